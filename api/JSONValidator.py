@@ -1,4 +1,6 @@
-from api.models import Manufacturer, Device
+from datetime import date
+from api.models import Manufacturer, Device, SPEC_KEYS, SPEC_OPERATORS, DEVICE_FIELDS
+from api.helpers import decode_cursor
 
 
 class Validator:
@@ -8,11 +10,16 @@ class Validator:
 
     def __init__(self):
         self.JSON_FUNCTIONS = {
-            'manufacturer': self.check_manuf_name,
-            'name': self.check_device_name,
+            'manufacturer': self.convert_name,
+            'name': self.convert_name,
             'limit': self.convert_limit,
             'offset': self.convert_offset,
-            'is_released': self.convert_is_released
+            'is_released': self.convert_is_released,
+            'cursor': self.convert_cursor,
+            'ids': self.convert_ids,
+            'specs': self.convert_specs,
+            'sort_by': self.convert_sort_by,
+            'fields': self.convert_fields
         }
 
     @classmethod
@@ -136,6 +143,35 @@ class Validator:
         '''
         return cls.convert_num(default=None, num=id)
 
+    @classmethod
+    def convert_ids(cls, ids=None) -> list or None:
+        ''' Converts a list of ids, or a comma separated string of ids, to a list of integers
+
+        Args:
+            ids: a list of ids, or a string such as "1,2,3"
+        Returns:
+            The ids as integers without duplicates, in the order given, or None if
+            any id cannot be converted
+
+        >>> convert_ids("3, 1,3")
+        [3, 1]
+        >>> convert_ids([7, "8"])
+        [7, 8]
+        >>> convert_ids("1,two") is None
+        True
+        '''
+        if type(ids) == str:
+            ids = [id.strip() for id in ids.split(',') if id.strip()]
+        if type(ids) != list:
+            return None
+
+        converted = []
+        for id in ids:
+            if not cls.check_convertable(id):
+                return None
+            converted.append(int(id))
+        return list(dict.fromkeys(converted))
+
     @classmethod
     def convert_is_released(cls, is_released: str = None) -> bool:
         ''' Converts a str or None to a boolean 
@@ -154,6 +190,134 @@ class Validator:
         '''
         return bool(is_released)
 
+    @classmethod
+    def convert_cursor(cls, cursor: str = None) -> dict or None:
+        ''' Converts an opaque pagination cursor to the sort keys it holds
+
+        Args:
+            cursor: a string returned as next_cursor by a list endpoint
+        Returns:
+            A dict with an integer id, and a release_date (date or None) if the
+            cursor has one, or None if the cursor cannot be converted
+
+        >>> convert_cursor(encode_cursor({'id': 7}))
+        {'id': 7}
+        >>> convert_cursor(encode_cursor({'release_date': '2021-01-29', 'id': 7}))
+        {'id': 7, 'release_date': datetime.date(2021, 1, 29)}
+        >>> convert_cursor('not-a-cursor') is None
+        True
+        '''
+        values = decode_cursor(cursor)
+        if not values or type(values.get('id')) is not int:
+            return None
+
+        converted = {'id': values['id']}
+        if 'release_date' in values:
+            release_date = values['release_date']
+            try:
+                converted['release_date'] = date.fromisoformat(
+                    release_date) if release_date is not None else None
+            except (TypeError, ValueError):
+                return None
+        return converted
+
+    @classmethod
+    def convert_specs(cls, specs: str = None) -> list or None:
+        ''' Converts a comma separated list of key:operator:value spec filters
+
+        Args:
+            specs: a string such as "battery_capacity:gte:5000,display_size:lte:6.5", where
+                each key is one of SPEC_KEYS and each operator is eq, gt, gte, lt or lte
+        Returns:
+            A list of (key, operator, value) tuples with float values, or None if any
+            filter cannot be converted
+
+        >>> convert_specs("battery_capacity:gte:5000, ram:eq:8")
+        [('battery_capacity', 'gte', 5000.0), ('ram', 'eq', 8.0)]
+        >>> convert_specs("battery_capacity:about:5000") is None
+        True
+        '''
+        if type(specs) != str:
+            return None
+
+        converted = []
+        for spec in specs.split(','):
+            parts = [part.strip() for part in spec.split(':')]
+            if len(parts) != 3 or parts[0] not in SPEC_KEYS or parts[1] not in SPEC_OPERATORS:
+                return None
+            try:
+                value = float(parts[2])
+            except ValueError:
+                return None
+            converted.append((parts[0], parts[1], value))
+        return converted
+
+    @classmethod
+    def convert_sort_by(cls, sort_by: str = None) -> tuple or None:
+        ''' Converts a spec key to sort by, descending if it starts with "-"
+
+        Args:
+            sort_by: a string such as "display_size" or "-battery_capacity"
+        Returns:
+            A (key, descending) tuple, or None if the key isn't one of SPEC_KEYS
+
+        >>> convert_sort_by("-battery_capacity")
+        ('battery_capacity', True)
+        >>> convert_sort_by("color") is None
+        True
+        '''
+        if type(sort_by) != str:
+            return None
+        sort_by = sort_by.strip()
+        key = sort_by.lstrip('-')
+        if key not in SPEC_KEYS:
+            return None
+        return (key, sort_by.startswith('-'))
+
+    @classmethod
+    def convert_fields(cls, fields: str = None) -> tuple or None:
+        ''' Converts a comma separated list of device fields to return
+
+        Args:
+            fields: a string such as "name,release_date", where each field is
+                one of DEVICE_FIELDS
+        Returns:
+            A tuple of the fields without duplicates, in the order they're
+            serialized, or None if any field isn't one of DEVICE_FIELDS
+
+        >>> convert_fields("release_date, name,name")
+        ('name', 'release_date')
+        >>> convert_fields("name,price") is None
+        True
+        '''
+        if type(fields) != str:
+            return None
+        requested = {field.strip() for field in fields.split(',') if field.strip()}
+        if not requested or not requested <= set(DEVICE_FIELDS):
+            return None
+        return tuple(field for field in DEVICE_FIELDS if field in requested)
+
+    @classmethod
+    def convert_name(cls, name: str = None) -> str or None:
+        ''' Converts a name filter to a trimmed string, without touching the DB.
+        Whether the name matches anything is checked by the model's query
+
+        Args:
+            name: a string that represents part of a manufacturer or device name
+        Returns:
+            name with surrounding whitespace removed, or None if name is not a non-empty string
+
+        >>> convert_name(" iPhone ")
+        'iPhone'
+        >>> convert_name("   ") is None
+        True
+        >>> convert_name(7) is None
+        True
+        '''
+        if type(name) != str or not name.strip():
+            return None
+        return name.strip()
+
     @classmethod
     def check_name(cls, name: str = None, model=None):
         ''' Checks if a name can matches the name
@@ -217,15 +381,11 @@ class Validator:
 
         for param in valid_params:
             initial_value = data.get(param)
-            new_value = self.JSON_FUNCTIONS[param](initial_value)
             if initial_value:
                 new_value = self.JSON_FUNCTIONS[param](initial_value)
                 # super janky way to check for the val 0 and not include False vals
                 if new_value or str(new_value) == '0':
-                    if param == 'limit' or param == 'is_released' or param == 'offset':
-                        json_data[param] = new_value
-                    else:
-                        json_data[param] = initial_value
+                    json_data[param] = new_value
                 else:
                     json_data[param] = None
             else:
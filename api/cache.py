@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from api.config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+
+
+class TTLCache:
+    '''
+    A bounded, thread-safe, in-process cache where every entry
+    expires after a time to live, and the least recently used entry
+    is evicted once the cache is full. Keeps hit and miss counters
+    '''
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not self.MISSING
+
+    def get(self, key, count: bool = True):
+        '''
+        Returns the value stored for key, or TTLCache.MISSING
+        if there is no entry or the entry has expired
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    if count:
+                        self.hits += 1
+                    return value
+                del self._entries[key]
+            if count:
+                self.misses += 1
+            return self.MISSING
+
+    def set(self, key, value, ttl: float = None):
+        '''
+        Stores value for key, for ttl seconds if given otherwise for
+        the cache's ttl, evicting the least recently used entry if full
+        '''
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        '''Removes the entry for key if there is one'''
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        '''Removes every entry'''
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        '''Returns the size of the cache and its hit and miss counters'''
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+# Serialized JSON bodies of the list endpoints, cleared whenever the
+# catalog changes in this process. Other processes (e.g. the offline
+# crawler) can't clear it, so entries also expire after the TTL
+response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
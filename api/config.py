@@ -8,3 +8,106 @@ INVALID_DATE_MAP = {
     '(Official)': '', 'Q1': 'January', 'Q2': 'April', 'Q3': 'July', 'Q4': 'October', 'Yes': 'January 1900'}
 
 UNRELEASED_YEAR = 5
+
+# Validated API keys are cached per worker, unknown keys for a shorter time
+# so a key created on another worker becomes usable quickly
+API_KEY_CACHE_SIZE = int(os.environ.get('API_KEY_CACHE_SIZE', 10000))
+API_KEY_CACHE_TTL = float(os.environ.get('API_KEY_CACHE_TTL', 300))
+API_KEY_NEGATIVE_CACHE_TTL = float(
+    os.environ.get('API_KEY_NEGATIVE_CACHE_TTL', 30))
+
+# Listing pages fetched per manufacturer, and how many are fetched at once
+DEVICE_PAGES = int(os.environ.get('DEVICE_PAGES', 5))
+SCRAPE_WORKERS = int(os.environ.get('SCRAPE_WORKERS', 8))
+
+MANUFACTURERS_URL = 'https://www.phonearena.com/phones/manufacturers'
+
+# Offline crawler: max requests per second to any one host (0 for no limit),
+# and how many devices' specs are written per transaction
+CRAWL_RATE_LIMIT = float(os.environ.get('CRAWL_RATE_LIMIT', 5))
+CRAWL_BATCH_SIZE = int(os.environ.get('CRAWL_BATCH_SIZE', 50))
+
+# BeautifulSoup parser for scraped pages, defaults to lxml if installed
+HTML_PARSER = os.environ.get('HTML_PARSER')
+
+# Per worker cache of serialized list responses, keyed by route and filters
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 60))
+
+# Most device ids one /api/get-devices-by-id request can look up
+MAX_IDS_PER_REQUEST = int(os.environ.get('MAX_IDS_PER_REQUEST', 500))
+
+# Devices fetched per round-trip while streaming the catalog export
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+
+# Specs also stored as numbers so devices can be filtered and sorted by them:
+# (category, spec name) -> (key, unit, regex for the number [and its unit])
+NUMERIC_SPECS = {
+    ('Display', 'Size'): ('display_size', 'in', r'(\d+(?:\.\d+)?)'),
+    ('Display', 'Refresh rate'): ('refresh_rate', 'Hz', r'(\d+(?:\.\d+)?)'),
+    ('Battery', 'Capacity'): ('battery_capacity', 'mAh', r'(\d+(?:\.\d+)?)'),
+    ('Battery', 'Charging speed'): ('charging_speed', 'W', r'(\d+(?:\.\d+)?)'),
+    ('Hardware', 'RAM'): ('ram', 'GB', r'(\d+(?:\.\d+)?)\s*(MB|GB|TB)'),
+    ('Hardware', 'Internal storage'): ('storage', 'GB', r'(\d+(?:\.\d+)?)\s*(MB|GB|TB)'),
+    ('Design', 'Weight'): ('weight', 'g', r'(\d+(?:\.\d+)?)\s*g\b'),
+    ('Buyers information', 'Price'): ('price', 'USD', r'\$\s*(\d+(?:\.\d+)?)')
+}
+
+# Converts a matched unit to the unit the spec is stored in
+SPEC_UNIT_SCALES = {'MB': 1 / 1024, 'GB': 1, 'TB': 1024}
+
+# Scraper HTTP client: seconds to connect and to read a page, retries of
+# failed requests with exponential backoff (FETCH_BACKOFF * 2^n seconds),
+# and where pages are cached with their ETag/Last-Modified ('' for no cache)
+FETCH_CONNECT_TIMEOUT = float(os.environ.get('FETCH_CONNECT_TIMEOUT', 5))
+FETCH_READ_TIMEOUT = float(os.environ.get('FETCH_READ_TIMEOUT', 30))
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', 3))
+FETCH_BACKOFF = float(os.environ.get('FETCH_BACKOFF', 0.5))
+FETCH_CACHE_DIR = os.environ.get('FETCH_CACHE_DIR', '.fetch_cache')
+
+# Incremental refresh: devices last fetched more than REFRESH_STALE_DAYS ago
+# (REFRESH_UNRELEASED_DAYS for unreleased devices) are refreshed, at most
+# REFRESH_LIMIT per run
+REFRESH_STALE_DAYS = float(os.environ.get('REFRESH_STALE_DAYS', 7))
+REFRESH_UNRELEASED_DAYS = float(os.environ.get('REFRESH_UNRELEASED_DAYS', 1))
+REFRESH_LIMIT = int(os.environ.get('REFRESH_LIMIT', 1000))
+
+# Failed device scrapes are retried up to SCRAPE_MAX_ATTEMPTS times, waiting
+# SCRAPE_RETRY_DELAY seconds after the first failure and doubling after
+# each one, up to SCRAPE_RETRY_MAX_DELAY seconds
+SCRAPE_MAX_ATTEMPTS = int(os.environ.get('SCRAPE_MAX_ATTEMPTS', 5))
+SCRAPE_RETRY_DELAY = float(os.environ.get('SCRAPE_RETRY_DELAY', 300))
+SCRAPE_RETRY_MAX_DELAY = float(os.environ.get('SCRAPE_RETRY_MAX_DELAY', 86400))
+
+# Connections each async worker (app/asgi.py) keeps open, and may open at most
+ASYNC_POOL_MIN_SIZE = int(os.environ.get('ASYNC_POOL_MIN_SIZE', 2))
+ASYNC_POOL_MAX_SIZE = int(os.environ.get('ASYNC_POOL_MAX_SIZE', 20))
+
+# Database connections per worker: DB_POOL_SIZE kept open plus up to
+# DB_MAX_OVERFLOW more under load, waiting at most DB_POOL_TIMEOUT seconds
+# for a free one. Connections are replaced after DB_POOL_RECYCLE seconds and
+# checked before use if DB_POOL_PRE_PING, so a failover doesn't leave dead
+# ones behind. Statements are cancelled after DB_STATEMENT_TIMEOUT ms (0 for never)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 10000))
+
+# Seconds after a write during which reads stay on the primary instead of
+# the read replica (DATABASE_REPLICA_URL), so they see the write
+REPLICA_STALENESS = float(os.environ.get('REPLICA_STALENESS', 5))
+
+# Each API key may make RATE_LIMIT requests per second (0 for no limit),
+# with bursts of up to RATE_LIMIT_BURST. The buckets are kept in a SQLite
+# file shared by the host's workers, on a RAM disk ('' to keep them per process)
+RATE_LIMIT = float(os.environ.get('RATE_LIMIT', 10))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 100))
+RATE_LIMIT_STORE = os.environ.get(
+    'RATE_LIMIT_STORE', '/dev/shm/grabaphone_rate_limits.sqlite3')
+
+# Requests per API key are counted in memory and written to the DB every
+# USAGE_FLUSH_SIZE requests or USAGE_FLUSH_INTERVAL seconds
+USAGE_FLUSH_SIZE = int(os.environ.get('USAGE_FLUSH_SIZE', 500))
+USAGE_FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL', 30))
@@ -0,0 +1,348 @@
+'''
+Offline crawler that fills the database with every manufacturer,
+device and spec on phonearena.com, without going through the
+webmaster routes.
+
+Pages are fetched by a bounded pool of worker threads, and every
+database write happens on the thread that called Crawler.run, so
+the workers never touch the session. Device pages that haven't
+changed since the last crawl (see api.fetch), or whose specs hash the
+same as last time, aren't written again. --refresh skips the listings
+and only re-fetches the devices that are unreleased, unscraped or stale.
+Device pages that fail are queued in scrape_failures, and retried with
+backoff by --retry-failures.
+
+Usage:
+    python -m api.crawler [--workers 8] [--rate 5] [--pages 5]
+                          [--batch-size 50] [--fixtures DIR]
+                          [--manufacturer NAME ...]
+    python -m api.crawler --refresh [--limit 1000] [--stale-days 7]
+    python -m api.crawler --retry-failures [--limit 1000] [--wait]
+'''
+import argparse
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from threading import Lock
+from urllib.parse import urlparse
+from app.database import db
+from api.fetch import Page, FetchError, DirectoryFetcher, make_fetcher
+from api.models import Manufacturer, Device, Spec, ScrapeFailure
+from api.parsing import parse_device_page, parse_device_listing, parse_manufacturer_info
+from api.config import MANUFACTURERS_URL, DEVICE_PAGES, SCRAPE_WORKERS, CRAWL_RATE_LIMIT, CRAWL_BATCH_SIZE, REFRESH_LIMIT, REFRESH_STALE_DAYS
+
+
+class HostRateLimiter:
+    '''
+    Spaces out requests to each host so that no host gets
+    more than {rate} requests per second
+    '''
+
+    def __init__(self, rate: float = CRAWL_RATE_LIMIT):
+        self.interval = 1 / rate if rate else 0
+        self._next_slot = {}
+        self._lock = Lock()
+
+    def delay(self, url: str) -> float:
+        '''
+        Reserves the next free slot for the url's host and returns
+        how many seconds the caller has to wait for it
+        '''
+        if not self.interval:
+            return 0
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        return slot - now
+
+    def wait(self, url: str):
+        '''Blocks until a request to the url's host is allowed'''
+        delay = self.delay(url)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HTTPFetcher:
+    '''
+    Fetches pages from the web within the rate limit of each host, through
+    a fetch client pooling a connection for each of {workers} threads
+    '''
+
+    def __init__(self, rate_limiter: HostRateLimiter = None, client=None, workers: int = SCRAPE_WORKERS):
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        self.client = client or make_fetcher(workers)
+
+    def fetch(self, url: str, conditional: bool = True) -> Page:
+        '''
+        Returns the page once the host's rate limit allows (see fetch.Fetcher.fetch).
+        Raises FetchError if the request times out, can't connect, or gets an
+        error status after the client's retries
+        '''
+        self.rate_limiter.wait(url)
+        return self.client.fetch(url, conditional=conditional)
+
+
+class Crawler:
+    '''
+    Crawls every manufacturer, their devices, and each device's specs
+    with {workers} fetch workers, writing specs {batch_size} devices
+    per transaction
+    '''
+
+    def __init__(self, fetcher=None, workers: int = SCRAPE_WORKERS, pages: int = DEVICE_PAGES,
+                 batch_size: int = CRAWL_BATCH_SIZE):
+        self.fetcher = fetcher or HTTPFetcher(workers=workers)
+        self.workers = workers
+        self.pages = pages
+        self.batch_size = batch_size
+        self.stats = {'manufacturers': 0, 'devices': 0,
+                      'specs': 0, 'unchanged': 0, 'failed': []}
+        self._device_ids = {}
+        self._failing = set()
+        self._batch = {}
+
+    def fetch_listings(self, manufacturer_id: int, url: str) -> tuple:
+        '''Worker job: fetches a manufacturer's device listing pages'''
+        listings = {}
+        urls = [url] + [url + f'/page/{i}' for i in range(1, self.pages)]
+        for page_url in urls:
+            try:
+                page = self.fetcher.fetch(page_url)
+            except FetchError:
+                break
+            for device_url, name in parse_device_listing(page.text):
+                listings.setdefault(device_url, name)
+        return ('listing', manufacturer_id, list(listings.items()))
+
+    def fetch_device_page(self, device_id: int, url: str, conditional: bool = True) -> tuple:
+        '''
+        Worker job: fetches and parses a device page, unless
+        conditional and the page hasn't changed since the last crawl
+        '''
+        try:
+            page = self.fetcher.fetch(url, conditional=conditional)
+        except FetchError as error:
+            return ('failed', device_id, error)
+        if not page.changed:
+            return ('unchanged', device_id, None)
+        return ('device', device_id, parse_device_page(page.text))
+
+    def write_manufacturers(self, info: list, names: list = None) -> list:
+        '''
+        Creates the manufacturers in info that don't exist yet (by url),
+        and returns every manufacturer to crawl
+        '''
+        existing = {url for url, in db.session.query(Manufacturer.url)}
+        for manuf in info:
+            if manuf['url'] not in existing:
+                existing.add(manuf['url'])
+                db.session.add(Manufacturer(**manuf))
+        db.session.commit()
+
+        manufacturers = Manufacturer.query.order_by(Manufacturer.id).all()
+        if names:
+            names = [name.lower() for name in names]
+            manufacturers = [m for m in manufacturers
+                             if any(name in m.name.lower() for name in names)]
+        self.stats['manufacturers'] = len(manufacturers)
+        return manufacturers
+
+    def write_devices(self, manufacturer_id: int, listings: list) -> list:
+        '''
+        Creates the listed devices that don't exist yet (by url), and
+        returns the (id, url, is_new) of every listed device
+        '''
+        new_devices = [Device(manufacturer_id=manufacturer_id, name=name, url=url)
+                       for url, name in listings if url not in self._device_ids]
+        db.session.add_all(new_devices)
+        db.session.flush()
+        for device in new_devices:
+            self._device_ids[device.url] = device.id
+        db.session.commit()
+
+        new_urls = {device.url for device in new_devices}
+        self.stats['devices'] += len(listings)
+        return [(self._device_ids[url], url, url in new_urls) for url, name in listings]
+
+    def write_specs(self, device_id: int, details: dict):
+        '''
+        Queues a device's parsed page to be written with the next batch,
+        unless its specs are the same as when it was last scraped
+        '''
+        device = Device.query.get(device_id)
+        specs = device.apply_details(details)
+        if specs is None:
+            self.write_failure(device, ScrapeFailure.NO_SPECS, 200)
+            return
+        self.resolve_failure(device_id)
+        if not device.update_content_hash(specs):
+            self.stats['unchanged'] += 1
+            return
+        self._batch[device_id] = specs
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def write_unchanged(self, device_id: int):
+        '''Records the fetch of a device page that hasn't changed'''
+        Device.query.get(device_id).mark_fetched(Device.SCRAPE_OK)
+        self.resolve_failure(device_id)
+        self.stats['unchanged'] += 1
+
+    def write_failure(self, device: Device, error_type: str, http_status: int = None):
+        '''Queues a device whose page couldn't be scraped to be retried'''
+        device.mark_fetched(Device.SCRAPE_FAILED)
+        ScrapeFailure.record(device, error_type, http_status)
+        self._failing.add(device.id)
+        self.stats['failed'].append(device.url)
+
+    def resolve_failure(self, device_id: int):
+        '''Removes a device that was scraped from the retry queue, if it was in it'''
+        if device_id in self._failing:
+            ScrapeFailure.resolve(device_id)
+            self._failing.discard(device_id)
+
+    def write_device_page(self, kind: str, device_id: int, result):
+        '''Writes the result of a fetch_device_page job'''
+        if kind == 'unchanged':
+            self.write_unchanged(device_id)
+        elif kind == 'failed':
+            self.write_failure(Device.query.get(device_id),
+                               result.error_type, result.http_status)
+        else:
+            self.write_specs(device_id, result)
+
+    def flush(self):
+        '''Writes the queued specs and device details in one transaction'''
+        if not self._batch:
+            db.session.commit()
+            return
+        self.stats['specs'] += sum(len(specs)
+                                   for specs in self._batch.values())
+        Spec.replace_all(self._batch)
+        self._batch = {}
+
+    def run(self, names: list = None) -> dict:
+        '''
+        Crawls the manufacturers matching names (or all of them), their
+        devices and specs, and returns the crawl's stats
+        '''
+        try:
+            info = parse_manufacturer_info(
+                self.fetcher.fetch(MANUFACTURERS_URL).text)
+        except FetchError:
+            info = []
+        manufacturers = self.write_manufacturers(info, names)
+        self._device_ids = dict(db.session.query(Device.url, Device.id))
+        self._failing = self.failing_device_ids()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self.fetch_listings, m.id, m.url)
+                       for m in manufacturers}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, id, result = future.result()
+                    if kind == 'listing':
+                        for device_id, url, is_new in self.write_devices(id, result):
+                            # New devices have nothing stored, so always need the full page
+                            pending.add(executor.submit(
+                                self.fetch_device_page, device_id, url, not is_new))
+                    else:
+                        self.write_device_page(kind, id, result)
+        self.flush()
+        return self.stats
+
+    def fetch_devices(self, devices: list):
+        '''Fetches the (id, url, conditional) devices' pages and writes them'''
+        self.stats['devices'] += len(devices)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.fetch_device_page, *device)
+                       for device in devices]
+            for future in as_completed(futures):
+                self.write_device_page(*future.result())
+        self.flush()
+
+    @staticmethod
+    def failing_device_ids() -> set:
+        '''Returns the ids of the devices in the retry queue'''
+        return {id for id, in db.session.query(ScrapeFailure.device_id)}
+
+    def refresh(self, limit: int = REFRESH_LIMIT, stale_days: float = REFRESH_STALE_DAYS) -> dict:
+        '''
+        Re-fetches only the devices due a refresh (see Device.refresh_candidates),
+        without crawling the manufacturer listings, and returns the crawl's stats
+        '''
+        devices = [(device.id, device.url, device.content_hash is not None)
+                   for device in Device.refresh_candidates(limit=limit, stale_days=stale_days)]
+        self._failing = self.failing_device_ids()
+        self.fetch_devices(devices)
+        return self.stats
+
+    def retry_failures(self, limit: int = REFRESH_LIMIT, wait: bool = False) -> dict:
+        '''
+        Retries up to {limit} failed device scrapes that are due (see
+        ScrapeFailure), and returns the crawl's stats. If wait, keeps
+        sleeping until the next retry is due, until every failure has
+        either been scraped or run out of attempts
+        '''
+        while True:
+            self._failing = self.failing_device_ids()
+            # Unconditional, a cached copy of a page that failed to parse won't help
+            self.fetch_devices([(failure.device_id, failure.url, False)
+                                for failure in ScrapeFailure.due(limit)])
+            next_due = ScrapeFailure.next_due()
+            if not wait or next_due is None:
+                return self.stats
+            time.sleep(max(0, (next_due - datetime.utcnow()).total_seconds()))
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description='Crawl phonearena.com into the grabaphone database')
+    parser.add_argument('--workers', type=int, default=SCRAPE_WORKERS,
+                        help='number of pages fetched at once')
+    parser.add_argument('--rate', type=float, default=CRAWL_RATE_LIMIT,
+                        help='max requests per second to one host (0 for no limit)')
+    parser.add_argument('--pages', type=int, default=DEVICE_PAGES,
+                        help='device listing pages crawled per manufacturer')
+    parser.add_argument('--batch-size', type=int, default=CRAWL_BATCH_SIZE,
+                        help='devices whose specs are written per transaction')
+    parser.add_argument('--fixtures', metavar='DIR',
+                        help='crawl a directory of saved html instead of the web')
+    parser.add_argument('--manufacturer', action='append', dest='names',
+                        help='only crawl manufacturers matching this name')
+    parser.add_argument('--refresh', action='store_true',
+                        help='only re-fetch unreleased, unscraped and stale devices')
+    parser.add_argument('--retry-failures', action='store_true',
+                        help='only retry the failed device scrapes that are due')
+    parser.add_argument('--wait', action='store_true',
+                        help='with --retry-failures, keep retrying until the queue is drained')
+    parser.add_argument('--limit', type=int, default=REFRESH_LIMIT,
+                        help='most devices re-fetched by --refresh or --retry-failures')
+    parser.add_argument('--stale-days', type=float, default=REFRESH_STALE_DAYS,
+                        help='days after which --refresh re-fetches a device')
+    args = parser.parse_args(argv)
+
+    if args.fixtures:
+        fetcher = DirectoryFetcher(args.fixtures)
+    else:
+        fetcher = HTTPFetcher(HostRateLimiter(args.rate), workers=args.workers)
+
+    crawler = Crawler(fetcher=fetcher, workers=args.workers,
+                      pages=args.pages, batch_size=args.batch_size)
+    if args.retry_failures:
+        stats = crawler.retry_failures(limit=args.limit, wait=args.wait)
+    elif args.refresh:
+        stats = crawler.refresh(limit=args.limit, stale_days=args.stale_days)
+    else:
+        stats = crawler.run(names=args.names)
+    print(f"Crawled {stats['manufacturers']} manufacturers, {stats['devices']} devices "
+          f"and {stats['specs']} specs, {stats['unchanged']} device pages unchanged "
+          f"and {len(stats['failed'])} failed")
+
+
+if __name__ == '__main__':
+    from app.app import app
+    main()
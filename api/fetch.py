@@ -0,0 +1,204 @@
+'''
+HTTP client shared by the scrapers.
+
+Pages are fetched through one pooled session with timeouts and retries,
+and pages that came with an ETag or Last-Modified header are cached on
+disk, so fetching them again is a conditional request that the server
+can answer with 304 Not Modified.
+
+The scrapers fetch through get_fetcher(), so tests (or the offline
+crawler) can swap in another fetcher, such as a DirectoryFetcher of
+saved pages, with set_fetcher().
+'''
+import gzip
+import hashlib
+import json
+import os
+import requests
+from collections import namedtuple
+from threading import Lock
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from api.config import SCRAPE_WORKERS, FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT, FETCH_RETRIES, FETCH_BACKOFF, FETCH_CACHE_DIR
+
+# A fetched page, where changed is False if the server said it hasn't
+# changed since it was cached
+Page = namedtuple('Page', ['url', 'text', 'changed'])
+
+_session = None
+_session_lock = Lock()
+_fetcher = None
+
+
+class FetchError(Exception):
+    '''
+    A page could not be fetched. error_type is http_error (with the
+    response's http_status), timeout or connection_error
+    '''
+
+    def __init__(self, url: str, error_type: str, http_status: int = None):
+        super().__init__(f'{error_type} fetching {url}' +
+                         (f' ({http_status})' if http_status else ''))
+        self.url = url
+        self.error_type = error_type
+        self.http_status = http_status
+
+
+def make_session(retries: int = FETCH_RETRIES, backoff: float = FETCH_BACKOFF,
+                 pool_size: int = SCRAPE_WORKERS) -> requests.Session:
+    '''
+    Returns a session whose pool holds {pool_size} connections, one for each
+    scrape worker, and that retries connection errors and failed responses
+    {retries} times with exponential backoff. 429s aren't retried, so the
+    caller's rate limit and failure queue decide when to ask again
+    '''
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET']), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    ''' Returns the requests session shared by the scrapers
+
+    The session keeps connections to phonearena.com alive between
+    requests (see make_session)
+    '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+    return _session
+
+
+class PageCache:
+    '''
+    On-disk cache of pages and their ETag/Last-Modified validators,
+    one gzipped JSON file per url under {root}
+    '''
+
+    def __init__(self, root: str = FETCH_CACHE_DIR):
+        self.root = root
+
+    def path_for(self, url: str) -> str:
+        '''Returns the path the page for url is cached at'''
+        return os.path.join(self.root, hashlib.sha1(url.encode()).hexdigest() + '.json.gz')
+
+    def get(self, url: str) -> dict or None:
+        '''Returns the cached etag, last_modified and text for url, or None'''
+        try:
+            with gzip.open(self.path_for(url), 'rt', encoding='utf-8') as entry:
+                return json.load(entry)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, url: str, etag: str, last_modified: str, text: str):
+        '''Caches the page for url, replacing the cached page atomically'''
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path_for(url)
+        temp = f'{path}.{os.getpid()}.tmp'
+        with gzip.open(temp, 'wt', encoding='utf-8') as entry:
+            json.dump({'etag': etag, 'last_modified': last_modified,
+                       'text': text}, entry)
+        os.replace(temp, path)
+
+
+class Fetcher:
+    '''
+    Fetches pages with the shared session, making conditional requests
+    for pages in {cache} (or plain requests if cache is None)
+    '''
+
+    def __init__(self, session: requests.Session = None, cache: PageCache = None,
+                 timeout: tuple = (FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT)):
+        self.session = session or get_session()
+        self.cache = cache
+        self.timeout = timeout
+
+    def fetch(self, url: str, conditional: bool = True) -> Page:
+        '''
+        Returns the page at url, or raises FetchError if it could not be fetched.
+        If conditional and the page is cached, the server is asked for it only
+        if it changed, and the cached page is returned with changed=False if not
+        '''
+        cached = self.cache.get(url) if self.cache and conditional else None
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        try:
+            response = self.session.get(
+                url, headers=headers, timeout=self.timeout)
+        except requests.Timeout:
+            raise FetchError(url, 'timeout')
+        except requests.RequestException:
+            raise FetchError(url, 'connection_error')
+
+        if response.status_code == 304 and cached:
+            return Page(url, cached['text'], False)
+        if response.status_code != 200:
+            raise FetchError(url, 'http_error', response.status_code)
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if self.cache and (etag or last_modified):
+            self.cache.set(url, etag, last_modified, response.text)
+        return Page(url, response.text, True)
+
+
+class DirectoryFetcher:
+    '''
+    Fetches pages from a directory of saved html, where the page for
+    https://host/a/b is stored at {root}/host/a/b.html
+    '''
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_for(self, url: str) -> str:
+        '''Returns the path the page for url is saved at'''
+        parsed = urlparse(url)
+        path = parsed.path.strip('/') or 'index'
+        return os.path.join(self.root, parsed.netloc, *path.split('/')) + '.html'
+
+    def fetch(self, url: str, conditional: bool = True) -> Page:
+        '''Returns the saved page, or raises FetchError (404) if it was not saved'''
+        try:
+            with open(self.path_for(url), encoding='utf-8') as page:
+                return Page(url, page.read(), True)
+        except FileNotFoundError:
+            raise FetchError(url, 'http_error', 404)
+
+
+def make_fetcher(workers: int = SCRAPE_WORKERS) -> Fetcher:
+    '''
+    Returns a Fetcher like get_fetcher's, but with its own session
+    pooling a connection for each of {workers} threads
+    '''
+    return Fetcher(session=make_session(pool_size=workers),
+                   cache=PageCache() if FETCH_CACHE_DIR else None)
+
+
+def get_fetcher():
+    '''Returns the fetcher the scrapers use, by default a cached Fetcher'''
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = Fetcher(cache=PageCache() if FETCH_CACHE_DIR else None)
+    return _fetcher
+
+
+def set_fetcher(fetcher):
+    '''
+    Makes the scrapers use fetcher (anything with a Fetcher's fetch
+    method, raising FetchError), or the default Fetcher again if fetcher is None
+    '''
+    global _fetcher
+    _fetcher = fetcher
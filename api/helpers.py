@@ -1,5 +1,52 @@
-from datetime import datetime, date
-from api.config import DATE_FORMATS, INVALID_DATE_MAP
+import base64
+import json
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from api.config import DATE_FORMATS, INVALID_DATE_MAP, NUMERIC_SPECS, SPEC_UNIT_SCALES
+
+
+# Month names as strptime's %B and %b match them (in the C locale)
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(MONTHS, start=1)}
+MONTH_NUMBERS.update({name[:3].lower(): number for number,
+                      name in enumerate(MONTHS, start=1)})
+
+# What each strptime directive in DATE_FORMATS matches, as strptime does
+DATE_DIRECTIVES = {
+    '%B': '(?P<month>' + '|'.join(MONTHS) + ')',
+    '%b': '(?P<month>' + '|'.join(name[:3] for name in MONTHS) + ')',
+    '%d': r'(?P<day>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])',
+    '%Y': r'(?P<year>\d{4})'
+}
+
+NO_DATE = date(1900, 1, 1)
+
+
+def compile_date_format(date_format: str):
+    ''' Compiles a strptime format into a regex matching the same strings
+
+    Args:
+        date_format: a format using only the directives in DATE_DIRECTIVES, such as %B %Y
+    Returns:
+        A case insensitive regex with month, day and year groups for the directives used
+    '''
+    pattern = ''
+    for part in re.split(r'(%[a-zA-Z]|\s+)', date_format):
+        if part in DATE_DIRECTIVES:
+            pattern += DATE_DIRECTIVES[part]
+        elif part.isspace():
+            pattern += r'\s+'
+        else:
+            pattern += re.escape(part)
+    return re.compile(pattern, re.IGNORECASE)
+
+
+DATE_PATTERNS = [compile_date_format(date_format)
+                 for date_format in DATE_FORMATS]
+INVALID_DATE_PATTERN = re.compile(
+    '|'.join(re.escape(invalid_date) for invalid_date in INVALID_DATE_MAP))
 
 
 def convert_to_date(date_str: str = None):
@@ -7,32 +54,61 @@ def convert_to_date(date_str: str = None):
     datetime dates
 
     Args:
-        date_str: a string that represents a date such as May 2015, or Nov 7th, 2020
+        date_str: a string that represents a date such as May 2015, or Nov 7th, 2020,
+            including the quarters and notes make_date_valid fixes
     Returns:
         A datetime.date object representing the given date, or January 1900 if no date was passed
     '''
     # If the date is null, we will push it to the back of results by setting to January 1900
     if not date_str or not type(date_str) == str:
-        return datetime.strptime('January 1900', '%B %Y').date()
+        return NO_DATE
+    return parse_date(date_str)
 
-    raw_date = None
-    date = None
 
-    for date_format in DATE_FORMATS:
+@lru_cache(maxsize=4096)
+def parse_date(date_str: str) -> date:
+    ''' Parses a date string with the first of DATE_FORMATS that it matches.
+    Only a few thousand distinct release dates exist, so results are cached
+
+    Args:
+        date_str: any string
+    Returns:
+        The date, or January 1900 if date_str doesn't match a format
+    '''
+    date_str = make_date_valid(date_str)
+    for pattern in DATE_PATTERNS:
+        match = pattern.fullmatch(date_str)
+        if not match:
+            continue
+        parts = match.groupdict()
+        month = MONTH_NUMBERS[parts['month'].lower()] if 'month' in parts else 1
         try:
-            raw_date = datetime.strptime(date_str, date_format)
+            return date(int(parts['year']), month, int(parts.get('day', 1)))
         except ValueError:
+            # Such as Feb 30th, which strptime rejects too
             continue
+    return NO_DATE
 
-    if raw_date:
-        date = raw_date.date()
-    else:
-        date = datetime.strptime('January 1900', '%B %Y').date()
 
-    return date
+def strptime_convert_to_date(date_str: str = None):
+    ''' The strptime loop parse_date replaced, which it must agree with.
+    Kept as the reference for the tests and benchmarks.bench_dates
 
+    Args:
+        date_str: a string already passed through make_date_valid
+    Returns:
+        The date of the last of DATE_FORMATS date_str matches, or January 1900
+    '''
+    if not date_str or not type(date_str) == str:
+        return NO_DATE
+    raw_date = None
+    for date_format in DATE_FORMATS:
+        try:
+            raw_date = datetime.strptime(date_str, date_format)
+        except ValueError:
+            continue
+    return raw_date.date() if raw_date else NO_DATE
 
-# CHECK IF NECESSARY ANYMORE
 
 def make_date_valid(date_str: str = None):
     ''' Turns invalid phonearena dates into dates that can be converted
@@ -46,10 +122,68 @@ def make_date_valid(date_str: str = None):
     if not date_str or type(date_str) != str:
         return None
 
-    for invalid_date, valid_date in INVALID_DATE_MAP.items():
-        if invalid_date in date_str:
-            date_str = date_str.replace(invalid_date, valid_date)
+    date_str = INVALID_DATE_PATTERN.sub(
+        lambda match: INVALID_DATE_MAP[match.group()], date_str)
+
+    return date_str.strip()
+
+
+def encode_cursor(values: dict) -> str:
+    ''' Encodes the sort keys of the last row of a page into
+    an opaque pagination cursor
+
+    Args:
+        values: a JSON serializable dict such as {'id': 5}
+    Returns:
+        A url safe string to pass back as the cursor param
+    '''
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str = None):
+    ''' Decodes a cursor made by encode_cursor
+
+    Args:
+        cursor: a string returned by encode_cursor
+    Returns:
+        The dict the cursor was made from, or None if the cursor is invalid
+    '''
+    if not cursor or type(cursor) != str:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    if type(values) != dict:
+        return None
+    return values
+
 
-    date_str = date_str.strip()
+def convert_spec_value(category: str = None, name: str = None, description: str = None) -> tuple:
+    ''' Converts a spec listed in NUMERIC_SPECS to a number
+
+    Args:
+        category: the spec's category, such as Battery
+        name: the spec's name, such as Capacity
+        description: the spec's description, such as 5000 mAh
+    Returns:
+        A (key, value, unit) tuple such as ('battery_capacity', 5000.0, 'mAh'),
+        or (None, None, None) if the spec isn't numeric or has no number
+    '''
+    if not category or not name or type(description) != str:
+        return (None, None, None)
+
+    for (spec_category, spec_name), (key, unit, pattern) in NUMERIC_SPECS.items():
+        if spec_category not in category or name != spec_name:
+            continue
+        match = re.search(pattern, description.replace(',', ''))
+        if not match:
+            return (None, None, None)
+        value = float(match.group(1))
+        if match.lastindex and match.lastindex > 1:
+            value *= SPEC_UNIT_SCALES[match.group(2)]
+        return (key, value, unit)
 
-    return date_str
+    return (None, None, None)
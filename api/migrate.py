@@ -0,0 +1,49 @@
+'''
+Applies the SQL files in migrations/ that haven't been applied yet,
+in filename order, recording each one in the schema_migrations table.
+
+Fresh databases made with db.create_all() already have the tables and
+indexes, and every migration is written to be safe to re-run on them.
+
+Usage:
+    python -m api.migrate
+'''
+import glob
+import os
+from app.database import db
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), 'migrations')
+
+
+def pending_migrations(applied: set) -> list:
+    '''Returns the paths of the migrations not in applied, in order'''
+    paths = sorted(glob.glob(os.path.join(MIGRATIONS_DIR, '*.sql')))
+    return [path for path in paths if os.path.basename(path) not in applied]
+
+
+def migrate() -> list:
+    '''Applies every pending migration, and returns their names'''
+    db.session.execute(
+        'CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at TIMESTAMP DEFAULT now())')
+    applied = {name for name, in db.session.execute(
+        'SELECT name FROM schema_migrations')}
+
+    names = []
+    for path in pending_migrations(applied):
+        name = os.path.basename(path)
+        # Backfills can run longer than the web's statement timeout
+        db.session.execute('SET LOCAL statement_timeout = 0')
+        with open(path) as migration:
+            db.session.execute(migration.read())
+        db.session.execute(
+            'INSERT INTO schema_migrations (name) VALUES (:name)', {'name': name})
+        db.session.commit()
+        names.append(name)
+    return names
+
+
+if __name__ == '__main__':
+    from app.app import app
+    for name in migrate():
+        print(f'Applied {name}')
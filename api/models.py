@@ -1,12 +1,58 @@
-import requests
 import os
-from bs4 import BeautifulSoup as bsoup
-from sqlalchemy import func, nullslast
+import operator
+import hashlib
+import json
+from sqlalchemy import nullslast, nullsfirst, and_, or_, case, exists, event, bindparam, DDL
+from sqlalchemy.orm import selectinload, aliased
 from typing import List
-from datetime import date
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from app.database import db
-from api.helpers import convert_to_date
-from api.config import UNRELEASED_YEAR
+from api.parsing import parse_device_page, parse_device_listing, parse_manufacturer_info, parse_rating, parse_image, parse_release_date
+from api.cache import TTLCache, response_cache
+from api.helpers import encode_cursor, convert_spec_value
+from api.fetch import FetchError, get_fetcher
+from api.config import UNRELEASED_YEAR, API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL, API_KEY_NEGATIVE_CACHE_TTL, DEVICE_PAGES, SCRAPE_WORKERS, MANUFACTURERS_URL, EXPORT_BATCH_SIZE, NUMERIC_SPECS, REFRESH_STALE_DAYS, REFRESH_UNRELEASED_DAYS, REFRESH_LIMIT, SCRAPE_MAX_ATTEMPTS, SCRAPE_RETRY_DELAY, SCRAPE_RETRY_MAX_DELAY
+
+
+#############
+#  Filters  #
+#############
+
+
+#####################################################################
+
+def name_filter(column, pattern: str, term: str):
+    '''
+    Returns a filter matching column against the ilike pattern. If no
+    row's column contains term at all, the pattern becomes '%', matching
+    every row, so a name that matches nothing doesn't narrow the results.
+    The check is an uncorrelated EXISTS inside the main query, which
+    Postgres runs once, and it only picks the pattern, so column ilike
+    pattern can still be answered from the trigram index
+    '''
+    # A separate alias keeps the check uncorrelated from the main query
+    # and out of reach of aliased joins on the same model
+    other = getattr(aliased(column.class_), column.key)
+    matches = exists().where(other.ilike(fr'%{term}%'))
+    return column.ilike(case([(matches, pattern)], else_='%'))
+
+
+# Keys of the specs stored as numbers, and the comparisons they can be filtered by
+SPEC_KEYS = {key for key, unit, pattern in NUMERIC_SPECS.values()}
+SPEC_OPERATORS = {
+    'eq': operator.eq,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le
+}
+
+# Fields of a serialized device, in the order they're serialized
+DEVICE_FIELDS = ('id', 'manufacturer', 'name', 'rating',
+                 'release_date', 'image_url', 'device_url', 'specs')
+
+#####################################################################
 
 
 ###################
@@ -22,15 +68,56 @@ class APIKey(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     key = db.Column(db.String(12), unique=True, nullable=False)
+    # Usage, added in batches by api/ratelimit.py's UsageCounter
+    request_count = db.Column(db.Integer, nullable=False,
+                              default=0, server_default='0')
+    last_used = db.Column(db.DateTime)
+
+    # Results of validate, including unknown keys, so repeat requests skip the DB
+    cache = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
 
     def __repr__(self):
         return f'<APIKey #{self.id}: {self.key}>'
 
     @classmethod
     def validate(cls, key: str):
-        if not cls.query.filter_by(key=key).first():
+        '''
+        Returns whether key is a valid API Key, checking the
+        in-process cache before the DB
+        '''
+        if not key or type(key) != str:
             return False
-        return True
+
+        is_valid = cls.cache.get(key)
+        if is_valid is TTLCache.MISSING:
+            is_valid = cls.remember(key, cls.key_query(key).first() is not None)
+        return is_valid
+
+    @classmethod
+    def key_query(cls, key: str):
+        '''Returns the query for the API Key with value key'''
+        return cls.query.filter_by(key=key).limit(1)
+
+    @classmethod
+    def remember(cls, key: str, is_valid: bool) -> bool:
+        '''Caches whether key is valid, unknown keys for a shorter time, and returns is_valid'''
+        ttl = None if is_valid else API_KEY_NEGATIVE_CACHE_TTL
+        cls.cache.set(key, is_valid, ttl=ttl)
+        return is_valid
+
+    @classmethod
+    def add_usage(cls, usage: dict):
+        '''
+        Adds {key: (requests, last used)} to the keys' request counts and
+        last used times, in one transaction on its own connection so the
+        current session is left alone
+        '''
+        statement = cls.__table__.update().where(cls.key == bindparam('api_key')).values(
+            request_count=cls.request_count + bindparam('requests'),
+            last_used=db.func.greatest(cls.last_used, bindparam('used')))
+        with db.engine.begin() as connection:
+            connection.execute(statement, [{'api_key': key, 'requests': requests, 'used': used}
+                                           for key, (requests, used) in usage.items()])
 
     # Considering removing this altogether and just adding the key when user clicks generate
     @classmethod
@@ -39,6 +126,8 @@ class APIKey(db.Model):
         new_key = cls(key=key)
         db.session.add(new_key)
         db.session.commit()
+        # Drop any negative entry left from before the key existed
+        cls.cache.invalidate(key)
         return new_key
 
     @classmethod
@@ -101,49 +190,77 @@ class Manufacturer(db.Model):
             'image_url': self.image_url
         }
 
-    def scrape_devices(self):
+    def page_urls(self, pages: int = DEVICE_PAGES) -> List[str]:
         '''
-        Scrapes 5 pages of devices by the current manufacturer
-        instance from phonearena.com, and returns a list of
-        dicts with the device name, url, and manuf id
+        Returns the urls of the first {pages} device listing
+        pages for the manufacturer
         '''
-        raw_devices = []
-        devices = []
-        url = self.url
+        return [self.url] + [self.url + f'/page/{i}' for i in range(1, pages)]
 
+    @staticmethod
+    def fetch_device_listing(url: str) -> List[tuple]:
+        '''
+        Fetches a device listing page with the shared fetcher and
+        returns its devices, or an empty list if the page is missing
+        '''
+        try:
+            page = get_fetcher().fetch(url)
+        except FetchError:
+            return []
+        return parse_device_listing(page.text)
+
+    def scrape_devices(self, pages: int = DEVICE_PAGES, workers: int = SCRAPE_WORKERS):
+        '''
+        Scrapes {pages} pages of devices by the current manufacturer
+        instance from phonearena.com, {workers} pages at a time, and
+        returns a list of dicts with the device name, url, and manuf id
+        '''
         # The first 5 pages is most recent 180 devices
-        for i in range(5):
-            response = requests.get(url)
-            if response.status_code != 200:
-                break
-            container = bsoup(response.text, 'html.parser').find(
-                id='finder-results')
-            current_devices = container.find_all('div', class_='stream-item')
-            raw_devices = list(set(raw_devices).union(current_devices))
-            url = self.url + f'/page/{i+1}'
+        urls = self.page_urls(pages)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(urls)))) as executor:
+            listings = executor.map(self.fetch_device_listing, urls)
+
+            # Pages can overlap, so devices are unique by url, keeping page order
+            raw_devices = {}
+            for listing in listings:
+                for url, name in listing:
+                    raw_devices.setdefault(url, name)
 
-        for device in raw_devices:
-            name = device.find('p', class_='title').text
-            url = device.a['href']
-            devices.append({'name': name, 'url': url, 'manuf_id': self.id})
+        return [{'name': name, 'url': url, 'manuf_id': self.id}
+                for url, name in raw_devices.items()]
 
-        return devices
+    def cursor(self) -> str:
+        '''Returns the cursor for the page of manufacturers after this one'''
+        return encode_cursor({'id': self.id})
 
     @classmethod
-    def get(cls, manufacturer: str = None, offset: int = 0, limit: int = 100):
+    def get(cls, manufacturer: str = None, offset: int = 0, limit: int = 100, cursor: dict = None):
         '''
         Gets the manufacturers with the given name and/or all up
-        to the limit (defaults to 100) and returns them
+        to the limit (defaults to 100) and returns them, ordered by id.
+        If a cursor is given, starts after the manufacturer it was made from
         '''
-        manufs = None
+        return cls.list_query(manufacturer=manufacturer, offset=offset, limit=limit, cursor=cursor).all()
+
+    @classmethod
+    def list_query(cls, manufacturer: str = None, offset: int = 0, limit: int = 100, cursor: dict = None):
+        '''Returns the query get runs, without running it'''
+        query = cls.query
 
         if manufacturer:
-            manufs = cls.query.filter(cls.name.ilike(
-                fr'%{manufacturer}%')).offset(offset).limit(limit).all()
-        else:
-            manufs = cls.query.offset(offset).limit(limit).all()
+            query = query.filter(name_filter(cls.name, fr'%{manufacturer}%', manufacturer))
+        if cursor:
+            query = query.filter(cls.id > cursor['id'])
+
+        return query.order_by(cls.id).offset(offset).limit(limit)
 
-        return manufs
+    @classmethod
+    def project(cls, query):
+        '''
+        Returns query selecting the manufacturers' columns as plain rows,
+        which serialize and cursor work on as Manufacturer.serialize(row)
+        '''
+        return query.with_entities(*[column.label(column.key) for column in cls.__table__.columns])
 
     @classmethod
     def create(cls, name: str, url: str, image_url: str) -> 'Manufacturer':
@@ -151,6 +268,7 @@ class Manufacturer(db.Model):
         new_manuf = cls(name=name, url=url, image_url=image_url)
         db.session.add(new_manuf)
         db.session.commit()
+        response_cache.clear()
         return new_manuf
 
     @classmethod
@@ -159,16 +277,11 @@ class Manufacturer(db.Model):
         Sends a GET request to phonearena.com/manufacturers
         and returns a list of all the names of the manufacturers
         '''
-        info = []
-        url = 'https://www.phonearena.com/phones/manufacturers'
-        response = requests.get(url)
-        page = bsoup(response.text, 'html.parser')
-        divs = page.find_all('div', class_='manufacturer-item')
-
-        for manuf in divs:
-            info.append({'name': manuf.span.text,
-                         'url': manuf.a['href'], 'image_url': manuf.img['src']})
-        return info
+        try:
+            page = get_fetcher().fetch(MANUFACTURERS_URL)
+        except FetchError:
+            return []
+        return parse_manufacturer_info(page.text)
 
     @classmethod
     def create_all(cls):
@@ -182,6 +295,7 @@ class Manufacturer(db.Model):
             url = manuf['url']
             image_url = manuf['image_url']
             cls.create(name=name, url=url, image_url=image_url)
+        response_cache.clear()
 
 #####################################################################
 
@@ -199,16 +313,24 @@ class Device(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     manufacturer_id = db.Column(db.Integer, db.ForeignKey(
-        'manufacturers.id', ondelete='CASCADE'), nullable=False)
+        'manufacturers.id', ondelete='CASCADE'), nullable=False, index=True)
     name = db.Column(db.Text, nullable=False)
     rating = db.Column(db.Float)
     release_date = db.Column(db.Date)
     image = db.Column(db.Text)
     url = db.Column(db.Text, nullable=False)
+    # Crawl metadata: when the page was last fetched, a hash of its specs,
+    # and whether the last scrape worked (None if never scraped)
+    last_fetched = db.Column(db.DateTime, index=True)
+    content_hash = db.Column(db.Text)
+    scrape_status = db.Column(db.Text)
 
     manufacturer = db.relationship('Manufacturer')
     specs = db.relationship('Spec')
 
+    SCRAPE_OK = 'ok'
+    SCRAPE_FAILED = 'failed'
+
     def __repr__(self):
         return f'<Device #{self.id}: {self.manufacturer} {self.name}>'
 
@@ -227,174 +349,347 @@ class Device(db.Model):
 
         return categories
 
+    @staticmethod
+    def serialize_release_date(release_date: date) -> str or None:
+        '''Returns release_date for JSON, or None for the unreleased placeholder'''
+        year = date.today().year + UNRELEASED_YEAR
+        return str(release_date).replace(
+            '00:00:00 GMT', '').strip() if release_date and release_date != date(year, 12, 31) else None
+
     def serialize(self):
         '''
         Returns a dictionary with the device's information,
         and a dict of their specs, for converting to JSON
         '''
-
-        year = date.today().year + UNRELEASED_YEAR
-
         return {
             'id': self.id,
             'manufacturer': self.manufacturer.name,
             'name': self.name,
             'rating': self.rating,
-            'release_date':  str(self.release_date).replace(
-                '00:00:00 GMT', '').strip() if self.release_date and self.release_date != date(year, 12, 31) else None,
+            'release_date': self.serialize_release_date(self.release_date),
             'image_url': self.image,
             'device_url': self.url,
 
             'specs': self.serialize_specs()
         }
 
+    @classmethod
+    def project(cls, query, fields: tuple):
+        '''
+        Returns query selecting only the columns of fields (see DEVICE_FIELDS)
+        as plain rows instead of Devices, plus the id and release date that
+        cursors are made from. Specs aren't columns, see serialize_rows
+        '''
+        columns = {'name': cls.name, 'rating': cls.rating,
+                   'image_url': cls.image, 'device_url': cls.url}
+        selected = [cls.id.label('id'), cls.release_date.label('release_date')]
+        if 'manufacturer' in fields:
+            # Its own alias, so it doesn't clash with the manufacturer filter's join
+            maker = aliased(Manufacturer)
+            query = query.join(maker, cls.manufacturer_id == maker.id)
+            selected.append(maker.name.label('manufacturer'))
+        selected += [columns[field].label(field)
+                     for field in fields if field in columns]
+        return query.with_entities(*selected)
+
+    @classmethod
+    def serialize_rows(cls, rows: list, fields: tuple, specs: dict = None) -> List[dict]:
+        '''
+        Returns dictionaries with only the fields of rows from project, for
+        converting to JSON. If fields has specs, they're taken from specs
+        (as Spec.serialize_for returns them) or loaded in one query
+        '''
+        if specs is None:
+            specs = Spec.serialize_for([row.id for row in rows]) if 'specs' in fields else {}
+        serialized = []
+        for row in rows:
+            device = {}
+            for field in fields:
+                if field == 'specs':
+                    device['specs'] = specs.get(row.id, {})
+                elif field == 'release_date':
+                    device['release_date'] = cls.serialize_release_date(row.release_date)
+                else:
+                    device[field] = getattr(row, field)
+            serialized.append(device)
+        return serialized
+
     def get_rating(self, page):
         '''
         Gets the user rating for a device off the given
         page if available
         '''
-        raw_rating = None
-        try:
-            raw_rating = page.find('a', class_='widgetRating__phonearena').find(
-                'div', class_='score').find_all(text=True, recursive=False)
-        except AttributeError:
-            try:
-                raw_rating = page.find('a', class_='widgetRating__user').find(
-                    'div', class_='score').find_all(text=True, recursive=False)
-            except AttributeError:
-                raw_rating = [None]
-        rating = " ".join(str(raw_rating[0]).split())
-        try:
-            self.rating = float(rating)
-        except ValueError:
-            self.rating = None
-        return
+        self.rating = parse_rating(page)
 
     def get_image(self, page):
         '''
         Gets the device image for a device off the given
         page if available
         '''
-        try:
-            img = page.find('picture', class_='portrait').find(
-                'noscript').find('img')
-            img_link = img.attrs['src']
-            self.image = img_link
-        except AttributeError:
-            # No Image Found
-            pass
-
-        return
+        image = parse_image(page)
+        if image:
+            self.image = image
 
     def get_release_date(self, page):
         '''
         Gets the release date of a device if available, otherwise
         sets it to either the end of the current year, or None
         '''
-        try:
-            div = page.find('a', class_='widgetQuickSpecs__link calendar')
-            header = div.find('h5', class_='widgetQuickSpecs__title_heading')
-            value = div.find('p', class_='widgetQuickSpecs__title_paragraph').find_all(
-                text=True, recursive=False)
-            release_date = str(value[0])
-            if release_date == 'No information':
-                # Temporary solution for devices that don't have an expected release date
-                # Make the relase date the last day of the year 5 years from now
-                release_date = f'Dec 31, {date.today().year + UNRELEASED_YEAR}'
-            self.release_date = convert_to_date(release_date)
-        except:
-            self.release_date = None
+        self.release_date = parse_release_date(page)
+
+    def mark_fetched(self, status: str):
+        '''Records that the device page was just fetched, with the scrape's status'''
+        self.last_fetched = datetime.utcnow()
+        self.scrape_status = status
+
+    @staticmethod
+    def hash_content(content: dict) -> str:
+        '''Returns a hash of a device page's parsed content'''
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def update_content_hash(self, specs: List[dict]) -> bool:
+        '''
+        Stores the hash of the device's newly parsed specs, rating, image and
+        release date, and returns whether any of them changed since they were
+        last stored, so the specs and the cached responses need replacing
+        '''
+        content_hash = self.hash_content({'specs': specs, 'rating': self.rating,
+                                          'image': self.image, 'release_date': self.release_date})
+        changed = content_hash != self.content_hash
+        self.content_hash = content_hash
+        return changed
+
+    def apply_details(self, details: dict) -> List[dict]:
+        '''
+        Sets the rating, image and release date of the device from
+        its parsed page (see parsing.parse_device_page), records the
+        fetch, and returns the page's specs
+        '''
+        self.rating = details['rating']
+        if details['image']:
+            self.image = details['image']
+        self.release_date = details['release_date']
+        self.mark_fetched(
+            self.SCRAPE_OK if details['specs'] is not None else self.SCRAPE_FAILED)
+        return details['specs']
 
     def scrape_specs(self) -> List['Spec']:
         '''
         Scrapes all the specs for a device from the
-        device page and creates the specs for the device
-        '''
-        response = requests.get(self.url)
-        page = bsoup(response.text, 'html.parser')
-        if not page:
-            # For testing which urls fail specs so we can see why
-            with open('spec_failed.txt', 'a') as specFile:
-                specFile.write(self.url)
+        device page and replaces the specs for the device.
+        Skips writing the specs if the page hasn't changed
+        since the device was last scraped. Failures are
+        queued for retry (see ScrapeFailure)
+        '''
+        try:
+            page = get_fetcher().fetch(
+                self.url, conditional=self.content_hash is not None)
+        except FetchError as error:
+            self.mark_fetched(self.SCRAPE_FAILED)
+            ScrapeFailure.record(self, error.error_type, error.http_status)
+            db.session.commit()
             return
 
-        self.get_rating(page)
-        self.get_image(page)
-        self.get_release_date(page)
+        if not page.changed:
+            self.mark_fetched(self.SCRAPE_OK)
+            ScrapeFailure.resolve(self.id)
+            db.session.commit()
+            return
 
-        try:
-            spec_groups = page.find(
-                'div', class_='widgetSpecs').find_all('section')
-        except AttributeError:
-            # For testing which urls fail specs so we can see why
-            with open('spec_failed.txt', 'a') as specFile:
-                specFile.write(self.url)
+        specs = self.apply_details(parse_device_page(page.text))
+        if specs is None:
+            ScrapeFailure.record(self, ScrapeFailure.NO_SPECS, 200)
+            db.session.commit()
             return
 
-        for group in spec_groups:
-            category = " ".join(str(group.h3.text).split())
-            specs = group.tbody.find_all('tr')
-            for spec in specs:
-                name = " ".join(str(spec.th.text).split())
-                description = " ".join(str(spec.td.text).split())
-                if 'Display' in category and 'Size:' in name:
-                    # Remove " inches" from display size
-                    description = description[:len(description) - 7]
-                name = name.replace(':', '')
-                new_spec = Spec.create(
-                    device_id=self.id, category=category, name=name, description=description)
-        db.session.commit()
+        ScrapeFailure.resolve(self.id)
+        if not self.update_content_hash(specs):
+            db.session.commit()
+            return
+        Spec.replace_all({self.id: specs})
+
+    @classmethod
+    def refresh_candidates(cls, limit: int = REFRESH_LIMIT, stale_days: float = REFRESH_STALE_DAYS,
+                           unreleased_days: float = REFRESH_UNRELEASED_DAYS) -> List['Device']:
+        '''
+        Returns up to {limit} devices to refresh, in order: unreleased devices
+        (including those given the UNRELEASED_YEAR placeholder date) last fetched
+        more than {unreleased_days} days ago, devices never scraped, then devices
+        last fetched more than {stale_days} days ago, least recently fetched first.
+        Devices whose last scrape failed are left to the retry queue (see ScrapeFailure)
+        '''
+        now = datetime.utcnow()
+        unreleased = and_(cls.release_date > date.today(),
+                          cls.last_fetched < now - timedelta(days=unreleased_days))
+        never_scraped = cls.last_fetched.is_(None)
+        stale = cls.last_fetched < now - timedelta(days=stale_days)
+        priority = case([(unreleased, 0), (never_scraped, 1)], else_=2)
+        not_failed = or_(cls.scrape_status.is_(None),
+                         cls.scrape_status != cls.SCRAPE_FAILED)
+        return cls.query.filter(or_(unreleased, never_scraped, stale), not_failed).order_by(
+            priority, nullsfirst(cls.last_fetched.asc()), cls.id).limit(limit).all()
+
+    @classmethod
+    def eager_options(cls):
+        '''
+        Returns loader options that fetch the manufacturers and specs
+        of a page of devices in one extra query each, instead of one
+        query per device when serializing
+        '''
+        return (selectinload(cls.manufacturer), selectinload(cls.specs))
+
+    def cursor(self, latest: bool = False) -> str:
+        '''
+        Returns the cursor for the page of devices after this one,
+        from get_latest if latest is True, otherwise from get. Also
+        works on rows from project, as Device.cursor(row)
+        '''
+        if latest:
+            return encode_cursor({'release_date': self.release_date, 'id': self.id})
+        return encode_cursor({'id': self.id})
+
+    @classmethod
+    def latest_after(cls, cursor: dict):
+        '''
+        Returns the filter for the devices that come after the cursor
+        when ordered by release date (newest first, nulls last), then id
+        '''
+        if cursor['release_date'] is None:
+            return and_(cls.release_date.is_(None), cls.id > cursor['id'])
+        return or_(cls.release_date < cursor['release_date'],
+                   and_(cls.release_date == cursor['release_date'],
+                        cls.id > cursor['id']),
+                   cls.release_date.is_(None))
 
     @classmethod
-    def get_latest(cls, manufacturer: str = None, name: str = None, offset: int = 0, limit: int = 100, is_released: bool = False):
+    def filter_specs(cls, query, specs: list = None):
+        '''
+        Filters query to the devices whose numeric specs match every
+        (key, operator, value) in specs, such as ('battery_capacity', 'gte', 5000)
+        '''
+        for key, op, value in specs or []:
+            query = query.filter(cls.specs.any(
+                and_(Spec.key == key, SPEC_OPERATORS[op](Spec.value, value))))
+        return query
+
+    @classmethod
+    def sort_by_spec(cls, query, key: str, descending: bool = False):
+        '''
+        Orders query by the devices' numeric spec {key}, devices
+        without the spec last
+        '''
+        spec = aliased(Spec)
+        order = spec.value.desc() if descending else spec.value.asc()
+        return query.outerjoin(spec, and_(spec.device_id == cls.id, spec.key == key)).order_by(nullslast(order))
+
+    @classmethod
+    def filtered(cls, manufacturer: str = None, name: str = None, is_released: bool = False,
+                 specs: list = None, exact_manufacturer: bool = False):
+        '''
+        Returns a query for the devices matching only the filters given: made by
+        a manufacturer whose name contains manufacturer (or matches it, if
+        exact_manufacturer), whose name contains name, released before today,
+        and whose numeric specs match specs (see filter_specs)
+        '''
+        query = cls.query
+        if manufacturer:
+            pattern = manufacturer if exact_manufacturer else fr'%{manufacturer}%'
+            query = query.join(Manufacturer, cls.manufacturer_id == Manufacturer.id).filter(
+                name_filter(Manufacturer.name, pattern, manufacturer))
+        if name:
+            query = query.filter(name_filter(cls.name, fr'%{name}%', name))
+        if is_released:
+            # Compared as is (not through func.date) so the index can be used
+            query = query.filter(cls.release_date < date.today())
+        return cls.filter_specs(query, specs)
+
+    @classmethod
+    def get_latest(cls, manufacturer: str = None, name: str = None, offset: int = 0, limit: int = 100, is_released: bool = False, eager: bool = False, cursor: dict = None, specs: list = None, sort_by: tuple = None, fields: tuple = None):
         '''
         Gets 100 latest devices with the given manufacturer, that match the given name,
-        serializes and then returns them
-        '''
-
-        # Gotta find a way to get outta this IF hell
-        if manufacturer and name and is_released:
-            return cls.query.join(Device.manufacturer, aliased=True).filter(Manufacturer.name.ilike(fr'%{manufacturer}%')).filter(Device.name.ilike(fr'%{name}%')).filter(
-                func.date(Device.release_date) < date.today()).order_by(nullslast(Device.release_date.desc())).offset(offset).limit(limit).all()
-        elif manufacturer and name:
-            return cls.query.join(Device.manufacturer, aliased=True).filter(Manufacturer.name.ilike(fr'%{manufacturer}%')).filter(
-                Device.name.ilike(fr'%{name}%')).order_by(nullslast(Device.release_date.desc())).offset(offset).limit(limit).all()
-        elif name and is_released:
-            return cls.query.filter(Device.name.ilike(fr'%{name}%')).filter(func.date(Device.release_date) < date.today(
-            )).order_by(nullslast(Device.release_date.desc())).offset(offset).limit(limit).all()
-        elif name:
-            return cls.query.filter(Device.name.ilike(
-                fr'%{name}%')).order_by(nullslast(Device.release_date.desc())).offset(offset).limit(limit).all()
-        elif manufacturer and is_released:
-            return cls.query.join(Device.manufacturer, aliased=True).filter(Manufacturer.name.ilike(fr'%{manufacturer}%')).filter(func.date(
-                Device.release_date) < date.today()).order_by(nullslast(Device.release_date.desc())).offset(offset).limit(limit).all()
-        elif manufacturer:
-            return cls.query.join(Device.manufacturer, aliased=True).filter(
-                Manufacturer.name.ilike(fr'%{manufacturer}%')).order_by(nullslast(Device.release_date.desc())).offset(offset).limit(limit).all()
-        elif is_released:
-            return cls.query.filter(func.date(Device.release_date) < date.today()).order_by(nullslast(
-                Device.release_date.desc())).order_by(Device.release_date.desc()).offset(offset).limit(limit).all()
-
-        return cls.query.order_by(nullslast(Device.release_date.desc())).order_by(
-            Device.release_date.desc()).offset(offset).limit(limit).all()
+        serializes and then returns them. If eager is True the manufacturers and specs
+        are loaded up front for serializing. If a cursor is given, starts after the
+        device it was made from. specs and sort_by filter and order the devices by
+        their numeric specs (see filter_specs and sort_by_spec), and replace the cursor.
+        If fields is given, returns rows of only those fields instead (see project)
+        '''
+        return cls.latest_query(manufacturer=manufacturer, name=name, offset=offset, limit=limit, is_released=is_released,
+                                eager=eager, cursor=cursor, specs=specs, sort_by=sort_by, fields=fields).all()
 
-    @ classmethod
-    def get(cls, manufacturer: str = None, name: str = None, offset: int = 0, limit: int = 100):
+    @classmethod
+    def latest_query(cls, manufacturer: str = None, name: str = None, offset: int = 0, limit: int = 100, is_released: bool = False, eager: bool = False, cursor: dict = None, specs: list = None, sort_by: tuple = None, fields: tuple = None):
+        '''Returns the query get_latest runs, without running it'''
+        query = cls.filtered(manufacturer=manufacturer, name=name,
+                             is_released=is_released, specs=specs)
+
+        if sort_by:
+            # Sorting by a spec comes before the release date, and pages by offset
+            query = cls.sort_by_spec(query, *sort_by)
+        elif cursor and 'release_date' in cursor:
+            query = query.filter(cls.latest_after(cursor))
+        # Devices released on the same day are ordered by id so pages don't overlap
+        query = query.order_by(nullslast(cls.release_date.desc()), cls.id)
+
+        if fields:
+            query = cls.project(query, fields)
+        elif eager:
+            query = query.options(*cls.eager_options())
+
+        return query.offset(offset).limit(limit)
+
+    @classmethod
+    def get(cls, manufacturer: str = None, name: str = None, offset: int = 0, limit: int = 100, eager: bool = False, cursor: dict = None, specs: list = None, sort_by: tuple = None, fields: tuple = None):
         '''
         Gets {limit} devices with the given manufacturer, that match the given name,
-        serializes and then returns them
+        serializes and then returns them, ordered by id. If eager is True the manufacturers
+        and specs are loaded up front for serializing. If a cursor is given, starts after
+        the device it was made from. specs and sort_by filter and order the devices by
+        their numeric specs (see filter_specs and sort_by_spec), and replace the cursor.
+        If fields is given, returns rows of only those fields instead (see project)
+        '''
+        return cls.list_query(manufacturer=manufacturer, name=name, offset=offset, limit=limit,
+                              eager=eager, cursor=cursor, specs=specs, sort_by=sort_by, fields=fields).all()
+
+    @classmethod
+    def list_query(cls, manufacturer: str = None, name: str = None, offset: int = 0, limit: int = 100, eager: bool = False, cursor: dict = None, specs: list = None, sort_by: tuple = None, fields: tuple = None):
+        '''Returns the query get runs, without running it'''
+        query = cls.filtered(manufacturer=manufacturer, name=name,
+                             specs=specs, exact_manufacturer=True)
+
+        if sort_by:
+            query = cls.sort_by_spec(query, *sort_by)
+        elif cursor:
+            query = query.filter(cls.id > cursor['id'])
+        query = query.order_by(cls.id)
+
+        if fields:
+            query = cls.project(query, fields)
+        elif eager:
+            query = query.options(*cls.eager_options())
+
+        return query.offset(offset).limit(limit)
+
+    @classmethod
+    def get_by_ids(cls, ids: List[int]) -> List['Device']:
+        '''
+        Gets the devices with the given ids in one query, with their
+        manufacturers and specs loaded, in the order of ids. Ids with
+        no device are skipped
         '''
-        if manufacturer and name:
-            return cls.query.join(Device.manufacturer, aliased=True).filter(Manufacturer.name.ilike(
-                manufacturer)).filter(Device.name.ilike(fr'%{name}%')).offset(offset).limit(limit).all()
-        elif name:
-            return cls.query.filter(Device.name.ilike(
-                fr'%{name}%')).offset(offset).limit(limit).all()
-        elif manufacturer:
-            return cls.query.join(Device.manufacturer, aliased=True).filter(
-                Manufacturer.name.ilike(manufacturer)).offset(offset).limit(limit).all()
+        devices = cls.query.filter(cls.id.in_(ids)).options(
+            *cls.eager_options()).all()
+        by_id = {device.id: device for device in devices}
+        return [by_id[id] for id in ids if id in by_id]
 
-        return cls.query.offset(offset).limit(limit).all()
+    @classmethod
+    def stream_all(cls, batch_size: int = EXPORT_BATCH_SIZE):
+        '''
+        Yields every device ordered by id, with its manufacturer and specs,
+        reading {batch_size} devices at a time from a server-side cursor
+        so memory use stays flat however big the catalog is
+        '''
+        return cls.query.order_by(cls.id).options(*cls.eager_options()).execution_options(
+            stream_results=True).yield_per(batch_size)
 
     @ classmethod
     def create(cls, name: str, manufacturer_id: int, url: str) -> 'Device':
@@ -402,8 +697,14 @@ class Device(db.Model):
         device = cls(manufacturer_id=manufacturer_id, name=name, url=url)
         db.session.add(device)
         db.session.commit()
+        response_cache.clear()
         return device
 
+
+# Serves get_latest's order (and its cursors) straight from the index
+db.Index('ix_devices_release_date_id', nullslast(
+    Device.release_date.desc()), Device.id)
+
 #####################################################################
 
 
@@ -424,9 +725,17 @@ class Spec(db.Model):
     category = db.Column(db.Text, nullable=False)
     name = db.Column(db.Text, nullable=False)
     description = db.Column(db.Text, nullable=False)
+    # The description as a number, for the specs in NUMERIC_SPECS
+    key = db.Column(db.Text)
+    value = db.Column(db.Float)
+    unit = db.Column(db.Text)
 
     device = db.relationship('Device')
 
+    __table_args__ = (
+        db.Index('ix_specs_key_value', 'key', 'value', 'device_id'),
+    )
+
     def __repr__(self):
         return f'<Spec #{self.id}: {self.device.name} - {self.name}: {self.description}>'
 
@@ -437,13 +746,180 @@ class Spec(db.Model):
             'description': self.description
         }
 
+    @classmethod
+    def serialize_for(cls, device_ids: List[int]) -> dict:
+        '''
+        Returns the serialized specs of each device in device_ids, by device
+        id, grouped by category as in Device.serialize_specs. Reads plain
+        rows in one query rather than loading Spec instances
+        '''
+        return cls.group_serialized(cls.serialized_query(device_ids))
+
+    @classmethod
+    def serialized_query(cls, device_ids: List[int]):
+        '''Returns the query for the (device_id, category, name, description) of the devices' specs'''
+        return db.session.query(cls.device_id, cls.category, cls.name, cls.description).filter(
+            cls.device_id.in_(device_ids)).order_by(cls.device_id, cls.id)
+
+    @staticmethod
+    def group_serialized(rows) -> dict:
+        '''Groups rows from serialized_query as serialize_for returns them'''
+        specs = {}
+        for device_id, category, name, description in rows:
+            specs.setdefault(device_id, {}).setdefault(category, []).append(
+                {'name': name, 'description': description})
+        return specs
+
     @ classmethod
     def create(cls, device_id: int, category: str, name: str, description: str) -> 'Spec':
         '''Create a new Spec'''
-        new_spec = cls(device_id=device_id, category=category,
-                       name=name, description=description)
+        key, value, unit = convert_spec_value(category, name, description)
+        new_spec = cls(device_id=device_id, category=category, name=name,
+                       description=description, key=key, value=value, unit=unit)
         db.session.add(new_spec)
         db.session.commit()
+        response_cache.clear()
         return new_spec
 
+    @classmethod
+    def replace_all(cls, specs_by_device: dict):
+        '''
+        Replaces the specs of every device in specs_by_device, a dict of
+        device id to a list of spec dicts (category, name, description),
+        with one delete and one bulk insert in a single transaction. Numeric
+        specs get their key, value and unit (see helpers.convert_spec_value)
+        '''
+        if not specs_by_device:
+            return
+
+        rows = []
+        for device_id, specs in specs_by_device.items():
+            keys = set()
+            for spec in specs:
+                key, value, unit = convert_spec_value(
+                    spec.get('category'), spec.get('name'), spec.get('description'))
+                if key in keys:
+                    # One value per key, so sorting by a spec can't repeat a device
+                    key, value, unit = (None, None, None)
+                keys.add(key)
+                rows.append({'device_id': device_id, **spec,
+                             'key': key, 'value': value, 'unit': unit})
+        try:
+            cls.query.filter(cls.device_id.in_(list(specs_by_device))).delete(
+                synchronize_session=False)
+            db.session.bulk_insert_mappings(cls, rows)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        response_cache.clear()
+
+#####################################################################
+
+
+##########################
+#  Scrape Failure Model  #
+##########################
+
+
+#####################################################################
+
+class ScrapeFailure(db.Model):
+    '''
+    A device page that couldn't be scraped, queued to be retried
+    at next_attempt_at (see Crawler.retry_failures)
+    '''
+    __tablename__ = 'scrape_failures'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    device_id = db.Column(db.Integer, db.ForeignKey(
+        'devices.id', ondelete='CASCADE'), nullable=False, unique=True)
+    url = db.Column(db.Text, nullable=False)
+    # http_error, timeout, connection_error (see fetch.FetchError) or no_specs
+    error_type = db.Column(db.Text, nullable=False)
+    http_status = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, nullable=False, default=1)
+    last_attempt_at = db.Column(db.DateTime, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, index=True)
+
+    device = db.relationship('Device')
+
+    # The page was fetched but had no spec table
+    NO_SPECS = 'no_specs'
+
+    def __repr__(self):
+        return f'<ScrapeFailure #{self.id}: {self.url} {self.error_type} x{self.attempts}>'
+
+    @staticmethod
+    def retry_delay(attempts: int) -> timedelta:
+        '''Returns how long to wait after the {attempts}th failure'''
+        return timedelta(seconds=min(SCRAPE_RETRY_DELAY * 2 ** (attempts - 1), SCRAPE_RETRY_MAX_DELAY))
+
+    @classmethod
+    def record(cls, device: Device, error_type: str, http_status: int = None) -> 'ScrapeFailure':
+        '''
+        Records a failed scrape of device, scheduling the next attempt
+        with exponential backoff, or none once it has failed
+        SCRAPE_MAX_ATTEMPTS times. Committed by the caller
+        '''
+        now = datetime.utcnow()
+        failure = cls.query.filter_by(device_id=device.id).first()
+        if failure is None:
+            failure = cls(device_id=device.id, attempts=0)
+            db.session.add(failure)
+        failure.url = device.url
+        failure.error_type = error_type
+        failure.http_status = http_status
+        failure.attempts += 1
+        failure.last_attempt_at = now
+        failure.next_attempt_at = now + cls.retry_delay(
+            failure.attempts) if failure.attempts < SCRAPE_MAX_ATTEMPTS else None
+        return failure
+
+    @classmethod
+    def resolve(cls, device_id: int):
+        '''Removes device_id from the queue after a successful scrape'''
+        cls.query.filter_by(device_id=device_id).delete(
+            synchronize_session=False)
+
+    @classmethod
+    def due(cls, limit: int = REFRESH_LIMIT) -> List['ScrapeFailure']:
+        '''Returns up to {limit} failures due a retry, longest waiting first'''
+        return cls.query.filter(cls.next_attempt_at <= datetime.utcnow()).order_by(
+            cls.next_attempt_at, cls.id).limit(limit).all()
+
+    @classmethod
+    def next_due(cls) -> datetime or None:
+        '''Returns when the next retry is due, or None if there are none left'''
+        return db.session.query(db.func.min(cls.next_attempt_at)).scalar()
+
+#####################################################################
+
+
+####################
+#  Search Indexes  #
+####################
+
+
+#####################################################################
+
+def has_pg_trgm(ddl, target, bind, **kwargs) -> bool:
+    '''
+    Checks if the DB can use the pg_trgm extension, which backs
+    the ilike name filters with trigram indexes
+    '''
+    if bind.dialect.name != 'postgresql':
+        return False
+    return bind.execute(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").scalar() is not None
+
+
+# Mirrors migrations/001_trigram_name_indexes.sql for tables made by db.create_all()
+for searchable in (Manufacturer.__table__, Device.__table__):
+    event.listen(searchable, 'after_create', DDL(
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(callable_=has_pg_trgm))
+    event.listen(searchable, 'after_create', DDL(
+        f'CREATE INDEX IF NOT EXISTS ix_{searchable.name}_name_trgm ON {searchable.name} '
+        'USING gin (name gin_trgm_ops)').execute_if(callable_=has_pg_trgm))
+
 #####################################################################
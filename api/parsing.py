@@ -0,0 +1,207 @@
+'''
+Parsers for phonearena.com pages.
+
+Each page is parsed once, and only the widgets the scrapers read are
+kept (using a SoupStrainer), so the finders search a few small
+subtrees instead of the whole document. lxml is used when it is
+installed, otherwise the pure python html.parser.
+'''
+from bs4 import BeautifulSoup as bsoup, SoupStrainer
+from datetime import date
+from typing import List
+from api.helpers import convert_to_date
+from api.config import UNRELEASED_YEAR, HTML_PARSER
+
+try:
+    import lxml
+    PARSER = HTML_PARSER or 'lxml'
+except ImportError:
+    PARSER = HTML_PARSER or 'html.parser'
+
+
+# (tag, class) of every widget read off a device page
+DEVICE_WIDGETS = {
+    ('a', 'widgetRating__phonearena'),
+    ('a', 'widgetRating__user'),
+    ('picture', 'portrait'),
+    ('a', 'widgetQuickSpecs__link'),
+    ('div', 'widgetSpecs')
+}
+
+
+def is_device_widget(name: str, attrs: dict = None) -> bool:
+    ''' Checks if a tag is one of the DEVICE_WIDGETS
+
+    Args:
+        name: the tag's name
+        attrs: the tag's attributes, as passed to a SoupStrainer
+    Returns:
+        True if the tag and any of its classes match a device widget
+    '''
+    if not attrs:
+        return False
+    classes = dict(attrs).get('class') or ''
+    if type(classes) == str:
+        classes = classes.split()
+    return any((name, cls) in DEVICE_WIDGETS for cls in classes)
+
+
+DEVICE_PAGE_STRAINER = SoupStrainer(is_device_widget)
+LISTING_STRAINER = SoupStrainer(id='finder-results')
+MANUFACTURERS_STRAINER = SoupStrainer('div', class_='manufacturer-item')
+
+
+def parse(html: str, strainer: SoupStrainer = None) -> bsoup:
+    ''' Parses html with the fastest available parser
+
+    Args:
+        html: the page's html
+        strainer: a SoupStrainer for the parts of the page to keep, or None for all
+    Returns:
+        The parsed page
+    '''
+    return bsoup(html, PARSER, parse_only=strainer)
+
+
+def parse_rating(page) -> float or None:
+    ''' Gets the phonearena rating, or else the user rating, off a device page
+
+    Args:
+        page: a parsed device page
+    Returns:
+        The rating as a float, or None if the page has no rating
+    '''
+    raw_rating = [None]
+    for widget in ('widgetRating__phonearena', 'widgetRating__user'):
+        try:
+            raw_rating = page.find('a', class_=widget).find(
+                'div', class_='score').find_all(text=True, recursive=False)
+            break
+        except AttributeError:
+            continue
+    rating = " ".join(str(raw_rating[0]).split())
+    try:
+        return float(rating)
+    except ValueError:
+        return None
+
+
+def parse_image(page) -> str or None:
+    ''' Gets the device image url off a device page
+
+    Args:
+        page: a parsed device page
+    Returns:
+        The image url, or None if the page has no image
+    '''
+    try:
+        return page.find('picture', class_='portrait').find(
+            'noscript').find('img').attrs['src']
+    except (AttributeError, KeyError):
+        # No Image Found
+        return None
+
+
+def parse_release_date(page) -> date or None:
+    ''' Gets the release date off a device page
+
+    Args:
+        page: a parsed device page
+    Returns:
+        The release date, the last day of the year UNRELEASED_YEAR years from now
+        if the device has no release date yet, or None if the page has no release date
+    '''
+    try:
+        div = page.find('a', class_='widgetQuickSpecs__link calendar')
+        value = div.find('p', class_='widgetQuickSpecs__title_paragraph').find_all(
+            text=True, recursive=False)
+        release_date = str(value[0])
+        if release_date == 'No information':
+            # Temporary solution for devices that don't have an expected release date
+            # Make the relase date the last day of the year 5 years from now
+            release_date = f'Dec 31, {date.today().year + UNRELEASED_YEAR}'
+        return convert_to_date(release_date)
+    except:
+        return None
+
+
+def parse_specs(page) -> List[dict] or None:
+    ''' Parses the spec table off a device page
+
+    Args:
+        page: a parsed device page
+    Returns:
+        A list of dicts with the category, name and description of each spec,
+        or None if the page has no spec table
+    '''
+    try:
+        spec_groups = page.find(
+            'div', class_='widgetSpecs').find_all('section')
+    except AttributeError:
+        return None
+
+    parsed = []
+    for group in spec_groups:
+        category = " ".join(str(group.h3.text).split())
+        specs = group.tbody.find_all('tr')
+        for spec in specs:
+            name = " ".join(str(spec.th.text).split())
+            description = " ".join(str(spec.td.text).split())
+            if 'Display' in category and 'Size:' in name:
+                # Remove " inches" from display size
+                description = description[:len(description) - 7]
+            name = name.replace(':', '')
+            parsed.append(
+                {'category': category, 'name': name, 'description': description})
+    return parsed
+
+
+def parse_device_page(html: str) -> dict:
+    ''' Parses everything the API stores off a device page in one pass
+
+    Args:
+        html: a device page's html
+    Returns:
+        A dict with the device's rating, image, release_date and specs (see parse_specs)
+    '''
+    page = parse(html, DEVICE_PAGE_STRAINER)
+    return {
+        'rating': parse_rating(page),
+        'image': parse_image(page),
+        'release_date': parse_release_date(page),
+        'specs': parse_specs(page)
+    }
+
+
+def parse_device_listing(html: str) -> List[tuple]:
+    ''' Parses a manufacturer's device listing page
+
+    Args:
+        html: a device listing page's html
+    Returns:
+        A list of (url, name) tuples for every device on the page
+    '''
+    container = parse(html, LISTING_STRAINER).find(id='finder-results')
+    if not container:
+        return []
+
+    devices = []
+    for device in container.find_all('div', class_='stream-item'):
+        name = device.find('p', class_='title').text
+        devices.append((device.a['href'], name))
+    return devices
+
+
+def parse_manufacturer_info(html: str) -> List[dict]:
+    ''' Parses phonearena's manufacturers page
+
+    Args:
+        html: the manufacturers page's html
+    Returns:
+        A list of dicts with the name, url and image url of every manufacturer
+    '''
+    info = []
+    for manuf in parse(html, MANUFACTURERS_STRAINER).find_all('div', class_='manufacturer-item'):
+        info.append({'name': manuf.span.text,
+                     'url': manuf.a['href'], 'image_url': manuf.img['src']})
+    return info
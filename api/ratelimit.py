@@ -0,0 +1,187 @@
+'''
+Per API key rate limiting and usage accounting.
+
+Each key has a token bucket holding up to RATE_LIMIT_BURST requests and
+refilled at RATE_LIMIT requests per second; a request that finds it
+empty is answered 429. The buckets are kept in a store: a SQLiteStore
+on a RAM disk that every gunicorn worker on the host opens, so a key's
+limit holds across workers, or a MemoryStore, per process (and in tests).
+
+Requests served per key are counted in memory by a UsageCounter and
+added to api_keys.request_count and last_used in one batch every
+USAGE_FLUSH_SIZE requests or USAGE_FLUSH_INTERVAL seconds, from a
+background thread so no request waits on the write.
+'''
+import atexit
+import os
+import sqlite3
+import time
+from datetime import datetime
+from threading import Lock, Thread
+from sqlalchemy.exc import SQLAlchemyError
+from api.models import APIKey
+from api.config import RATE_LIMIT, RATE_LIMIT_BURST, RATE_LIMIT_STORE, USAGE_FLUSH_SIZE, USAGE_FLUSH_INTERVAL
+
+
+def take_token(bucket: tuple, rate: float, burst: int, now: float) -> tuple:
+    '''
+    Refills bucket, (tokens, updated) or None for a new full one, up to
+    now and takes a token. Returns the tokens left, and the seconds until
+    a token is available (0 if one was taken)
+    '''
+    tokens, updated = bucket or (burst, now)
+    tokens = min(burst, tokens + max(now - updated, 0) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryStore:
+    '''Token buckets kept in this process'''
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = Lock()
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        '''Takes a token from key's bucket, returning the seconds to wait if there's none'''
+        with self._lock:
+            tokens, wait = take_token(
+                self._buckets.get(key), rate, burst, now)
+            self._buckets[key] = (tokens, now)
+        return wait
+
+
+class SQLiteStore:
+    '''
+    Token buckets kept in a SQLite database, shared by every process that
+    opens the same path. Each bucket is updated in an immediate transaction,
+    so processes take tokens one at a time
+    '''
+
+    def __init__(self, path: str, timeout: float = 5):
+        self.path = path
+        self.timeout = timeout
+        self._connection = None
+        self._pid = None
+        self._lock = Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        # Forked workers can't share the parent's connection
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.execute('PRAGMA synchronous = OFF')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self._pid = os.getpid()
+        return self._connection
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        '''
+        Takes a token from key's bucket, returning the seconds to wait if there's
+        none. If the store stays locked for {timeout} seconds or can't be written,
+        the request is let through rather than failed
+        '''
+        with self._lock:
+            try:
+                return self._take(key, rate, burst, now)
+            except sqlite3.OperationalError:
+                return 0.0
+
+    def _take(self, key: str, rate: float, burst: int, now: float) -> float:
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            bucket = connection.execute(
+                'SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, wait = take_token(bucket, rate, burst, now)
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+            connection.execute('COMMIT')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        return wait
+
+
+class RateLimiter:
+    '''Token bucket rate limit per key, of rate requests per second in bursts of up to burst'''
+
+    def __init__(self, store, rate: float = RATE_LIMIT, burst: int = RATE_LIMIT_BURST):
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+
+    def check(self, key: str) -> float:
+        '''Counts a request by key, returning 0 if it's allowed, otherwise the seconds to wait'''
+        if not self.rate:
+            return 0.0
+        # Wall clock time, the same in every process
+        return self.store.take(key, self.rate, self.burst, time.time())
+
+
+class UsageCounter:
+    '''Requests per key counted in memory and flushed to the DB in batches'''
+
+    def __init__(self, flush_size: int = USAGE_FLUSH_SIZE, flush_interval: float = USAGE_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self._usage = {}
+        self._last_flush = time.monotonic()
+        self._flushing = None
+        self._lock = Lock()
+
+    def record(self, key: str) -> bool:
+        '''Counts a request by key, returning whether it's time to flush'''
+        with self._lock:
+            requests, _ = self._usage.get(key, (0, None))
+            self._usage[key] = (requests + 1, datetime.utcnow())
+            self.pending += 1
+            return (self.pending >= self.flush_size or
+                    time.monotonic() - self._last_flush >= self.flush_interval)
+
+    def flush(self):
+        '''
+        Adds the counted requests to the DB. If that fails they're kept
+        and added to the next flush
+        '''
+        with self._lock:
+            usage, self._usage = self._usage, {}
+            self.pending = 0
+            self._last_flush = time.monotonic()
+        if not usage:
+            return
+        try:
+            APIKey.add_usage(usage)
+        except SQLAlchemyError:
+            with self._lock:
+                for key, (requests, used) in usage.items():
+                    pending, last_used = self._usage.get(key, (0, used))
+                    self._usage[key] = (requests + pending, max(used, last_used))
+                    self.pending += requests
+
+    def flush_in_background(self) -> Thread:
+        '''
+        Flushes in a daemon thread, out of the request's way, returning it.
+        Returns None if a flush is already running, which picks up the counts
+        '''
+        with self._lock:
+            if self._flushing and self._flushing.is_alive():
+                return None
+            self._flushing = Thread(target=self.flush, daemon=True)
+            self._flushing.start()
+            return self._flushing
+
+
+# Shared with the host's other workers if RATE_LIMIT_STORE's directory exists
+store = SQLiteStore(RATE_LIMIT_STORE) if RATE_LIMIT_STORE and os.path.isdir(
+    os.path.dirname(RATE_LIMIT_STORE)) else MemoryStore()
+rate_limiter = RateLimiter(store)
+
+usage = UsageCounter()
+# Counts left when the worker exits
+atexit.register(usage.flush)
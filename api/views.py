@@ -1,13 +1,31 @@
-from flask import render_template, request, jsonify, abort, make_response
+from flask import g, render_template, request, jsonify, abort, make_response, Response, stream_with_context
 from app.app import app
 from app.database import db
-from api.config import MASTER_KEY
+from app.profiling import timed
+from api.config import MASTER_KEY, MAX_IDS_PER_REQUEST, EXPORT_BATCH_SIZE
 from api.models import APIKey, Manufacturer, Device, Spec
 from api.JSONValidator import Validator
+from api.cache import TTLCache, response_cache
+from api.ratelimit import rate_limiter, usage
 from functools import wraps
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+import hashlib
+import json
+import math
+import zlib
 
 jsonValidator = Validator()
 
+# SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+# Params each list route accepts (also served by app/asgi.py)
+MANUFACTURER_PARAMS = ['manufacturer', 'offset', 'limit', 'cursor']
+LATEST_DEVICE_PARAMS = ['manufacturer', 'name', 'offset', 'limit',
+                        'is_released', 'cursor', 'specs', 'sort_by', 'fields']
+DEVICE_PARAMS = ['manufacturer', 'name', 'offset',
+                 'limit', 'cursor', 'specs', 'sort_by', 'fields']
+
 
 # TODO
 # 1. Finish tests
@@ -22,7 +40,7 @@ jsonValidator = Validator()
 
 
 def api_key_required(f):
-    '''Decorator to validate API Key'''
+    '''Decorator to validate API Key, and rate limit and count its requests'''
     @wraps(f)
     def decorated_func(*args, **kwargs):
         data = None
@@ -36,6 +54,15 @@ def api_key_required(f):
                 {'message': 'API Key invalid!', 'status': 401})
             response = make_response(json_response, 401)
             abort(response)
+        wait = rate_limiter.check(key)
+        if wait:
+            json_response = jsonify(
+                {'message': 'Rate limit exceeded!', 'status': 429})
+            response = make_response(json_response, 429)
+            response.headers['Retry-After'] = str(math.ceil(wait))
+            abort(response)
+        if usage.record(key):
+            usage.flush_in_background()
         return f(*args, **kwargs)
     return decorated_func
 
@@ -57,6 +84,85 @@ def master_key_required(f):
         return f(*args, **kwargs)
     return decorated_func
 
+
+def read_replica(f):
+    '''
+    Decorator to run a read only route's queries on the read replica, if
+    one is configured (see RoutingSession). Goes below api_key_required, so
+    keys are checked on the primary and new keys work right away
+    '''
+    @wraps(f)
+    def decorated_func(*args, **kwargs):
+        g.read_replica = True
+        return f(*args, **kwargs)
+    return decorated_func
+
+#####################################################################
+
+#############
+#  Helpers  #
+#############
+
+#####################################################################
+
+
+def cached_response(filters: dict, build):
+    '''
+    Returns the JSON response for the current route and filters, from the
+    response cache if possible, otherwise from the data returned by build().
+    Responds 304 with no body if the client's If-None-Match is still current
+    '''
+    key = (request.endpoint, json.dumps(filters, sort_keys=True, default=str))
+    cached = response_cache.get(key)
+    if cached is TTLCache.MISSING:
+        data = build()
+        with timed('serialize'):
+            body = jsonify(data).get_data()
+        cached = (body, hashlib.sha1(body).hexdigest())
+        response_cache.set(key, cached)
+
+    body, etag = cached
+    response = app.response_class(
+        body, mimetype=app.config['JSONIFY_MIMETYPE'])
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+def serialize_devices(devices: list, fields: tuple = None) -> list:
+    '''
+    Serializes Devices, or the rows of only the given fields that
+    Device.get and Device.get_latest return when fields are asked for
+    '''
+    if fields:
+        return Device.serialize_rows(devices, fields)
+    return [device.serialize() for device in devices]
+
+#####################################################################
+
+####################
+#  Error Handlers  #
+####################
+
+#####################################################################
+
+
+@app.errorhandler(OperationalError)
+@app.errorhandler(PoolTimeoutError)
+def database_unavailable(error):
+    '''
+    Responds 503 when a statement ran past DB_STATEMENT_TIMEOUT, no pooled
+    connection freed up within DB_POOL_TIMEOUT, or the DB can't be reached,
+    so the worker is freed and the client can retry
+    '''
+    db.session.rollback()
+    timed_out = isinstance(error, PoolTimeoutError) or getattr(
+        error.orig, 'pgcode', None) == QUERY_CANCELED
+    json_response = jsonify(
+        {'message': 'Request timed out!' if timed_out else 'Database unavailable!', 'status': 503})
+    response = make_response(json_response, 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
 #####################################################################
 
 ####################
@@ -89,24 +195,28 @@ def generate_api_key():
 
 @app.route('/api/get-manufacturers', methods=['GET'])
 @api_key_required
+@read_replica
 def get_manufacturers():
     '''Get manufacturers'''
 
-    filters = jsonValidator.sanitize_json(data=request.args, valid_params=[
-                                          'manufacturer', 'offset', 'limit'])
-
-    print(filters)
+    filters = jsonValidator.sanitize_json(data=request.args, valid_params=MANUFACTURER_PARAMS)
 
     manufacturer = filters['manufacturer']
     offset = filters['offset']
     limit = filters['limit']
+    cursor = filters['cursor']
 
-    manufacturers = Manufacturer.get(
-        manufacturer=manufacturer, offset=offset, limit=limit)
+    def build():
+        manufacturers = Manufacturer.get(
+            manufacturer=manufacturer, offset=offset, limit=limit, cursor=cursor)
+        with timed('serialize'):
+            serialized_manufacturers = [manuf.serialize()
+                                        for manuf in manufacturers]
+        next_cursor = manufacturers[-1].cursor() if len(
+            manufacturers) == limit else None
+        return {'Manufacturers': serialized_manufacturers, 'next_cursor': next_cursor}
 
-    serialized_manufacturers = [manuf.serialize() for manuf in manufacturers]
-    response = jsonify({'Manufacturers': serialized_manufacturers})
-    return (response, 200)
+    return cached_response(filters, build)
 
 #####################################################################
 
@@ -116,47 +226,129 @@ def get_manufacturers():
 
 @app.route('/api/get-latest-devices')
 @api_key_required
+@read_replica
 def get_latest_devices():
     '''
     Get latest devices
     '''
-    filters = jsonValidator.sanitize_json(data=request.args, valid_params=[
-                                          'manufacturer', 'name', 'offset', 'limit', 'is_released'])
+    filters = jsonValidator.sanitize_json(data=request.args, valid_params=LATEST_DEVICE_PARAMS)
 
     manufacturer = filters['manufacturer']
     name = filters['name']
     offset = filters['offset']
     limit = filters['limit']
     is_released = filters['is_released']
+    cursor = filters['cursor']
+    specs = filters['specs']
+    sort_by = filters['sort_by']
+    fields = filters['fields']
 
-    devices = Device.get_latest(
-        manufacturer=manufacturer, name=name, offset=offset, limit=limit, is_released=is_released)
-    serialized_devices = [device.serialize() for device in devices]
-    response = jsonify({'Devices': serialized_devices})
-    return (response, 200)
+    def build():
+        devices = Device.get_latest(
+            manufacturer=manufacturer, name=name, offset=offset, limit=limit, is_released=is_released, eager=True, cursor=cursor, specs=specs, sort_by=sort_by, fields=fields)
+        with timed('serialize'):
+            serialized_devices = serialize_devices(devices, fields)
+        # Spec sorted pages are paged by offset
+        next_cursor = Device.cursor(devices[-1], latest=True) if len(
+            devices) == limit and not sort_by else None
+        return {'Devices': serialized_devices, 'next_cursor': next_cursor}
+
+    return cached_response(filters, build)
 
 
 @app.route('/api/get-devices', methods=['GET'])
 @api_key_required
+@read_replica
 def get_devices():
     '''
     Get devices
     '''
 
-    filters = jsonValidator.sanitize_json(data=request.args, valid_params=[
-                                          'manufacturer', 'name', 'offset', 'limit'])
+    filters = jsonValidator.sanitize_json(data=request.args, valid_params=DEVICE_PARAMS)
 
     manufacturer = filters['manufacturer']
     name = filters['name']
     offset = filters['offset']
     limit = filters['limit']
+    cursor = filters['cursor']
+    specs = filters['specs']
+    sort_by = filters['sort_by']
+    fields = filters['fields']
+
+    def build():
+        devices = Device.get(manufacturer=manufacturer, name=name, offset=offset, limit=limit,
+                             eager=True, cursor=cursor, specs=specs, sort_by=sort_by, fields=fields)
+        with timed('serialize'):
+            serialized_devices = serialize_devices(devices, fields)
+        next_cursor = Device.cursor(devices[-1]) if len(
+            devices) == limit and not sort_by else None
+        return {'Devices': serialized_devices, 'next_cursor': next_cursor}
+
+    return cached_response(filters, build)
+
+
+@app.route('/api/get-devices-by-id', methods=['GET', 'POST'])
+@api_key_required
+@read_replica
+def get_devices_by_id():
+    '''
+    Get devices by id, in the order given, and list the ids
+    that have no device
+    '''
+    data = request.args if request.method == 'GET' else request.json
+    filters = jsonValidator.sanitize_json(data=data, valid_params=['ids'])
+    ids = filters['ids']
+
+    if not ids:
+        response = jsonify(
+            {'message': 'You must provide a list of device ids!', 'status': 400})
+        return (response, 400)
+
+    if len(ids) > MAX_IDS_PER_REQUEST:
+        response = jsonify(
+            {'message': f'You can request up to {MAX_IDS_PER_REQUEST} ids at once!', 'status': 400})
+        return (response, 400)
 
-    devices = Device.get(manufacturer=manufacturer,
-                         name=name, offset=offset, limit=limit)
-    serialized_devices = [device.serialize() for device in devices]
-    response = jsonify({'Devices': serialized_devices})
+    devices = Device.get_by_ids(ids)
+    found = {device.id for device in devices}
+    with timed('serialize'):
+        response = jsonify({'Devices': [device.serialize() for device in devices],
+                            'missing': [id for id in ids if id not in found]})
     return (response, 200)
 
+
+@app.route('/api/export-devices', methods=['GET'])
+@api_key_required
+@read_replica
+def export_devices():
+    '''
+    Stream every device with its specs as newline delimited JSON,
+    gzipped if the client accepts it
+    '''
+    # Quality weighted, so gzip;q=0 turns it off
+    use_gzip = request.accept_encodings['gzip'] > 0
+
+    def generate():
+        # Streams the catalog in the same batches it's read from the DB
+        compressor = zlib.compressobj(
+            wbits=16 + zlib.MAX_WBITS) if use_gzip else None
+        lines = []
+        for device in Device.stream_all(batch_size=EXPORT_BATCH_SIZE):
+            lines.append(json.dumps(device.serialize()) + '\n')
+            if len(lines) >= EXPORT_BATCH_SIZE:
+                chunk = ''.join(lines).encode()
+                lines = []
+                yield compressor.compress(chunk) if use_gzip else chunk
+        chunk = ''.join(lines).encode()
+        yield compressor.compress(chunk) + compressor.flush() if use_gzip else chunk
+
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 #####################################################################
 
 ######################
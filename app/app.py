@@ -1,6 +1,7 @@
 from flask import Flask
 from flask_cors import CORS
-from app.database import connect_db
+from app.database import connect_db, engine_options, REPLICA
+from app.profiling import init_profiling
 import os
 
 app = Flask(__name__)
@@ -19,4 +20,13 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
     'DATABASE_URL', 'postgresql:///grabaphone')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'kAmfv86aKDB02n')
+# Optional read replica for the GET routes (see app/database.py)
+if os.environ.get('DATABASE_REPLICA_URL'):
+    app.config['SQLALCHEMY_BINDS'] = {
+        REPLICA: os.environ['DATABASE_REPLICA_URL']}
+# Pool size, recycling, pre-ping and statement timeout (see api/config.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
+# Server-Timing headers and /metrics (see app/profiling.py)
+app.config['PROFILING'] = bool(os.environ.get('PROFILING'))
 connect_db(app)
+init_profiling(app)
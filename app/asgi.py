@@ -0,0 +1,198 @@
+'''
+Optional async serving mode for the read-only list routes.
+
+Serves /api/get-manufacturers, /api/get-latest-devices and
+/api/get-devices with Starlette, querying Postgres through an asyncpg
+connection pool, so a slow query waits on the event loop instead of
+holding a whole worker. The queries are built by the same model methods
+the Flask views use (Manufacturer.list_query, Device.latest_query and
+Device.list_query), compiled to SQL and run on the pool, and the rows
+are serialized by the same code, so responses match the Flask routes.
+
+Every other route is only served by the Flask app. Needs the packages in
+requirements-async.txt:
+
+    uvicorn app.asgi:app --workers 4
+'''
+import asyncio
+import hashlib
+import json
+import math
+from collections import namedtuple
+from contextlib import asynccontextmanager
+import asyncpg
+from sqlalchemy.dialects.postgresql.base import PGDialect, PGCompiler
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import parse_etags
+from app.app import app as flask_app
+from app.database import REPLICA
+from api.models import APIKey, Manufacturer, Device, Spec, DEVICE_FIELDS
+from api.views import jsonValidator, MANUFACTURER_PARAMS, LATEST_DEVICE_PARAMS, DEVICE_PARAMS
+from api.cache import TTLCache, response_cache
+from api.ratelimit import rate_limiter, usage
+from api.config import ASYNC_POOL_MIN_SIZE, ASYNC_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_STATEMENT_TIMEOUT
+
+
+class AsyncpgCompiler(PGCompiler):
+    '''Renders bound parameters as asyncpg's $1, $2...'''
+
+    def bindparam_string(self, name, **kwargs):
+        return '$' + super().bindparam_string(name, **kwargs)[1:]
+
+
+class AsyncpgDialect(PGDialect):
+    statement_compiler = AsyncpgCompiler
+
+
+dialect = AsyncpgDialect(paramstyle='numeric')
+
+
+def compile_query(query) -> tuple:
+    '''Returns the SQL of a SQLAlchemy query and its parameters, for asyncpg'''
+    compiled = query.statement.compile(dialect=dialect)
+    return str(compiled), [compiled.params[name] for name in compiled.positiontup]
+
+
+async def fetch(pool: asyncpg.pool.Pool, query) -> list:
+    '''Runs query on a pooled connection, returning its rows as named tuples'''
+    sql, params = compile_query(query)
+    async with pool.acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        records = await connection.fetch(sql, *params)
+    if not records:
+        return []
+    Row = namedtuple('Row', records[0].keys())
+    return [Row(*record.values()) for record in records]
+
+
+async def validate_key(pool: asyncpg.pool.Pool, key: str) -> bool:
+    '''APIKey.validate, querying the DB through the pool'''
+    if not key or type(key) != str:
+        return False
+    is_valid = APIKey.cache.get(key)
+    if is_valid is TTLCache.MISSING:
+        is_valid = APIKey.remember(key, bool(await fetch(pool, APIKey.key_query(key))))
+    return is_valid
+
+
+def list_route(endpoint: str, valid_params: list, build):
+    '''
+    Returns a route handler answering like the Flask route endpoint: it checks
+    and rate limits the API key, validates the params, and responds with the JSON of
+    await build(pool, filters), through the same response cache and ETags
+    '''
+    async def handler(request):
+        pool = request.app.state.pool
+        api_key = request.query_params.get('key')
+        if not await validate_key(request.app.state.primary, api_key):
+            return JSONResponse({'message': 'API Key invalid!', 'status': 401}, status_code=401)
+        # The SQLite store can wait on a lock, so it's kept off the event loop
+        wait = await run_in_threadpool(rate_limiter.check, api_key)
+        if wait:
+            return JSONResponse({'message': 'Rate limit exceeded!', 'status': 429},
+                                status_code=429, headers={'Retry-After': str(math.ceil(wait))})
+        if usage.record(api_key):
+            usage.flush_in_background()
+
+        filters = jsonValidator.sanitize_json(
+            data=request.query_params, valid_params=valid_params)
+        key = (endpoint, json.dumps(filters, sort_keys=True, default=str))
+        cached = response_cache.get(key)
+        if cached is TTLCache.MISSING:
+            data = await build(pool, filters)
+            body = (json.dumps(data, sort_keys=True,
+                               separators=(',', ':')) + '\n').encode()
+            cached = (body, hashlib.sha1(body).hexdigest())
+            response_cache.set(key, cached)
+
+        body, etag = cached
+        headers = {'ETag': f'"{etag}"'}
+        # Compared as Werkzeug does for the Flask routes: weakly, in a list, or *
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type='application/json', headers=headers)
+    return handler
+
+
+async def build_manufacturers(pool: asyncpg.pool.Pool, filters: dict) -> dict:
+    query = Manufacturer.list_query(manufacturer=filters['manufacturer'], offset=filters['offset'],
+                                    limit=filters['limit'], cursor=filters['cursor'])
+    manufacturers = await fetch(pool, Manufacturer.project(query))
+    next_cursor = Manufacturer.cursor(manufacturers[-1]) if len(
+        manufacturers) == filters['limit'] else None
+    return {'Manufacturers': [Manufacturer.serialize(manuf) for manuf in manufacturers],
+            'next_cursor': next_cursor}
+
+
+async def serialize_devices(pool: asyncpg.pool.Pool, devices: list, fields: tuple) -> list:
+    specs = Spec.group_serialized(await fetch(pool, Spec.serialized_query(
+        [device.id for device in devices]))) if devices and 'specs' in fields else {}
+    return Device.serialize_rows(devices, fields, specs)
+
+
+async def build_latest_devices(pool: asyncpg.pool.Pool, filters: dict) -> dict:
+    fields = filters['fields'] or DEVICE_FIELDS
+    devices = await fetch(pool, Device.latest_query(
+        manufacturer=filters['manufacturer'], name=filters['name'], offset=filters['offset'],
+        limit=filters['limit'], is_released=filters['is_released'], cursor=filters['cursor'],
+        specs=filters['specs'], sort_by=filters['sort_by'], fields=fields))
+    # Spec sorted pages are paged by offset
+    next_cursor = Device.cursor(devices[-1], latest=True) if len(
+        devices) == filters['limit'] and not filters['sort_by'] else None
+    return {'Devices': await serialize_devices(pool, devices, fields), 'next_cursor': next_cursor}
+
+
+async def build_devices(pool: asyncpg.pool.Pool, filters: dict) -> dict:
+    fields = filters['fields'] or DEVICE_FIELDS
+    devices = await fetch(pool, Device.list_query(
+        manufacturer=filters['manufacturer'], name=filters['name'], offset=filters['offset'],
+        limit=filters['limit'], cursor=filters['cursor'], specs=filters['specs'],
+        sort_by=filters['sort_by'], fields=fields))
+    next_cursor = Device.cursor(devices[-1]) if len(
+        devices) == filters['limit'] and not filters['sort_by'] else None
+    return {'Devices': await serialize_devices(pool, devices, fields), 'next_cursor': next_cursor}
+
+
+async def database_unavailable(request, error):
+    '''Responds 503 as the Flask app's database_unavailable does'''
+    timed_out = isinstance(error, (asyncpg.QueryCanceledError, asyncio.TimeoutError))
+    return JSONResponse({'message': 'Request timed out!' if timed_out else 'Database unavailable!', 'status': 503},
+                        status_code=503, headers={'Retry-After': '1'})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    server_settings = {'statement_timeout': str(
+        DB_STATEMENT_TIMEOUT)} if DB_STATEMENT_TIMEOUT else None
+    primary = flask_app.config['SQLALCHEMY_DATABASE_URI']
+    replica = (flask_app.config.get('SQLALCHEMY_BINDS') or {}).get(REPLICA)
+    # The routes read from the read replica if there is one. API keys are
+    # checked on the primary, as in the Flask app, so new keys work right away
+    app.state.pool = await asyncpg.create_pool(
+        replica or primary, server_settings=server_settings,
+        min_size=ASYNC_POOL_MIN_SIZE, max_size=ASYNC_POOL_MAX_SIZE)
+    app.state.primary = await asyncpg.create_pool(
+        primary, server_settings=server_settings, min_size=1,
+        max_size=ASYNC_POOL_MAX_SIZE) if replica else app.state.pool
+    try:
+        yield
+    finally:
+        await app.state.pool.close()
+        if replica:
+            await app.state.primary.close()
+
+
+app = Starlette(routes=[
+    Route('/api/get-manufacturers',
+          list_route('get_manufacturers', MANUFACTURER_PARAMS, build_manufacturers)),
+    Route('/api/get-latest-devices',
+          list_route('get_latest_devices', LATEST_DEVICE_PARAMS, build_latest_devices)),
+    Route('/api/get-devices',
+          list_route('get_devices', DEVICE_PARAMS, build_devices))
+], lifespan=lifespan, exception_handlers={
+    asyncpg.QueryCanceledError: database_unavailable,
+    asyncio.TimeoutError: database_unavailable,
+    asyncpg.PostgresConnectionError: database_unavailable
+})
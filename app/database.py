@@ -1,6 +1,95 @@
-from flask_sqlalchemy import SQLAlchemy
+import time
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from app.profiling import record_checkout
+from api.config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT, REPLICA_STALENESS
 
-db = SQLAlchemy()
+# Name of the read replica in SQLALCHEMY_BINDS
+REPLICA = 'replica'
+
+
+class RoutingSession(SignallingSession):
+    '''
+    Session that sends the queries of routes marked with read_replica to
+    the replica, if one is configured. Flushes, and every query after one
+    until the transaction ends, go to the primary, as do all reads for
+    REPLICA_STALENESS seconds after a commit that wrote, while the replica
+    catches up. Writes are only tracked per process
+    '''
+    last_write = float('-inf')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wrote = False
+
+    def reads_from_replica(self) -> bool:
+        return (REPLICA in (self.app.config.get('SQLALCHEMY_BINDS') or ())
+                and has_app_context() and g.get('read_replica', False)
+                and not self._flushing and not self.wrote
+                and time.monotonic() - RoutingSession.last_write > REPLICA_STALENESS)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.reads_from_replica():
+            return db.get_engine(self.app, bind=REPLICA)
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def after_flush(session, flush_context):
+    session.wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def after_commit(session):
+    if session.wrote:
+        RoutingSession.last_write = time.monotonic()
+    session.wrote = False
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def after_rollback(session):
+    session.wrote = False
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+class TimedQueuePool(QueuePool):
+    '''QueuePool that records how long each checkout waited for a connection'''
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            record_checkout(time.perf_counter() - start, timed_out=True)
+            raise
+        record_checkout(time.perf_counter() - start)
+        return connection
+
+
+def engine_options() -> dict:
+    '''Returns the pool and timeout settings from api/config.py, for SQLALCHEMY_ENGINE_OPTIONS'''
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+    if DB_STATEMENT_TIMEOUT:
+        options['connect_args'] = {
+            'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'}
+    return options
 
 
 def connect_db(app):
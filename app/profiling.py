@@ -0,0 +1,218 @@
+'''
+Opt-in request profiling.
+
+When app.config['PROFILING'] is set (PROFILING=1 in the environment),
+every request records its wall time, the number and time of the SQL
+queries it ran, the time spent serializing (see timed) and the size of
+its response. Each response gets a Server-Timing header with the
+request's numbers, and the totals per endpoint are served in the
+Prometheus text format at /metrics.
+
+Waits for a connection from the pool (see app/database.py) are recorded
+too, in their own histogram and in Server-Timing.
+
+Metrics are kept per process, so with several gunicorn workers each
+scrape of /metrics sees one worker. Queries run while a response is
+streamed happen after the request is recorded, and aren't counted.
+'''
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from flask import g, request, has_request_context, has_app_context, current_app, abort, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    '''Thread-safe totals of the profiled requests, per endpoint'''
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        '''Forgets every recorded request'''
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.buckets = defaultdict(lambda: [0] * len(BUCKETS))
+            self.totals = defaultdict(float)
+            self.checkouts = [0] * len(BUCKETS)
+            self.checkout_totals = {'count': 0, 'seconds': 0.0, 'timeouts': 0}
+
+    def observe(self, endpoint: str, method: str, status: int, profile: dict):
+        '''Records a finished request's profile (see start_profile)'''
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            buckets = self.buckets[endpoint]
+            for i, bound in enumerate(BUCKETS):
+                if profile['duration'] <= bound:
+                    buckets[i] += 1
+            for name in ('duration', 'queries', 'db', 'serialize', 'bytes'):
+                self.totals[(name, endpoint)] += profile[name]
+            self.totals[('count', endpoint)] += 1
+
+    def observe_checkout(self, wait: float, timed_out: bool = False):
+        '''Records a pool checkout that waited {wait} seconds, or gave up waiting'''
+        with self._lock:
+            for i, bound in enumerate(BUCKETS):
+                if wait <= bound:
+                    self.checkouts[i] += 1
+            self.checkout_totals['count'] += 1
+            self.checkout_totals['seconds'] += wait
+            self.checkout_totals['timeouts'] += timed_out
+
+    def render(self) -> str:
+        '''Returns the metrics in the Prometheus text exposition format'''
+        with self._lock:
+            lines = ['# HELP grabaphone_requests_total Requests handled.',
+                     '# TYPE grabaphone_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'grabaphone_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            lines += ['# HELP grabaphone_request_duration_seconds Wall time of requests.',
+                      '# TYPE grabaphone_request_duration_seconds histogram']
+            for endpoint, buckets in sorted(self.buckets.items()):
+                for bound, count in zip(BUCKETS, buckets):
+                    lines.append(
+                        f'grabaphone_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                count = int(self.totals[('count', endpoint)])
+                lines += [
+                    f'grabaphone_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {count}',
+                    f'grabaphone_request_duration_seconds_sum{{endpoint="{endpoint}"}} {self.totals[("duration", endpoint)]:.6f}',
+                    f'grabaphone_request_duration_seconds_count{{endpoint="{endpoint}"}} {count}']
+
+            for name, metric, help in (('queries', 'grabaphone_sql_queries_total', 'SQL queries run by requests.'),
+                                       ('db', 'grabaphone_sql_seconds_total',
+                                        'Time requests spent in SQL queries.'),
+                                       ('serialize', 'grabaphone_serialize_seconds_total',
+                                        'Time requests spent serializing responses.'),
+                                       ('bytes', 'grabaphone_response_bytes_total', 'Size of response bodies.')):
+                lines += [f'# HELP {metric} {help}', f'# TYPE {metric} counter']
+                for endpoint in sorted(self.buckets):
+                    value = self.totals[(name, endpoint)]
+                    value = f'{value:.6f}' if name in ('db', 'serialize') else int(value)
+                    lines.append(f'{metric}{{endpoint="{endpoint}"}} {value}')
+
+            lines += ['# HELP grabaphone_pool_checkout_seconds Time waited for a pooled database connection.',
+                      '# TYPE grabaphone_pool_checkout_seconds histogram']
+            for bound, count in zip(BUCKETS, self.checkouts):
+                lines.append(
+                    f'grabaphone_pool_checkout_seconds_bucket{{le="{bound}"}} {count}')
+            lines += [
+                f'grabaphone_pool_checkout_seconds_bucket{{le="+Inf"}} {self.checkout_totals["count"]}',
+                f'grabaphone_pool_checkout_seconds_sum {self.checkout_totals["seconds"]:.6f}',
+                f'grabaphone_pool_checkout_seconds_count {self.checkout_totals["count"]}',
+                '# HELP grabaphone_pool_checkout_timeouts_total Checkouts that gave up waiting for a connection.',
+                '# TYPE grabaphone_pool_checkout_timeouts_total counter',
+                f'grabaphone_pool_checkout_timeouts_total {self.checkout_totals["timeouts"]}']
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def is_profiling() -> bool:
+    '''Checks if the current request is being profiled'''
+    return has_request_context() and 'profile' in g
+
+
+@contextmanager
+def timed(name: str):
+    '''Adds the time spent in the block to the current request's {name} time'''
+    if not is_profiling():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.profile[name] += time.perf_counter() - start
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if is_profiling():
+        context._profile_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_profile_start', None)
+    if start is not None and is_profiling():
+        g.profile['db'] += time.perf_counter() - start
+        g.profile['queries'] += 1
+
+
+def record_checkout(wait: float, timed_out: bool = False):
+    '''Records a pool checkout, if profiling is on'''
+    if has_app_context() and current_app.config.get('PROFILING'):
+        metrics.observe_checkout(wait, timed_out)
+        if is_profiling():
+            g.profile['pool'] += wait
+
+
+def start_profile():
+    if current_app.config.get('PROFILING'):
+        g.profile = {'start': time.perf_counter(), 'queries': 0,
+                     'db': 0.0, 'serialize': 0.0, 'pool': 0.0}
+
+
+def finish_profile(response: Response) -> Response:
+    if not is_profiling():
+        return response
+    profile = g.profile
+    profile['duration'] = time.perf_counter() - profile['start']
+    profile['bytes'] = response.content_length or (
+        0 if response.is_streamed else len(response.get_data()))
+
+    response.headers['Server-Timing'] = ', '.join([
+        f'app;dur={profile["duration"] * 1000:.2f}',
+        f'db;dur={profile["db"] * 1000:.2f};desc="{profile["queries"]} queries"',
+        f'pool;dur={profile["pool"] * 1000:.2f}',
+        f'serialize;dur={profile["serialize"] * 1000:.2f}'])
+    metrics.observe(request.endpoint or 'unknown', request.method,
+                    response.status_code, profile)
+    return response
+
+
+def render_metrics():
+    '''Serves the metrics, if profiling is on'''
+    if not current_app.config.get('PROFILING'):
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+class QueryCounter:
+    '''
+    Context manager that counts the SQL statements sent
+    to the database while it is active
+    '''
+
+    def __init__(self):
+        self.count = 0
+
+    def callback(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self.callback)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(Engine, 'before_cursor_execute', self.callback)
+
+
+def init_profiling(app):
+    '''
+    Adds the profiling hooks and the /metrics route to app. They do
+    nothing unless app.config['PROFILING'] is set
+    '''
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.add_url_rule('/metrics', 'metrics', render_metrics)
@@ -0,0 +1,196 @@
+'''
+Benchmarks the read API: seeds a database with a synthetic catalog (see
+benchmarks.catalog), then requests get-devices, get-latest-devices and
+get-manufacturers through the Flask test client for every filter
+combination at several page depths, and prints the p50 and p99 latency
+and the SQL queries per request of each.
+
+The response cache is cleared before every request so the database is
+measured, unless --cached is passed. Results can be saved with
+--save-baseline and compared against later with --compare, which exits
+with status 1 if any request got slower than --threshold allows or ran
+more queries.
+
+The database given by --database is dropped and recreated unless
+--no-seed is passed, so don't point it at real data.
+
+Usage:
+    python -m benchmarks.bench_api [--database URI] [--devices 10000]
+                                   [--repeat 20] [--no-seed] [--cached]
+                                   [--save-baseline FILE] [--compare FILE]
+'''
+import argparse
+import json
+import math
+import statistics
+import sys
+import time
+from app.app import app
+from app.profiling import QueryCounter
+from api.models import APIKey, Device
+from api.cache import response_cache
+from api.ratelimit import rate_limiter
+from benchmarks.catalog import seed
+import run  # registers the app's routes
+
+DEVICE_FILTERS = [
+    ('no filters', {}),
+    ('manufacturer', {'manufacturer': 'samsung'}),
+    ('name', {'name': 'galaxy'}),
+    ('manufacturer + name', {'manufacturer': 'samsung', 'name': 'galaxy'}),
+    ('specs', {'specs': 'battery_capacity:gte:5000,ram:gte:8'}),
+    ('sorted by spec', {'sort_by': '-display_size'})
+]
+
+# (route, [(label, filters)]) of every endpoint benchmarked
+ENDPOINTS = [
+    ('/api/get-devices', DEVICE_FILTERS),
+    ('/api/get-latest-devices', DEVICE_FILTERS + [
+        ('released', {'is_released': 'true'}),
+        ('released + manufacturer', {'is_released': 'true', 'manufacturer': 'samsung'})]),
+    ('/api/get-manufacturers', [
+        ('no filters', {}),
+        ('manufacturer', {'manufacturer': 'brand'})])
+]
+
+# (label, offset, pages followed by cursor) of every page depth requested
+DEPTHS = [
+    ('page 1', 0, 0),
+    ('offset 1000', 1000, 0),
+    ('cursor page 10', 0, 9)
+]
+
+
+def percentile(timings: list, p: float) -> float:
+    '''Returns the nearest-rank {p}th percentile of timings'''
+    ordered = sorted(timings)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def follow_cursor(client, route: str, params: dict, pages: int) -> str or None:
+    '''Returns the cursor of the page {pages} pages in, or None if there is no such page'''
+    cursor = None
+    for _ in range(pages):
+        body = client.get(route, query_string={
+            **params, **({'cursor': cursor} if cursor else {})}).get_json()
+        cursor = body.get('next_cursor')
+        if not cursor:
+            return None
+    return cursor
+
+
+def measure(client, route: str, params: dict, repeat: int, cached: bool, counter: QueryCounter) -> dict:
+    '''Returns the p50 and p99 milliseconds and the mean queries of {repeat} requests'''
+    # Warm up the connection pool and API key cache
+    client.get(route, query_string=params)
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        if not cached:
+            response_cache.clear()
+        before = counter.count
+        start = time.perf_counter()
+        response = client.get(route, query_string=params)
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count - before)
+        if response.status_code != 200:
+            raise RuntimeError(
+                f'{route} {params} responded {response.status_code}')
+    return {'p50': statistics.median(timings), 'p99': percentile(timings, 99),
+            'queries': statistics.mean(queries)}
+
+
+def benchmark(repeat: int, cached: bool) -> dict:
+    '''Returns the measurements of every endpoint, filter and depth, by name'''
+    client = app.test_client()
+    key = APIKey.generate_and_create().key
+    results = {}
+    with QueryCounter() as counter:
+        for route, filters in ENDPOINTS:
+            for label, params in filters:
+                for depth, offset, pages in DEPTHS:
+                    query = {'key': key, **params}
+                    if offset:
+                        query['offset'] = offset
+                    if pages:
+                        cursor = follow_cursor(client, route, query, pages)
+                        if cursor is None:
+                            continue
+                        query['cursor'] = cursor
+                    results[f'{route} | {label} | {depth}'] = measure(
+                        client, route, query, repeat, cached, counter)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    '''
+    Prints how results changed from baseline, and returns the names of
+    those whose p50 grew by more than {threshold} (and by more than a
+    millisecond, to ignore noise) or that run more queries
+    '''
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name}: new')
+            continue
+        slower = (result['p50'] > base['p50'] * (1 + threshold)
+                  and result['p50'] - base['p50'] > 1)
+        more_queries = result['queries'] > base['queries']
+        flag = '  REGRESSION' if slower or more_queries else ''
+        print(f'{name}: p50 {base["p50"]:.2f} -> {result["p50"]:.2f} ms, '
+              f'p99 {base["p99"]:.2f} -> {result["p99"]:.2f} ms, '
+              f'queries {base["queries"]:g} -> {result["queries"]:g}{flag}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database', default='postgresql:///grabaphone_bench')
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--manufacturers', type=int, default=100)
+    parser.add_argument('--specs', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-seed', action='store_true',
+                        help='benchmark the database as it is')
+    parser.add_argument('--cached', action='store_true',
+                        help='leave the response cache on')
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help='save the results to FILE')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results to a baseline saved in FILE')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='p50 growth allowed by --compare (default 0.2, 20%%)')
+    args = parser.parse_args(argv)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+    # Every request uses one key, far faster than the rate limit allows
+    rate_limiter.rate = 0
+    if not args.no_seed:
+        seed(args.manufacturers, args.devices, args.specs)
+    print(f'{Device.query.count()} devices, {args.repeat} requests each\n')
+
+    results = benchmark(args.repeat, args.cached)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline)['results'], args.threshold)
+    else:
+        for name, result in results.items():
+            print(f'{name}: p50 {result["p50"]:.2f} ms, p99 {result["p99"]:.2f} ms, '
+                  f'{result["queries"]:g} queries')
+        regressions = []
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline:
+            json.dump({'devices': Device.query.count(), 'repeat': args.repeat,
+                       'cached': args.cached, 'results': results}, baseline, indent=2)
+
+    if regressions:
+        print(f'\n{len(regressions)} regressions')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Benchmarks convert_to_date: the strptime loop it replaced, against the
+compiled regex parser without its cache and with a warm cache.
+
+Parses {count} release dates drawn, with repeats as in a real crawl,
+from the formats phonearena uses, and reports microseconds per date.
+
+Usage:
+    python -m benchmarks.bench_dates [--count 100000] [--distinct 2000] [--repeat 5]
+'''
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from api.helpers import convert_to_date, make_date_valid, parse_date, strptime_convert_to_date
+
+
+def release_dates(count: int, distinct: int) -> list:
+    '''Returns {count} release date strings, {distinct} of them different'''
+    random.seed(0)
+    dates = []
+    for _ in range(distinct):
+        day = date(2010, 1, 1) + timedelta(days=random.randint(0, 4000))
+        dates.append(random.choice([day.strftime('%b %d, %Y'), day.strftime('%B %Y'),
+                                    f'Q{(day.month - 1) // 3 + 1} {day.year}',
+                                    f'(Official) {day:%B %d, %Y}', 'No information']))
+    return [random.choice(dates) for _ in range(count)]
+
+
+def per_date(parse, dates: list, repeat: int) -> float:
+    '''Returns the best microseconds per date of parsing dates {repeat} times'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for date_str in dates:
+            parse(date_str)
+        elapsed = (time.perf_counter() - start) / len(dates) * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    dates = release_dates(args.count, args.distinct)
+    mismatches = [d for d in set(dates) if convert_to_date(d) !=
+                  strptime_convert_to_date(make_date_valid(d))]
+    if mismatches:
+        raise SystemExit(f'convert_to_date disagrees with strptime on {mismatches[:5]}')
+
+    print(f'{args.count} dates, {args.distinct} distinct\n')
+    baseline = per_date(lambda d: strptime_convert_to_date(make_date_valid(d)), dates, args.repeat)
+    print(f'strptime:            {baseline:.2f} us/date')
+    for label, parse in (('regex, uncached', parse_date.__wrapped__), ('regex, warm cache', convert_to_date)):
+        result = per_date(parse, dates, args.repeat)
+        print(f'{label + ":":<20} {result:.2f} us/date ({baseline / result:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+'''
+Load tests the list routes under gunicorn's sync workers and under the
+async serving mode (app/asgi.py on uvicorn), with the same number of
+worker processes, and prints the throughput and latency of each.
+
+Each server is started against --database with its response cache and
+rate limiting off, then --concurrency clients request a mix of list
+routes for --duration seconds. Seed the database first, e.g. with
+benchmarks.catalog.
+
+Usage:
+    python -m benchmarks.bench_load [--database URI] [--workers 4]
+                                    [--concurrency 64] [--duration 20]
+'''
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from app.app import app
+from api.models import APIKey
+
+# Requests the clients cycle through
+PATHS = [
+    '/api/get-manufacturers',
+    '/api/get-devices',
+    '/api/get-devices?manufacturer=Samsung',
+    '/api/get-devices?fields=name,release_date&limit=100',
+    '/api/get-latest-devices',
+    '/api/get-latest-devices?is_released=true&name=galaxy',
+    '/api/get-latest-devices?specs=battery_capacity:gte:5000',
+    '/api/get-latest-devices?offset=1000'
+]
+
+SERVERS = {
+    'gunicorn (sync)': ['gunicorn', '--workers', '{workers}', '--bind', '127.0.0.1:{port}', 'run:app'],
+    'uvicorn (async)': ['uvicorn', '--workers', '{workers}', '--host', '127.0.0.1', '--port', '{port}',
+                        '--log-level', 'warning', 'app.asgi:app']
+}
+
+
+def start(command: list, database: str, workers: int, port: int) -> subprocess.Popen:
+    '''Starts a server and waits until it answers'''
+    # All the clients share one key, so it mustn't be rate limited
+    env = {**os.environ, 'DATABASE_URL': database,
+           'RESPONSE_CACHE_SIZE': '0', 'RATE_LIMIT': '0'}
+    server = subprocess.Popen([part.format(workers=workers, port=port) for part in command],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/get-devices', timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise SystemExit(f'{command[0]} did not start')
+
+
+def stop(server: subprocess.Popen):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def client(base_url: str, key: str, offset: int, deadline: float) -> tuple:
+    '''Requests PATHS in turn until deadline, returning the latencies and the error count'''
+    session = requests.Session()
+    latencies = []
+    errors = 0
+    i = offset
+    while time.monotonic() < deadline:
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = session.get(base_url + path, params={'key': key}, timeout=30)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        latencies.append((time.perf_counter() - start) * 1000)
+        errors += not ok
+    return latencies, errors
+
+
+def load(base_url: str, key: str, concurrency: int, duration: float) -> dict:
+    deadline = time.monotonic() + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda i: client(base_url, key, i, deadline),
+                                    range(concurrency)))
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {'requests': len(latencies), 'errors': sum(result[1] for result in results),
+            'rps': len(latencies) / duration, 'p50': statistics.median(latencies),
+            'p99': latencies[int(len(latencies) * 0.99) - 1]}
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database', default='postgresql:///grabaphone_bench')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+    key = APIKey.generate_and_create().key
+    print(f'{args.workers} workers, {args.concurrency} clients, {args.duration:g}s each\n')
+
+    for name, command in SERVERS.items():
+        server = start(command, args.database, args.workers, args.port)
+        try:
+            result = load(f'http://127.0.0.1:{args.port}', key,
+                          args.concurrency, args.duration)
+        finally:
+            stop(server)
+        print(f'{name}: {result["rps"]:.1f} req/s, p50 {result["p50"]:.1f} ms, '
+              f'p99 {result["p99"]:.1f} ms, {result["errors"]} errors of {result["requests"]}')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''
+Benchmarks parsing device pages: the full html.parser tree the scrapers
+used to search, against api.parsing's narrowed tree with each parser.
+
+Reports CPU time per device page. Defaults to the saved pages in
+tests/fixtures/phonearena; point --pages at a directory of real saved
+device pages for representative numbers, or use --filler to pad the
+fixtures with unrelated markup the size of a full phonearena page.
+
+Usage:
+    python -m benchmarks.bench_parsing [--pages DIR] [--repeat 20] [--filler 400]
+'''
+import argparse
+import glob
+import os
+import time
+from bs4 import BeautifulSoup as bsoup
+from unittest.mock import patch
+from api import parsing
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tests',
+                        'fixtures', 'phonearena', 'www.phonearena.com', 'phones')
+
+
+def full_parse(html: str) -> dict:
+    '''Parses the whole page with html.parser, as the scrapers used to'''
+    page = bsoup(html, 'html.parser')
+    return {
+        'rating': parsing.parse_rating(page),
+        'image': parsing.parse_image(page),
+        'release_date': parsing.parse_release_date(page),
+        'specs': parsing.parse_specs(page)
+    }
+
+
+def strained_parse(parser: str):
+    '''Returns a function parsing a page with api.parsing and the given parser'''
+    def parse(html: str) -> dict:
+        with patch('api.parsing.PARSER', parser):
+            return parsing.parse_device_page(html)
+    return parse
+
+
+def filler(kb: int) -> str:
+    '''Returns about kb kilobytes of page chrome the scrapers never read'''
+    block = ('<div class="news-item"><a href="/news/1"><img src="/img/1.jpg">'
+             '<h3>Related story headline</h3></a><p>Some teaser text for the story.</p>'
+             '<ul><li>Comments</li><li>Share</li></ul></div>\n')
+    return block * (kb * 1024 // len(block))
+
+
+def load_pages(directory: str, filler_kb: int) -> list:
+    pages = []
+    padding = filler(filler_kb) if filler_kb else ''
+    for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(path, encoding='utf-8') as page:
+            html = page.read()
+        if 'widgetSpecs' in html:
+            pages.append(html.replace('<body>', '<body>' + padding, 1))
+    return pages
+
+
+def bench(parse, pages: list, repeat: int) -> float:
+    '''Returns the CPU milliseconds parse takes per page'''
+    start = time.process_time()
+    for _ in range(repeat):
+        for html in pages:
+            parse(html)
+    return (time.process_time() - start) * 1000 / (repeat * len(pages))
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--pages', default=FIXTURES,
+                        help='directory of saved device pages')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--filler', type=int, default=400,
+                        help='kilobytes of unrelated markup added to each page')
+    args = parser.parse_args(argv)
+
+    pages = load_pages(args.pages, args.filler)
+    if not pages:
+        parser.error(f'no device pages found in {args.pages}')
+
+    candidates = [('full tree, html.parser', full_parse),
+                  ('strained, html.parser', strained_parse('html.parser'))]
+    try:
+        import lxml
+        candidates.append(('strained, lxml', strained_parse('lxml')))
+    except ImportError:
+        print('lxml is not installed, skipping it')
+
+    size = sum(len(html) for html in pages) // len(pages) // 1024
+    print(f'{len(pages)} device pages, ~{size} KB each, {args.repeat} runs')
+    baseline = None
+    for label, parse in candidates:
+        ms = bench(parse, pages, args.repeat)
+        baseline = baseline or ms
+        print(f'{label:<26} {ms:8.2f} ms CPU / device  ({baseline / ms:4.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
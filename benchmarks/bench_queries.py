@@ -0,0 +1,100 @@
+'''
+Benchmarks the device list queries: seeds a database with a synthetic
+catalog (see benchmarks.catalog), then prints the query plan and latency of Device.get_latest
+and Device.get for every combination of filters.
+
+The database given by --database is dropped and recreated unless
+--no-seed is passed, so don't point it at real data.
+
+Usage:
+    python -m benchmarks.bench_queries [--database URI] [--devices 50000]
+                                       [--repeat 20] [--no-seed]
+'''
+import argparse
+import itertools
+import statistics
+import time
+from app.app import app
+from app.database import db
+from api.models import Device
+from sqlalchemy import nullslast
+from benchmarks.catalog import seed
+
+
+def combinations(manufacturer: str, released: tuple = (False, True)) -> list:
+    '''Returns (label, filters) of every combination of filters, with manufacturer as given'''
+    return [
+        (' + '.join(name for name, value in combo if value) or 'no filters',
+         {name: value for name, value in combo if value})
+        for combo in itertools.product(
+            (('manufacturer', None), ('manufacturer', manufacturer)),
+            (('name', None), ('name', 'galaxy')),
+            tuple(('is_released', value) for value in released))
+    ]
+
+
+# Every combination get-latest-devices can receive. Its manufacturer
+# filter matches part of the name
+LATEST_COMBINATIONS = combinations('sams')
+# Every combination get-devices can receive. Its manufacturer filter
+# matches the whole name
+COMBINATIONS = combinations('Samsung', released=(False,))
+
+
+def explain(query) -> list:
+    '''Returns the lines of the plan Postgres picks for query'''
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f'EXPLAIN {compiled}', compiled.params)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def latency(run, repeat: int) -> tuple:
+    '''Returns the p50 and max milliseconds of run over {repeat} runs'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.rollback()
+    return statistics.median(timings), max(timings)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database', default='postgresql:///grabaphone_bench')
+    parser.add_argument('--devices', type=int, default=50000)
+    parser.add_argument('--manufacturers', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-seed', action='store_true',
+                        help='benchmark the database as it is')
+    args = parser.parse_args(argv)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+    if not args.no_seed:
+        # Specs don't take part in these queries, so skip them
+        seed(args.manufacturers, args.devices, specs=0)
+    print(f'{Device.query.count()} devices, {args.repeat} runs per query\n')
+
+    for label, filters in LATEST_COMBINATIONS:
+        query = Device.filtered(**filters).order_by(
+            nullslast(Device.release_date.desc()), Device.id).limit(100)
+        p50, worst = latency(
+            lambda: Device.get_latest(limit=100, **filters), args.repeat)
+        print(f'get_latest, {label}: p50 {p50:.2f} ms, max {worst:.2f} ms')
+        for line in explain(query):
+            print(f'    {line}')
+        print()
+
+    for label, filters in COMBINATIONS:
+        p50, worst = latency(
+            lambda: Device.get(limit=100, **filters), args.repeat)
+        print(f'get, {label}: p50 {p50:.2f} ms, max {worst:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+'''
+Generates synthetic catalogs for the benchmarks: {manufacturers}
+manufacturers, {devices} devices spread over them with realistic names
+and release dates, and about {specs} phonearena style specs per device
+(with the numeric ones stored the way the scrapers store them).
+
+Rows are loaded with COPY, so 100k devices with 60 specs each take
+minutes rather than hours.
+
+Usage:
+    python -m benchmarks.catalog [--database URI] [--manufacturers 100]
+                                 [--devices 10000] [--specs 60]
+'''
+import argparse
+import csv
+import io
+import random
+from datetime import date, timedelta
+from app.app import app
+from app.database import db
+from api.helpers import convert_spec_value
+from api.models import Manufacturer, Device, Spec
+
+BRANDS = ['Apple', 'Samsung', 'Google', 'Motorola', 'OnePlus',
+          'Nokia', 'Sony', 'LG', 'Xiaomi', 'Huawei']
+SERIES = ['Galaxy', 'Pixel', 'iPhone', 'Moto', 'Xperia',
+          'Note', 'Edge', 'Lite', 'Pro', 'Mini']
+
+
+def choice(*options):
+    return lambda: random.choice(options)
+
+
+def number(low: float, high: float, template: str = '{}', digits: int = 0):
+    return lambda: template.format(round(random.uniform(low, high), digits) if digits else random.randint(low, high))
+
+
+def weight():
+    grams = random.uniform(120, 240)
+    return f'{grams / 28.35:.2f} oz ({grams:.1f} g)'
+
+
+# (category, name, description generator) of every spec a device gets
+SPECS = [
+    ('Design', 'OS', choice('Android (11)', 'Android (12)', 'iOS (14.x)', 'iOS (15.x)')),
+    ('Design', 'Dimensions', choice('5.78 x 2.82 x 0.29 inches', '6.5 x 2.98 x 0.35 inches')),
+    ('Design', 'Weight', weight),
+    ('Design', 'Materials', choice('Back: Glass; Frame: Aluminum', 'Back: Plastic; Frame: Plastic')),
+    ('Design', 'Resistance', choice('Water, Dust; IP68', 'Water; IP54', 'No')),
+    ('Design', 'Biometrics', choice('Fingerprint (under display)', '3D Face unlock', 'Fingerprint (side)')),
+    ('Design', 'Colors', choice('Black, White, Blue', 'Gray, Green', 'Black')),
+    ('Display', 'Size', number(4.7, 7.2, '{}', 1)),
+    ('Display', 'Resolution', choice('1080 x 2400 pixels', '1170 x 2532 pixels', '1440 x 3200 pixels')),
+    ('Display', 'Technology', choice('OLED', 'AMOLED', 'IPS LCD')),
+    ('Display', 'Refresh rate', choice('60Hz', '90Hz', '120Hz', '144Hz')),
+    ('Display', 'Pixel density', number(300, 560, '{} PPI')),
+    ('Display', 'Screen-to-body', number(75, 92, '{} %', 2)),
+    ('Display', 'Features', choice('HDR video support, Scratch-resistant glass', 'Oleophobic coating')),
+    ('Display', 'Peak brightness', number(500, 1500, '{} cd/m2 (nit)')),
+    ('Hardware', 'System chip', choice('Apple A14 Bionic (5 nm)', 'Qualcomm Snapdragon 888 5G (5 nm)',
+                                       'MediaTek Dimensity 1200 (6 nm)', 'Google Tensor (5 nm)')),
+    ('Hardware', 'Processor', choice('Octa-core, 2840 MHz', 'Hexa-core, 3100 MHz')),
+    ('Hardware', 'GPU', choice('Adreno 660', 'Mali-G78 MP20', 'Apple GPU')),
+    ('Hardware', 'RAM', choice('3GB', '4GB', '6GB', '8GB', '12GB', '16GB')),
+    ('Hardware', 'Internal storage', choice('64GB, not expandable', '128GB, 256GB', '512GB', '1TB')),
+    ('Hardware', 'Storage expansion', choice('microSDXC up to 1024 GB', 'No')),
+    ('Hardware', 'Device type', choice('Smartphone')),
+    ('Battery', 'Capacity', number(1800, 7000, '{} mAh')),
+    ('Battery', 'Charging speed', choice('15.0W', '18.0W', '25.0W', '45.0W', '65.0W')),
+    ('Battery', 'Wireless charging', choice('Yes', 'No')),
+    ('Battery', 'Type', choice('Li - Ion, Not user replaceable', 'Li - Polymer, Not user replaceable')),
+    ('Battery', 'Web browsing', number(8, 16, '{}h')),
+    ('Battery', 'Video playback', number(10, 24, '{}h')),
+    ('Main camera', 'Matrix', choice('12 MP (Triple camera)', '50 MP (Dual camera)', '108 MP (Quad camera)')),
+    ('Main camera', 'Aperture', choice('F1.6', 'F1.8', 'F2.2')),
+    ('Main camera', 'Focal length', choice('26 mm', '24 mm', '13 mm')),
+    ('Main camera', 'Sensor size', choice('1/1.76"', '1/2.55"', '1/1.33"')),
+    ('Main camera', 'Pixel size', choice('1.4 um', '0.8 um', '1.7 um')),
+    ('Main camera', 'Flash', choice('Dual LED', 'LED')),
+    ('Main camera', 'Video recording', choice('3840x2160 (4K UHD) (60 fps)', '1920x1080 (Full HD) (30 fps)')),
+    ('Main camera', 'Features', choice('Optical image stabilization, HDR, Night mode', 'Autofocus, HDR')),
+    ('Main camera', 'Zoom', choice('Digital zoom', 'Optical zoom: 3.0x', 'Optical zoom: 10.0x')),
+    ('Selfie camera', 'Matrix', choice('12 MP', '10 MP', '32 MP')),
+    ('Selfie camera', 'Aperture', choice('F2.2', 'F2.4')),
+    ('Selfie camera', 'Video capture', choice('3840x2160 (4K UHD) (60 fps)', '1920x1080 (Full HD) (30 fps)')),
+    ('Multimedia', 'Headphones', choice('No 3.5mm jack', '3.5mm jack')),
+    ('Multimedia', 'Speakers', choice('Earpiece, Loudspeaker', 'Loudspeaker')),
+    ('Multimedia', 'Screen mirroring', choice('Wireless screen share', 'No')),
+    ('Multimedia', 'Additional features', choice('Dolby Atmos', 'FM radio', 'None')),
+    ('Connectivity', '5G', choice('Yes', 'No')),
+    ('Connectivity', 'Bluetooth', choice('5.0', '5.1', '5.2')),
+    ('Connectivity', 'Wi-Fi', choice('802.11 a, b, g, n, ac, ax (Wi-Fi 6)', '802.11 a, b, g, n, ac')),
+    ('Connectivity', 'USB', choice('Lightning, USB 2.0', 'USB Type-C, USB 3.1')),
+    ('Connectivity', 'Features', choice('NFC, Tethering, VoLTE', 'NFC, Wi-Fi Calling')),
+    ('Connectivity', 'Location', choice('GPS, A-GPS, Glonass, Galileo', 'GPS, A-GPS')),
+    ('Connectivity', 'Sensors', choice('Accelerometer, Gyroscope, Compass, Barometer', 'Accelerometer, Proximity')),
+    ('Connectivity', 'Other', choice('eSIM', 'Dual SIM')),
+    ('Buyers information', 'Price', number(99, 1599, '$ {}')),
+    ('Buyers information', 'In the box', choice('USB cable', 'Charger, USB cable, Case')),
+    ('Buyers information', 'Warranty', choice('1 year', '2 years')),
+    ('Network', 'GSM', choice('850, 900, 1800, 1900 MHz')),
+    ('Network', 'UMTS', choice('850, 900, 1700/2100, 1900, 2100 MHz')),
+    ('Network', 'LTE', choice('1, 2, 3, 4, 5, 7, 8, 12, 13, 14, 17, 18, 19, 20, 25, 26, 28, 29, 30, 66, 71')),
+    ('Network', '5G bands', choice('n1, n2, n3, n5, n7, n8, n25, n28, n41, n66, n71, n77, n78', 'None')),
+    ('Network', 'Data', choice('LTE-A, HSDPA+ (4G) 42.2 Mbit/s', 'LTE Cat 20'))
+]
+
+
+def copy(table: str, columns: list, rows):
+    '''Loads rows into table with COPY'''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    connection = db.engine.raw_connection()
+    try:
+        # Big loads run longer than the web's statement timeout
+        connection.cursor().execute('SET LOCAL statement_timeout = 0')
+        connection.cursor().copy_expert(
+            f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)',
+            io.BytesIO(buffer.getvalue().encode('utf-8')))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def device_specs(device_id: int, count: int) -> list:
+    '''Returns {count} spec rows for a device'''
+    rows = []
+    for category, name, describe in SPECS[:count]:
+        description = describe()
+        key, value, unit = convert_spec_value(category, name, description)
+        rows.append((device_id, category, name, description, key, value, unit))
+    return rows
+
+
+def seed(manufacturers: int = 100, devices: int = 10000, specs: int = 60, random_seed: int = 0):
+    '''Recreates the tables and fills them with a synthetic catalog'''
+    random.seed(random_seed)
+    db.drop_all()
+    db.create_all()
+
+    names = BRANDS[:manufacturers] + \
+        [f'Brand {i}' for i in range(manufacturers - len(BRANDS))]
+    copy(Manufacturer.__tablename__, ['id', 'name', 'url', 'image_url'],
+         [(i, name, f'https://www.phonearena.com/phones/manufacturers/{name}', f'https://example.com/{i}.png')
+          for i, name in enumerate(names, start=1)])
+
+    today = date.today()
+    placeholder = date(today.year + 5, 12, 31)
+    device_rows = []
+    for id in range(1, devices + 1):
+        # Big brands make most of the devices
+        manufacturer_id = random.randint(1, min(len(BRANDS), len(names))) if random.random(
+        ) < 0.7 else random.randint(1, len(names))
+        released = random.random()
+        release_date = (None if released < 0.05 else placeholder if released < 0.1
+                        else today + timedelta(days=random.randint(1, 365)) if released < 0.15
+                        else today - timedelta(days=random.randint(1, 3650)))
+        name = f'{names[manufacturer_id - 1]} {random.choice(SERIES)} {id}'
+        device_rows.append((id, manufacturer_id, name, round(random.uniform(5, 10), 1), release_date,
+                            f'https://example.com/phones/{id}.jpg', f'https://www.phonearena.com/phones/{name.replace(" ", "-")}_id{id}'))
+    copy(Device.__tablename__, ['id', 'manufacturer_id', 'name', 'rating', 'release_date', 'image', 'url'],
+         device_rows)
+
+    spec_columns = ['device_id', 'category', 'name',
+                    'description', 'key', 'value', 'unit']
+    for start in range(1, devices + 1, 5000):
+        copy(Spec.__tablename__, spec_columns, (row for id in range(start, min(start + 5000, devices + 1))
+                                     for row in device_specs(id, specs)))
+
+    for table in (Manufacturer.__tablename__, Device.__tablename__, Spec.__tablename__):
+        db.session.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 1) FROM {table}))")
+    db.session.commit()
+    db.session.execute('SET LOCAL statement_timeout = 0')
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database', default='postgresql:///grabaphone_bench')
+    parser.add_argument('--manufacturers', type=int, default=100)
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--specs', type=int, default=60,
+                        help=f'specs per device (up to {len(SPECS)})')
+    args = parser.parse_args(argv)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+    seed(args.manufacturers, args.devices, args.specs)
+    print(f'Seeded {args.manufacturers} manufacturers and {args.devices} devices '
+          f'with {min(args.specs, len(SPECS))} specs each')
+
+
+if __name__ == '__main__':
+    main()
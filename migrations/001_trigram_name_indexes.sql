@@ -0,0 +1,8 @@
+-- Trigram indexes so the ilike('%term%') name filters don't scan every row
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_devices_name_trgm
+    ON devices USING gin (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_manufacturers_name_trgm
+    ON manufacturers USING gin (name gin_trgm_ops);
@@ -0,0 +1,46 @@
+-- Specs stored as numbers (see NUMERIC_SPECS in api/config.py), so devices
+-- can be filtered and sorted by them with an index instead of parsing text
+ALTER TABLE specs ADD COLUMN IF NOT EXISTS key TEXT;
+ALTER TABLE specs ADD COLUMN IF NOT EXISTS value DOUBLE PRECISION;
+ALTER TABLE specs ADD COLUMN IF NOT EXISTS unit TEXT;
+
+CREATE INDEX IF NOT EXISTS ix_specs_key_value
+    ON specs (key, value, device_id);
+
+-- Backfill the specs already scraped, the same way helpers.convert_spec_value does
+UPDATE specs SET key = 'display_size', unit = 'in',
+    value = CAST(substring(replace(description, ',', '') FROM '([0-9]+(\.[0-9]+)?)') AS DOUBLE PRECISION)
+    WHERE key IS NULL AND category LIKE '%Display%' AND name = 'Size' AND description ~ '[0-9]';
+
+UPDATE specs SET key = 'refresh_rate', unit = 'Hz',
+    value = CAST(substring(replace(description, ',', '') FROM '([0-9]+(\.[0-9]+)?)') AS DOUBLE PRECISION)
+    WHERE key IS NULL AND category LIKE '%Display%' AND name = 'Refresh rate' AND description ~ '[0-9]';
+
+UPDATE specs SET key = 'battery_capacity', unit = 'mAh',
+    value = CAST(substring(replace(description, ',', '') FROM '([0-9]+(\.[0-9]+)?)') AS DOUBLE PRECISION)
+    WHERE key IS NULL AND category LIKE '%Battery%' AND name = 'Capacity' AND description ~ '[0-9]';
+
+UPDATE specs SET key = 'charging_speed', unit = 'W',
+    value = CAST(substring(replace(description, ',', '') FROM '([0-9]+(\.[0-9]+)?)') AS DOUBLE PRECISION)
+    WHERE key IS NULL AND category LIKE '%Battery%' AND name = 'Charging speed' AND description ~ '[0-9]';
+
+UPDATE specs SET key = CASE WHEN name = 'RAM' THEN 'ram' ELSE 'storage' END, unit = 'GB',
+    value = CAST(substring(replace(description, ',', '') FROM '([0-9]+(\.[0-9]+)?)\s*(MB|GB|TB)') AS DOUBLE PRECISION)
+        * CASE substring(description FROM '[0-9]\s*(MB|GB|TB)') WHEN 'MB' THEN 1.0 / 1024 WHEN 'TB' THEN 1024 ELSE 1 END
+    WHERE key IS NULL AND category LIKE '%Hardware%' AND name IN ('RAM', 'Internal storage')
+        AND description ~ '[0-9]\s*(MB|GB|TB)';
+
+UPDATE specs SET key = 'weight', unit = 'g',
+    value = CAST(substring(replace(description, ',', '') FROM '([0-9]+(\.[0-9]+)?)\s*g\y') AS DOUBLE PRECISION)
+    WHERE key IS NULL AND category LIKE '%Design%' AND name = 'Weight' AND description ~ '[0-9]\s*g\y';
+
+UPDATE specs SET key = 'price', unit = 'USD',
+    value = CAST(substring(replace(description, ',', '') FROM '\$\s*([0-9]+(\.[0-9]+)?)') AS DOUBLE PRECISION)
+    WHERE key IS NULL AND category LIKE '%Buyers information%' AND name = 'Price' AND description ~ '\$\s*[0-9]';
+
+-- One value per key per device, as Spec.replace_all keeps, so sorting by a
+-- spec can't repeat a device: only the first spec scraped (the lowest id)
+UPDATE specs SET key = NULL, value = NULL, unit = NULL
+    WHERE key IS NOT NULL AND id NOT IN (
+        SELECT DISTINCT ON (device_id, key) id FROM specs
+        WHERE key IS NOT NULL ORDER BY device_id, key, id);
@@ -0,0 +1,7 @@
+-- Indexes for the device list filters: get-latest-devices reads devices in
+-- (release_date DESC NULLS LAST, id) order, and manufacturer filters join on manufacturer_id
+CREATE INDEX IF NOT EXISTS ix_devices_release_date_id
+    ON devices (release_date DESC NULLS LAST, id);
+
+CREATE INDEX IF NOT EXISTS ix_devices_manufacturer_id
+    ON devices (manufacturer_id);
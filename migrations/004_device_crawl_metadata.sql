@@ -0,0 +1,8 @@
+-- Per device crawl metadata, so incremental refreshes (python -m api.crawler
+-- --refresh) only re-fetch unreleased, failed and stale devices
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS last_fetched TIMESTAMP;
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS scrape_status TEXT;
+
+CREATE INDEX IF NOT EXISTS ix_devices_last_fetched
+    ON devices (last_fetched);
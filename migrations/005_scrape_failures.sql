@@ -0,0 +1,15 @@
+-- Queue of device pages that couldn't be scraped, retried with backoff
+-- by python -m api.crawler --retry-failures (replaces spec_failed.txt)
+CREATE TABLE IF NOT EXISTS scrape_failures (
+    id SERIAL PRIMARY KEY,
+    device_id INTEGER NOT NULL UNIQUE REFERENCES devices (id) ON DELETE CASCADE,
+    url TEXT NOT NULL,
+    error_type TEXT NOT NULL,
+    http_status INTEGER,
+    attempts INTEGER NOT NULL,
+    last_attempt_at TIMESTAMP NOT NULL,
+    next_attempt_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_scrape_failures_next_attempt_at
+    ON scrape_failures (next_attempt_at);
@@ -0,0 +1,4 @@
+-- Requests served per API key, added in batches by each worker's
+-- UsageCounter (api/ratelimit.py) rather than per request
+ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS request_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS last_used TIMESTAMP;
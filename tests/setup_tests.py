@@ -1,11 +1,14 @@
 from app.app import app
 from app.database import db
 from api.models import Manufacturer, Device
+from api.ratelimit import rate_limiter, MemoryStore
 import datetime
 
 app.config['TESTING'] = True
 app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///grabaphone_test'
 app.config['SQLALCHEMY_ECHO'] = False
+# Rate limit buckets are kept in this process, not in the host's shared store
+rate_limiter.store = MemoryStore()
 
 
 def seed_db():
@@ -63,3 +66,4 @@ def seed_db():
         )
         db.session.add(dev)
         db.session.commit()
+
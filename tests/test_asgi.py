@@ -0,0 +1,112 @@
+from unittest import TestCase, SkipTest
+from unittest.mock import patch
+from api.models import APIKey, Spec
+from api.cache import response_cache
+from app.database import REPLICA
+from tests.setup_tests import app, seed_db
+import run  # registers the app's routes
+
+try:
+    from starlette.testclient import TestClient
+    from app.asgi import app as asgi_app, compile_query, validate_key
+except ImportError:
+    raise SkipTest('the async serving mode needs requirements-async.txt')
+
+
+class ASGITestCase(TestCase):
+    '''Async serving mode Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+        Spec.replace_all({
+            1: [{'category': 'Battery', 'name': 'Capacity', 'description': '2815 mAh'}],
+            2: [{'category': 'Battery', 'name': 'Capacity', 'description': '5000 mAh'},
+                {'category': 'Display', 'name': 'Size', 'description': '6.8 inches'}]
+        })
+        cls.key = APIKey.generate_and_create().key
+        cls.client = TestClient(asgi_app)
+        cls.client.__enter__()
+
+    def setUp(self):
+        self.flask = app.test_client()
+        response_cache.clear()
+
+    def assertSameResponse(self, route: str, **params):
+        '''Asserts the async route responds as the Flask route does'''
+        params = {'key': self.key, **params}
+        expected = self.flask.get(route, query_string=params)
+        response_cache.clear()
+        response = self.client.get(route, params=params)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.json(), expected.get_json())
+        return response
+
+    def test_get_manufacturers(self):
+        '''Serves get-manufacturers as Flask does'''
+        self.assertSameResponse('/api/get-manufacturers')
+        self.assertSameResponse('/api/get-manufacturers', manufacturer='sam')
+        cursor = self.assertSameResponse(
+            '/api/get-manufacturers', limit=1).json()['next_cursor']
+        self.assertSameResponse('/api/get-manufacturers', limit=1, cursor=cursor)
+
+    def test_get_devices(self):
+        '''Serves get-devices and get-latest-devices as Flask does'''
+        for route in ('/api/get-devices', '/api/get-latest-devices'):
+            self.assertSameResponse(route)
+            self.assertSameResponse(route, manufacturer='Samsung', name='galaxy')
+            self.assertSameResponse(route, specs='battery_capacity:gte:3000')
+            self.assertSameResponse(route, sort_by='-battery_capacity', limit=2)
+            self.assertSameResponse(route, fields='name,specs')
+            cursor = self.assertSameResponse(route, limit=2).json()['next_cursor']
+            self.assertSameResponse(route, limit=2, cursor=cursor)
+        self.assertSameResponse('/api/get-latest-devices', is_released='true')
+
+    def test_invalid_key(self):
+        '''Responds 401 without a valid API key'''
+        response = self.client.get('/api/get-devices', params={'key': 'invalid'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_if_none_match(self):
+        '''Responds 304 when the client's ETag is current'''
+        params = {'key': self.key}
+        etag = self.client.get('/api/get-devices', params=params).headers['ETag']
+        response = self.client.get('/api/get-devices', params=params,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_none_match_forms(self):
+        '''Compares lists, weak ETags and * as the Flask routes do'''
+        params = {'key': self.key}
+        etag = self.client.get('/api/get-devices', params=params).headers['ETag']
+        for if_none_match, status in ((f'"stale", {etag}', 304), (f'W/{etag}', 304),
+                                      ('*', 304), ('"stale"', 200)):
+            headers = {'If-None-Match': if_none_match}
+            expected = self.flask.get('/api/get-devices', query_string=params, headers=headers)
+            response = self.client.get('/api/get-devices', params=params, headers=headers)
+            self.assertEqual((response.status_code, expected.status_code), (status, status), if_none_match)
+
+    def test_keys_checked_on_primary(self):
+        '''Checks API keys on the primary when the routes read from a replica'''
+        # The test database stands in for the replica, on its own pool
+        self.client.__exit__(None, None, None)
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA: app.config['SQLALCHEMY_DATABASE_URI']}
+        try:
+            with TestClient(asgi_app) as client, patch('app.asgi.validate_key', wraps=validate_key) as validate:
+                response = client.get('/api/get-devices', params={'key': self.key})
+                self.assertEqual(response.status_code, 200)
+                self.assertIsNot(asgi_app.state.primary, asgi_app.state.pool)
+                self.assertIs(validate.call_args[0][0], asgi_app.state.primary)
+        finally:
+            del app.config['SQLALCHEMY_BINDS']
+            self.client.__enter__()
+
+    def test_compile_query(self):
+        '''Queries compile to asyncpg's numbered parameters'''
+        sql, params = compile_query(APIKey.key_query('abc'))
+        self.assertIn('api_keys.key = $1', sql)
+        self.assertEqual(params, ['abc', 1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.__exit__(None, None, None)
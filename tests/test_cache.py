@@ -0,0 +1,53 @@
+from unittest import TestCase
+from unittest.mock import patch
+from api.cache import TTLCache
+
+
+class TTLCacheTestCase(TestCase):
+    '''TTLCache Test Case'''
+
+    def setUp(self):
+        self.cache = TTLCache(maxsize=2, ttl=10)
+
+    def test_get_missing(self):
+        '''Returns MISSING and counts a miss for unknown keys'''
+        self.assertIs(self.cache.get('key'), TTLCache.MISSING)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_set_and_get(self):
+        '''Returns stored values, including falsy ones, and counts hits'''
+        self.cache.set('valid', True)
+        self.cache.set('invalid', False)
+        self.assertTrue(self.cache.get('valid'))
+        self.assertIs(self.cache.get('invalid'), False)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_expiry(self):
+        '''Entries expire after their ttl'''
+        with patch('api.cache.time.monotonic', return_value=100):
+            self.cache.set('short', 1, ttl=1)
+            self.cache.set('long', 2)
+        with patch('api.cache.time.monotonic', return_value=105):
+            self.assertIs(self.cache.get('short'), TTLCache.MISSING)
+            self.assertEqual(self.cache.get('long'), 2)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_evicts_least_recently_used(self):
+        '''Evicts the least recently used entry when full'''
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('c', self.cache)
+
+    def test_invalidate_and_clear(self):
+        '''Removes single entries and all entries'''
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.invalidate('a')
+        self.assertNotIn('a', self.cache)
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['size'], 0)
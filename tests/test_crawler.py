@@ -0,0 +1,195 @@
+from unittest import TestCase
+from unittest.mock import patch
+import datetime
+import os
+from api.crawler import Crawler, DirectoryFetcher, HostRateLimiter
+from api.models import Manufacturer, Device, Spec, ScrapeFailure
+from api.fetch import FetchError
+from api.parsing import parse_device_page
+from api.cache import response_cache
+from tests.setup_tests import db
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'phonearena')
+SE_URL = 'https://www.phonearena.com/phones/Apple-iPhone-SE-2020_id11330'
+
+
+class HostRateLimiterTestCase(TestCase):
+    '''HostRateLimiter Test Case'''
+
+    def test_delay_per_host(self):
+        '''Spaces out requests to the same host but not other hosts'''
+        limiter = HostRateLimiter(rate=2)
+        with patch('api.crawler.time.monotonic', return_value=10):
+            self.assertEqual(limiter.delay('https://a.com/1'), 0)
+            self.assertEqual(limiter.delay('https://a.com/2'), 0.5)
+            self.assertEqual(limiter.delay('https://a.com/3'), 1)
+            self.assertEqual(limiter.delay('https://b.com/1'), 0)
+
+    def test_no_limit(self):
+        '''Never delays with a rate of 0'''
+        limiter = HostRateLimiter(rate=0)
+        self.assertEqual(limiter.delay('https://a.com/1'), 0)
+        self.assertEqual(limiter.delay('https://a.com/1'), 0)
+
+
+class DirectoryFetcherTestCase(TestCase):
+    '''DirectoryFetcher Test Case'''
+
+    def test_fetch(self):
+        '''Returns saved pages by url, and None for missing pages'''
+        fetcher = DirectoryFetcher(FIXTURES)
+        page = fetcher.fetch(
+            'https://www.phonearena.com/phones/manufacturers/Apple/page/1')
+        self.assertIn('finder-results', page.text)
+        self.assertTrue(page.changed)
+        with self.assertRaises(FetchError) as error:
+            fetcher.fetch('https://www.phonearena.com/phones/manufacturers/Apple/page/2')
+        self.assertEqual(error.exception.http_status, 404)
+
+
+class CrawlerTestCase(TestCase):
+    '''Crawler Test Case'''
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+    def crawl(self, **kwargs):
+        crawler = Crawler(fetcher=DirectoryFetcher(FIXTURES),
+                          workers=4, batch_size=2, **kwargs)
+        return crawler.run()
+
+    def test_run(self):
+        '''Crawls every manufacturer, device and spec from saved pages'''
+        stats = self.crawl()
+        self.assertEqual(stats['manufacturers'], 2)
+        self.assertEqual(Manufacturer.query.count(), 2)
+        self.assertEqual(Device.query.count(), 4)
+        self.assertEqual(stats['failed'], [SE_URL])
+
+        iphone = Device.query.filter_by(name='Apple iPhone 12').one()
+        self.assertEqual(iphone.manufacturer.name, 'Apple')
+        self.assertEqual(iphone.rating, 8.4)
+        self.assertEqual(iphone.release_date, datetime.date(2020, 10, 23))
+        self.assertIn('Apple-iPhone-12.jpg', iphone.image)
+        self.assertEqual(iphone.serialize_specs()['Display'][0], {
+                         'name': 'Size', 'description': '6.1'})
+        self.assertEqual(Spec.query.count(), stats['specs'])
+
+    def test_rerun_does_not_duplicate(self):
+        '''Crawling twice leaves one row per manufacturer, device and spec'''
+        self.crawl()
+        specs = Spec.query.count()
+        self.crawl()
+        self.assertEqual(Manufacturer.query.count(), 2)
+        self.assertEqual(Device.query.count(), 4)
+        self.assertEqual(Spec.query.count(), specs)
+
+    def test_rerun_skips_unchanged(self):
+        '''Device pages that haven't changed aren't parsed or written again'''
+        self.crawl()
+        fetcher = DirectoryFetcher(FIXTURES)
+        real_fetch = fetcher.fetch
+
+        def fetch(url, conditional=True):
+            page = real_fetch(url, conditional)
+            if page and conditional and '_id' in url:
+                return page._replace(changed=False)
+            return page
+        fetcher.fetch = fetch
+
+        stats = Crawler(fetcher=fetcher, workers=4).run()
+        self.assertEqual(stats['unchanged'], 3)
+        self.assertEqual(stats['specs'], 0)
+        self.assertEqual(Device.query.filter_by(
+            name='Apple iPhone 12').one().rating, 8.4)
+
+    def test_refresh(self):
+        '''Refreshes only stale devices, skipping unchanged specs'''
+        self.crawl()
+        iphone = Device.query.filter_by(name='Apple iPhone 12').one()
+        iphone.last_fetched = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+        db.session.commit()
+
+        stats = Crawler(fetcher=DirectoryFetcher(FIXTURES), workers=4).refresh()
+        self.assertEqual(stats['devices'], 1)
+        self.assertEqual(stats['unchanged'], 1)
+        self.assertEqual(stats['specs'], 0)
+        self.assertEqual(stats['failed'], [])
+        iphone = Device.query.filter_by(name='Apple iPhone 12').one()
+        self.assertGreater(iphone.last_fetched, datetime.datetime.utcnow() - datetime.timedelta(days=1))
+        self.assertEqual(iphone.scrape_status, Device.SCRAPE_OK)
+
+    def test_refresh_new_details(self):
+        '''A new rating with the same specs is written and clears the cached responses'''
+        self.crawl()
+        iphone = Device.query.filter_by(name='Apple iPhone 12').one()
+        iphone.last_fetched = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+        db.session.commit()
+        response_cache.set('key', 'stale')
+
+        def parse(text):
+            return {**parse_device_page(text), 'rating': 9.0}
+        with patch('api.crawler.parse_device_page', side_effect=parse):
+            stats = Crawler(fetcher=DirectoryFetcher(FIXTURES), workers=4).refresh()
+        self.assertEqual(stats['unchanged'], 0)
+        self.assertEqual(Device.query.filter_by(name='Apple iPhone 12').one().rating, 9.0)
+        self.assertNotIn('key', response_cache)
+
+    def test_failures_queued(self):
+        '''Device pages that fail are queued with their error and a retry time'''
+        self.crawl()
+        failure = ScrapeFailure.query.one()
+        self.assertEqual(failure.url, SE_URL)
+        self.assertEqual((failure.error_type, failure.http_status,
+                          failure.attempts), ('http_error', 404, 1))
+        self.assertGreater(failure.next_attempt_at, failure.last_attempt_at)
+        self.assertEqual(failure.device.scrape_status, Device.SCRAPE_FAILED)
+
+    def test_retry_failures(self):
+        '''Retries due failures, backing off on failure and dropping them on success'''
+        self.crawl()
+        failure = ScrapeFailure.query.one()
+        failure.next_attempt_at = datetime.datetime.utcnow()
+        db.session.commit()
+
+        crawler = Crawler(fetcher=DirectoryFetcher(FIXTURES), workers=4)
+        stats = crawler.retry_failures()
+        self.assertEqual(stats['failed'], [SE_URL])
+        failure = ScrapeFailure.query.one()
+        self.assertEqual(failure.attempts, 2)
+        self.assertGreater(failure.next_attempt_at, datetime.datetime.utcnow())
+        # Not due yet
+        self.assertEqual(crawler.retry_failures()['devices'], 1)
+
+        failure.next_attempt_at = datetime.datetime.utcnow()
+        db.session.commit()
+        fetcher = DirectoryFetcher(FIXTURES)
+        fetcher.path_for = lambda url: DirectoryFetcher.path_for(
+            fetcher, url.replace('Apple-iPhone-SE-2020_id11330', 'Apple-iPhone-12_id11417'))
+        Crawler(fetcher=fetcher).retry_failures()
+        self.assertEqual(ScrapeFailure.query.count(), 0)
+        self.assertEqual(Device.query.filter_by(
+            url=SE_URL).one().scrape_status, Device.SCRAPE_OK)
+
+    def test_retry_failures_gives_up(self):
+        '''Failures stop being retried after the max attempts'''
+        self.crawl()
+        with patch('api.models.SCRAPE_MAX_ATTEMPTS', 2):
+            failure = ScrapeFailure.query.one()
+            failure.next_attempt_at = datetime.datetime.utcnow()
+            db.session.commit()
+            with patch('api.crawler.time.sleep') as sleep:
+                Crawler(fetcher=DirectoryFetcher(FIXTURES)).retry_failures(wait=True)
+        sleep.assert_not_called()
+        failure = ScrapeFailure.query.one()
+        self.assertEqual(failure.attempts, 2)
+        self.assertIsNone(failure.next_attempt_at)
+
+    def test_run_single_page(self):
+        '''Only crawls the configured number of listing pages'''
+        self.crawl(pages=1)
+        self.assertEqual(Device.query.count(), 3)
+
+    def tearDown(self):
+        db.session.rollback()
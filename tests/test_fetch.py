@@ -0,0 +1,133 @@
+from unittest import TestCase
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+import hashlib
+import os
+import shutil
+import tempfile
+from api.fetch import Fetcher, FetchError, PageCache, make_session, make_fetcher, get_session
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures',
+                        'phonearena', 'www.phonearena.com')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    '''
+    Serves the saved phonearena pages with ETags, answering 304 when the
+    client's If-None-Match is current. /flaky fails twice before working,
+    and /throttled always answers 429
+    '''
+    requests = []
+    flaky_failures = 0
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        path = self.path
+        if path == '/throttled':
+            return self.respond(429, b'')
+        if path == '/flaky':
+            if FixtureHandler.flaky_failures < 2:
+                FixtureHandler.flaky_failures += 1
+                return self.respond(503, b'')
+            path = '/phones/manufacturers'
+
+        try:
+            with open(os.path.join(FIXTURES, *path.strip('/').split('/')) + '.html', 'rb') as page:
+                body = page.read()
+        except FileNotFoundError:
+            return self.respond(404, b'')
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.respond(304, b'', etag)
+        self.respond(200, body, etag)
+
+    def respond(self, status: int, body: bytes, etag: str = None):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetcherTestCase(TestCase):
+    '''Fetcher Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fetcher = Fetcher(session=make_session(backoff=0),
+                               cache=PageCache(self.cache_dir))
+        FixtureHandler.requests = []
+        FixtureHandler.flaky_failures = 0
+
+    def test_fetch(self):
+        '''Returns the page, and None for missing pages'''
+        page = self.fetcher.fetch(self.base_url + '/phones/manufacturers')
+        self.assertIn('manufacturer-item', page.text)
+        self.assertTrue(page.changed)
+        with self.assertRaises(FetchError) as error:
+            self.fetcher.fetch(self.base_url + '/missing')
+        self.assertEqual((error.exception.error_type,
+                          error.exception.http_status), ('http_error', 404))
+
+    def test_conditional_fetch(self):
+        '''Fetching a cached page again is answered with 304 and the cached page'''
+        url = self.base_url + '/phones/manufacturers'
+        first = self.fetcher.fetch(url)
+        second = self.fetcher.fetch(url)
+        self.assertFalse(second.changed)
+        self.assertEqual(second.text, first.text)
+        self.assertIsNone(FixtureHandler.requests[0][1])
+        self.assertIsNotNone(FixtureHandler.requests[1][1])
+
+    def test_unconditional_fetch(self):
+        '''conditional=False always asks for the full page'''
+        url = self.base_url + '/phones/manufacturers'
+        self.fetcher.fetch(url)
+        self.assertTrue(self.fetcher.fetch(url, conditional=False).changed)
+
+    def test_retries(self):
+        '''Retries failed responses with backoff'''
+        page = self.fetcher.fetch(self.base_url + '/flaky')
+        self.assertIsNotNone(page)
+        self.assertEqual(len(FixtureHandler.requests), 3)
+
+    def test_throttled(self):
+        '''Raises 429s without retrying them'''
+        with self.assertRaises(FetchError) as error:
+            self.fetcher.fetch(self.base_url + '/throttled')
+        self.assertEqual(error.exception.http_status, 429)
+        self.assertEqual(len(FixtureHandler.requests), 1)
+
+    def test_connection_error(self):
+        '''Raises a connection_error when the server can't be reached'''
+        fetcher = Fetcher(session=make_session(backoff=0), timeout=(0.5, 0.5))
+        with self.assertRaises(FetchError) as error:
+            fetcher.fetch('http://127.0.0.1:9/')
+        self.assertEqual(error.exception.error_type, 'connection_error')
+
+    def test_shared_session(self):
+        '''Every fetcher uses the shared session by default'''
+        self.assertIs(Fetcher().session, get_session())
+
+    def test_pool_size(self):
+        '''make_fetcher pools a connection for each worker'''
+        session = make_fetcher(workers=12).session
+        self.assertEqual(session.get_adapter('https://www.phonearena.com')._pool_maxsize, 12)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
@@ -1,6 +1,19 @@
 from unittest import TestCase
 from datetime import date
-from api.helpers import convert_to_date, make_date_valid
+from api.helpers import convert_to_date, make_date_valid, strptime_convert_to_date, encode_cursor, decode_cursor, convert_spec_value, MONTHS
+import random
+
+
+def random_date_str(rng: random.Random) -> str:
+    '''Returns a string that looks more or less like a phonearena release date'''
+    month = rng.choice(MONTHS)
+    month = rng.choice([month, month[:3], month.upper(), month.lower(), month[:4], 'Q1', 'Q4'])
+    day = rng.choice([str(rng.randint(0, 35)), f'0{rng.randint(0, 9)}', f' {rng.randint(1, 9)}'])
+    year = rng.choice([str(rng.randint(1990, 2030))] * 5 + ['0000', '999', '20211'])
+    separator = rng.choice([' ', '  ', ', ', ',', ''])
+    date_str = rng.choice([f'{month} {day},{separator}{year}'] * 3 + [f'{month}{separator}{year}'] * 3 +
+                          [year, f'{month} {day}', 'Yes', 'No information', ''])
+    return rng.choice(['', '(Official) ', ' ']) + date_str + rng.choice(['', ' ', ' (Official)'])
 
 
 class ConvertToDateTestCase(TestCase):
@@ -45,6 +58,20 @@ class ConvertToDateTestCase(TestCase):
         # Regex matches XXXX-XX-XX i.e. 2020-08-21
         self.assertEqual(f'{converted_date}', '1900-01-01')
 
+    def test_quarters_and_notes(self):
+        '''Returns the date make_date_valid makes of quarters and notes'''
+        self.assertEqual(convert_to_date('Q3 2021'), date(2021, 7, 1))
+        self.assertEqual(convert_to_date('(Official) Sep 24, 2021'), date(2021, 9, 24))
+        self.assertEqual(convert_to_date('Feb 30, 2021'), date(1900, 1, 1))
+
+    def test_matches_strptime(self):
+        '''Returns what strptime made of the string make_date_valid fixes, for random strings'''
+        rng = random.Random(0)
+        for _ in range(5000):
+            date_str = random_date_str(rng)
+            self.assertEqual(convert_to_date(date_str),
+                             strptime_convert_to_date(make_date_valid(date_str)), repr(date_str))
+
 
 class MakeDateValidTestCase(TestCase):
     '''make_date_valid Test Case'''
@@ -99,3 +126,52 @@ class MakeDateValidTestCase(TestCase):
         '''Returns None with invalid type bool'''
 
         self.assertIsNone(make_date_valid(True))
+
+
+class CursorTestCase(TestCase):
+    '''encode_cursor & decode_cursor Test Case'''
+
+    def test_round_trip(self):
+        '''Decodes to the values the cursor was encoded from'''
+        cursor = encode_cursor({'release_date': date(2021, 1, 29), 'id': 7})
+        self.assertIsInstance(cursor, str)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), {
+                         'release_date': '2021-01-29', 'id': 7})
+
+    def test_invalid_cursor(self):
+        '''Returns None for strings that are not cursors'''
+        self.assertIsNone(decode_cursor('not a cursor'))
+        self.assertIsNone(decode_cursor(encode_cursor([1, 2])))
+        self.assertIsNone(decode_cursor())
+        self.assertIsNone(decode_cursor(7))
+
+
+class ConvertSpecValueTestCase(TestCase):
+    '''convert_spec_value Test Case'''
+
+    def test_numeric_specs(self):
+        '''Returns the key, value and unit of numeric specs'''
+        self.assertEqual(convert_spec_value('Display', 'Size', '6.1'),
+                         ('display_size', 6.1, 'in'))
+        self.assertEqual(convert_spec_value('Battery', 'Capacity', '2815 mAh'),
+                         ('battery_capacity', 2815.0, 'mAh'))
+        self.assertEqual(convert_spec_value('Design', 'Weight', '5.78 oz (164.0 g)'),
+                         ('weight', 164.0, 'g'))
+        self.assertEqual(convert_spec_value('Buyers information', 'Price', '$ 1,099'),
+                         ('price', 1099.0, 'USD'))
+
+    def test_unit_conversion(self):
+        '''Returns memory in GB whatever unit it is listed in'''
+        self.assertEqual(convert_spec_value('Hardware', 'RAM', '512MB'),
+                         ('ram', 0.5, 'GB'))
+        self.assertEqual(convert_spec_value('Hardware', 'Internal storage', '1TB (Apple)'),
+                         ('storage', 1024.0, 'GB'))
+
+    def test_not_numeric(self):
+        '''Returns Nones: specs that aren't numeric or have no number'''
+        self.assertEqual(convert_spec_value('Display', 'Technology', 'OLED'),
+                         (None, None, None))
+        self.assertEqual(convert_spec_value('Battery', 'Capacity', 'No info'),
+                         (None, None, None))
+        self.assertEqual(convert_spec_value(), (None, None, None))
@@ -1,7 +1,10 @@
 from unittest import TestCase
 from api.JSONValidator import Validator
 from api.models import Manufacturer, Device
+from api.helpers import encode_cursor
 from tests.setup_tests import db, seed_db
+from app.profiling import QueryCounter
+import datetime
 
 
 class ConvertNumTestCase(TestCase):
@@ -54,6 +57,101 @@ class ConvertNumTestCase(TestCase):
         self.assertIsNone(converted)
 
 
+class ConvertCursorTestCase(TestCase):
+    '''convert_cursor Test Case'''
+
+    def test_id_cursor(self):
+        '''Returns the id held by the cursor'''
+        cursor = encode_cursor({'id': 7})
+        self.assertEqual(Validator.convert_cursor(cursor), {'id': 7})
+
+    def test_release_date_cursor(self):
+        '''Returns the release date held by the cursor as a date'''
+        cursor = encode_cursor({'release_date': '2021-01-29', 'id': 7})
+        self.assertEqual(Validator.convert_cursor(cursor), {
+                         'release_date': datetime.date(2021, 1, 29), 'id': 7})
+        cursor = encode_cursor({'release_date': None, 'id': 7})
+        self.assertEqual(Validator.convert_cursor(cursor), {
+                         'release_date': None, 'id': 7})
+
+    def test_invalid_cursor(self):
+        '''Returns None: invalid cursors'''
+        self.assertIsNone(Validator.convert_cursor('not-a-cursor'))
+        self.assertIsNone(Validator.convert_cursor(
+            encode_cursor({'id': '7'})))
+        self.assertIsNone(Validator.convert_cursor(
+            encode_cursor({'release_date': 'yesterday', 'id': 7})))
+        self.assertIsNone(Validator.convert_cursor(None))
+
+
+class ConvertIdsTestCase(TestCase):
+    '''convert_ids Test Case'''
+
+    def test_valid_ids(self):
+        '''Returns unique integer ids in order'''
+        self.assertEqual(Validator.convert_ids('4, 2,4'), [4, 2])
+        self.assertEqual(Validator.convert_ids([4, '2', 9]), [4, 2, 9])
+
+    def test_invalid_ids(self):
+        '''Returns None: any unconvertable id'''
+        self.assertIsNone(Validator.convert_ids('1,two'))
+        self.assertIsNone(Validator.convert_ids([1, None]))
+        self.assertIsNone(Validator.convert_ids(7))
+        self.assertIsNone(Validator.convert_ids())
+
+
+class ConvertSpecsTestCase(TestCase):
+    '''convert_specs and convert_sort_by Test Case'''
+
+    def test_valid_specs(self):
+        '''Returns (key, operator, value) tuples'''
+        self.assertEqual(Validator.convert_specs('battery_capacity:gte:5000, display_size:lt:6.5'),
+                         [('battery_capacity', 'gte', 5000.0), ('display_size', 'lt', 6.5)])
+
+    def test_invalid_specs(self):
+        '''Returns None: unknown keys or operators, or values that aren't numbers'''
+        self.assertIsNone(Validator.convert_specs('color:eq:5'))
+        self.assertIsNone(Validator.convert_specs('ram:about:8'))
+        self.assertIsNone(Validator.convert_specs('ram:eq:eight'))
+        self.assertIsNone(Validator.convert_specs('ram:eq'))
+        self.assertIsNone(Validator.convert_specs(7))
+
+    def test_sort_by(self):
+        '''Returns (key, descending), or None for unknown keys'''
+        self.assertEqual(Validator.convert_sort_by('ram'), ('ram', False))
+        self.assertEqual(Validator.convert_sort_by('-ram'), ('ram', True))
+        self.assertIsNone(Validator.convert_sort_by('color'))
+
+
+class ConvertFieldsTestCase(TestCase):
+    '''convert_fields Test Case'''
+
+    def test_valid_fields(self):
+        '''Returns the fields once each, in serialized order'''
+        self.assertEqual(Validator.convert_fields('specs, name,id,name'),
+                         ('id', 'name', 'specs'))
+
+    def test_invalid_fields(self):
+        '''Returns None: unknown fields, no fields, or non-strings'''
+        self.assertIsNone(Validator.convert_fields('name,price'))
+        self.assertIsNone(Validator.convert_fields(' , '))
+        self.assertIsNone(Validator.convert_fields(7))
+
+
+class ConvertNameTestCase(TestCase):
+    '''convert_name Test Case'''
+
+    def test_valid_name(self):
+        '''Returns the trimmed name'''
+        self.assertEqual(Validator.convert_name(' Galaxy S '), 'Galaxy S')
+
+    def test_invalid_name(self):
+        '''Returns None: blank or non-string names'''
+        self.assertIsNone(Validator.convert_name('  '))
+        self.assertIsNone(Validator.convert_name(7))
+        self.assertIsNone(Validator.convert_name(None))
+
+
 class CheckNameTestCase(TestCase):
     '''check_name Test Case'''
 
@@ -223,7 +321,8 @@ class SanitizeJSONTestCase(TestCase):
 
     def test_invalid_values(self):
         '''
-        Returns data of default types and values on invalid data
+        Returns data of default types and values on invalid data, passing
+        names through for the query to match
         '''
         self.json_data = {
             'manufacturer': 'Test Manufacturer Plus',
@@ -234,7 +333,17 @@ class SanitizeJSONTestCase(TestCase):
         }
         new_data = self.jsonValidator.sanitize_json(
             data=self.json_data, valid_params=[*self.json_data.keys()])
-        self.assertEqual(self.default, new_data)
+        self.assertEqual({**self.default, 'manufacturer': 'Test Manufacturer Plus',
+                          'name': 'Test Grabaphone phone 0100'}, new_data)
+
+    def test_no_queries(self):
+        '''
+        Validates without querying the DB
+        '''
+        with QueryCounter() as counter:
+            self.jsonValidator.sanitize_json(
+                data=self.json_data, valid_params=[*self.json_data.keys()])
+        self.assertEqual(counter.count, 0)
 
     def test_invalid_type_none(self):
         '''
@@ -0,0 +1,42 @@
+from unittest import TestCase
+from api.models import Spec
+from api.migrate import MIGRATIONS_DIR
+from tests.setup_tests import db, seed_db
+import os
+
+
+def apply_migration(name: str):
+    with open(os.path.join(MIGRATIONS_DIR, name)) as migration:
+        db.session.execute(migration.read())
+    db.session.commit()
+
+
+class SpecValuesMigrationTestCase(TestCase):
+    '''Spec values migration Test Case'''
+
+    def setUp(self):
+        seed_db()
+
+    def add_display_sizes(self, key: str = None, values: tuple = (None, None)):
+        '''Adds device 1 a main and a secondary display size'''
+        for category, description, value in zip(('Display', 'Secondary Display'),
+                                                ('6.1 inches', '1.9 inches'), values):
+            db.session.add(Spec(device_id=1, category=category, name='Size',
+                                description=description, key=key, value=value))
+        db.session.add(Spec(device_id=2, category='Battery',
+                            name='Capacity', description='5,000 mAh'))
+        db.session.commit()
+
+    def numeric_specs(self) -> list:
+        specs = Spec.query.filter(Spec.key.isnot(None)).order_by(Spec.device_id).all()
+        return [(spec.device_id, spec.key, spec.value) for spec in specs]
+
+    def test_backfill_one_value_per_key(self):
+        '''Backfills the first spec of each key per device only'''
+        self.add_display_sizes()
+        apply_migration('002_spec_values.sql')
+        self.assertEqual(self.numeric_specs(),
+                         [(1, 'display_size', 6.1), (2, 'battery_capacity', 5000)])
+
+    def tearDown(self):
+        db.session.rollback()
@@ -1,7 +1,14 @@
-from unittest import TestCase
-from api.models import APIKey, Device, Manufacturer
+from unittest import TestCase, SkipTest
+from unittest.mock import MagicMock
+from api.models import APIKey, Device, Manufacturer, Spec, ScrapeFailure, DEVICE_FIELDS
+from api.fetch import Page, Fetcher, DirectoryFetcher, set_fetcher
 from tests.setup_tests import db, seed_db
+from app.profiling import QueryCounter
+from sqlalchemy import nullslast
 import datetime
+import os
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'phonearena')
 
 
 class APIKeyTestCase(TestCase):
@@ -24,6 +31,27 @@ class APIKeyTestCase(TestCase):
         is_validated = APIKey.validate(key)
         self.assertFalse(is_validated)
 
+    def test_validate_cached(self):
+        '''Test validating a key twice only queries the DB once'''
+        key = APIKey.generate_and_create().key
+        APIKey.cache.clear()
+        hits = APIKey.cache.hits
+        with QueryCounter() as counter:
+            self.assertTrue(APIKey.validate(key))
+            self.assertTrue(APIKey.validate(key))
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(APIKey.cache.hits, hits + 1)
+
+    def test_create_invalidates_negative_entry(self):
+        '''Test that a key cached as invalid is valid once created'''
+        key = APIKey.generate()
+        self.assertFalse(APIKey.validate(key))
+        with QueryCounter() as counter:
+            self.assertFalse(APIKey.validate(key))
+        self.assertEqual(counter.count, 0)
+        APIKey.create(key)
+        self.assertTrue(APIKey.validate(key))
+
     def test_generate(self):
         '''Test Generation of 12-character hexadecimal API Key is successful'''
         key = APIKey.generate()
@@ -50,6 +78,55 @@ class APIKeyTestCase(TestCase):
         db.session.rollback()
 
 
+def listing_page(*devices):
+    '''Builds a device listing page holding the given (url, name) devices'''
+    items = ''.join(f'<div class="stream-item"><a href="{url}"><p class="title">{name}</p></a></div>'
+                    for url, name in devices)
+    return f'<html><body><div id="finder-results">{items}</div></body></html>'
+
+
+class ManufacturerScrapeDevicesTestCase(TestCase):
+    '''Manufacturer.scrape_devices Test Case'''
+
+    def setUp(self):
+        self.manufacturer = Manufacturer(
+            id=1, name='Apple', url='https://pa.com/apple')
+        self.pages = {
+            'https://pa.com/apple': listing_page(('https://pa.com/1', 'Phone 1'), ('https://pa.com/2', 'Phone 2')),
+            'https://pa.com/apple/page/1': listing_page(('https://pa.com/2', 'Phone 2'), ('https://pa.com/3', 'Phone 3')),
+            'https://pa.com/apple/page/2': listing_page(('https://pa.com/4', 'Phone 4'))
+        }
+
+        def get(url):
+            response = MagicMock()
+            response.status_code = 200 if url in self.pages else 404
+            response.text = self.pages.get(url, '')
+            return response
+
+        self.session = MagicMock()
+        self.session.get.side_effect = lambda url, **kwargs: get(url)
+        set_fetcher(Fetcher(session=self.session))
+
+    def test_scrape_devices(self):
+        '''Test that devices across pages are de-duplicated by url, in page order'''
+        devices = self.manufacturer.scrape_devices(pages=4, workers=4)
+        self.assertEqual(self.session.get.call_count, 4)
+        self.assertEqual([d['url'] for d in devices], [
+                         'https://pa.com/1', 'https://pa.com/2', 'https://pa.com/3', 'https://pa.com/4'])
+        self.assertEqual(devices[0], {
+                         'name': 'Phone 1', 'url': 'https://pa.com/1', 'manuf_id': 1})
+
+    def test_scrape_devices_page_count(self):
+        '''Test that only the configured number of pages are fetched'''
+        devices = self.manufacturer.scrape_devices(pages=1)
+        self.assertEqual(self.session.get.call_count, 1)
+        self.assertEqual(self.session.get.call_args[0], ('https://pa.com/apple',))
+        self.assertEqual(len(devices), 2)
+
+    def tearDown(self):
+        set_fetcher(None)
+
+
 class DeviceTestCase(TestCase):
     '''Device Test Case'''
 
@@ -91,6 +168,23 @@ class DeviceTestCase(TestCase):
         self.assertEqual(devices[0].manufacturer.name, 'Apple')
         self.assertEqual(devices[0].rating, None)
 
+    def test_get_unmatched_name(self):
+        '''Test that a name matching no device doesn't narrow the results'''
+        all_devices = Device.get(limit=100)
+        self.assertEqual(Device.get(name='Invalid-Device',
+                                    limit=100), all_devices)
+        devices = Device.get(manufacturer='Invalid-Manufacturer',
+                             name='iPhone', limit=100)
+        self.assertEqual([d.name for d in devices], ['Apple iPhone 12'])
+
+    def test_get_latest_unmatched_name(self):
+        '''Test that get_latest drops filters on names matching nothing, in one query'''
+        with QueryCounter() as counter:
+            devices = Device.get_latest(manufacturer='Samsung',
+                                        name='Invalid-Device')
+        self.assertEqual(counter.count, 1)
+        self.assertEqual({d.manufacturer.name for d in devices}, {'Samsung'})
+
     def test_get_latest(self):
         devices = Device.get_latest()
         self.assertEqual(devices[0].name, 'Galaxy S21 Ultra')
@@ -99,6 +193,7 @@ class DeviceTestCase(TestCase):
         self.assertIsInstance(devices[0].release_date, datetime.date)
 
     def test_scrape_specs(self):
+        set_fetcher(DirectoryFetcher(FIXTURES))
         device = Device.query.get(1)
         device.scrape_specs()
         self.assertIsInstance(device.rating, float)
@@ -107,5 +202,346 @@ class DeviceTestCase(TestCase):
             'Oct 23, 2020', '%b %d, %Y').date())
         self.assertIsInstance(device.specs, list)
 
+    def test_scrape_specs_failure(self):
+        '''A device whose page can't be fetched is queued for retry'''
+        set_fetcher(DirectoryFetcher(FIXTURES))
+        device = Device.query.get(3)
+        device.scrape_specs()
+        failure = ScrapeFailure.query.filter_by(device_id=3).one()
+        self.assertEqual((failure.error_type, failure.http_status), ('http_error', 404))
+        self.assertEqual(device.scrape_status, Device.SCRAPE_FAILED)
+
+        device.scrape_specs()
+        self.assertEqual(ScrapeFailure.query.filter_by(device_id=3).one().attempts, 2)
+
+    def test_scrape_specs_unchanged(self):
+        '''A device with specs isn't rescraped if its page hasn't changed'''
+        fetcher = DirectoryFetcher(FIXTURES)
+        set_fetcher(fetcher)
+        device = Device.query.get(1)
+        device.scrape_specs()
+        specs = [spec.id for spec in device.specs]
+
+        fetcher.fetch = MagicMock(return_value=Page(device.url, '', False))
+        device.scrape_specs()
+        fetcher.fetch.assert_called_once_with(device.url, conditional=True)
+        db.session.expire(device)
+        self.assertEqual([spec.id for spec in device.specs], specs)
+
+    def tearDown(self):
+        set_fetcher(None)
+        db.session.rollback()
+
+
+class DeviceRefreshTestCase(TestCase):
+    '''Device crawl metadata Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+
+    def test_update_content_hash(self):
+        '''Only reports specs as changed when their hash changes'''
+        device = Device.query.get(1)
+        specs = [{'category': 'Display', 'name': 'Size', 'description': '6.1'}]
+        self.assertTrue(device.update_content_hash(specs))
+        self.assertFalse(device.update_content_hash(list(specs)))
+        self.assertTrue(device.update_content_hash(
+            [{'category': 'Display', 'name': 'Size', 'description': '6.2'}]))
+
+    def test_update_content_hash_details(self):
+        '''Reports a new rating, image or release date as a change, with the same specs'''
+        device = Device.query.get(1)
+        device.update_content_hash([])
+        for name, value in (('rating', 9.1), ('image', 'https://a.com/new.jpg'),
+                            ('release_date', datetime.date(2021, 1, 1))):
+            setattr(device, name, value)
+            self.assertTrue(device.update_content_hash([]))
+            self.assertFalse(device.update_content_hash([]))
+
+    def test_refresh_candidates(self):
+        '''Unreleased devices come first, then unscraped, then stale devices'''
+        now = datetime.datetime.utcnow()
+        galaxy, pixel, iphone = (Device.query.get(2), Device.query.get(3), Device.query.get(1))
+        iphone.last_fetched = now - datetime.timedelta(days=30)
+        galaxy.last_fetched = now - datetime.timedelta(days=2)
+        galaxy.release_date = datetime.date(datetime.date.today().year + 5, 12, 31)
+        self.assertEqual([d.id for d in Device.refresh_candidates()], [2, 3, 1])
+
+        # Recently fetched devices aren't due, even when unreleased
+        galaxy.last_fetched = now
+        pixel.mark_fetched(Device.SCRAPE_OK)
+        self.assertEqual([d.id for d in Device.refresh_candidates()], [1])
+        # Failed scrapes are left to the retry queue, however long ago they were
+        pixel.last_fetched = now - datetime.timedelta(days=40)
+        self.assertEqual([d.id for d in Device.refresh_candidates()], [3, 1])
+        pixel.scrape_status = Device.SCRAPE_FAILED
+        self.assertEqual([d.id for d in Device.refresh_candidates()], [1])
+        self.assertEqual(Device.refresh_candidates(limit=0), [])
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+class DeviceEagerLoadTestCase(TestCase):
+    '''Device eager loading Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+        for i in range(10):
+            device = Device(name=f'Eager Phone {i}', manufacturer_id=(i % 3) + 1,
+                            url=f'https://eager.com/{i}', release_date=datetime.date(2020, 1, i + 1))
+            db.session.add(device)
+            db.session.flush()
+            for j in range(3):
+                db.session.add(Spec(device_id=device.id, category='Display',
+                                    name=f'Spec {j}', description=f'{j}'))
+        db.session.commit()
+
+    def count_serialize_queries(self, method, limit):
+        '''Counts the queries needed to get and serialize a page of devices'''
+        db.session.expire_all()
+        with QueryCounter() as counter:
+            devices = method(limit=limit, eager=True)
+            serialized = [device.serialize() for device in devices]
+        self.assertEqual(len(serialized), limit)
+        return counter.count
+
+    def test_get_query_count_constant(self):
+        '''Test that serializing a page from get takes the same queries for any limit'''
+        small = self.count_serialize_queries(Device.get, 1)
+        large = self.count_serialize_queries(Device.get, 10)
+        self.assertEqual(small, large)
+        self.assertEqual(large, 3)
+
+    def test_get_latest_query_count_constant(self):
+        '''Test that serializing a page from get_latest takes the same queries for any limit'''
+        small = self.count_serialize_queries(Device.get_latest, 1)
+        large = self.count_serialize_queries(Device.get_latest, 10)
+        self.assertEqual(small, large)
+        self.assertEqual(large, 3)
+
+    def test_eager_serialize_matches_lazy(self):
+        '''Test that eager loading serializes the same as lazy loading'''
+        db.session.expire_all()
+        lazy = [d.serialize() for d in Device.get_latest(limit=10)]
+        db.session.expire_all()
+        eager = [d.serialize()
+                 for d in Device.get_latest(limit=10, eager=True)]
+        self.assertEqual(lazy, eager)
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+class DeviceProjectionTestCase(TestCase):
+    '''Device field projection Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+        Spec.replace_all({1: [{'category': 'Display', 'name': 'Size', 'description': '6.1 inches'},
+                              {'category': 'Battery', 'name': 'Capacity', 'description': '2815 mAh'}]})
+
+    def test_project(self):
+        '''Returns rows of only the fields asked for, in one query'''
+        with QueryCounter() as counter:
+            rows = Device.get_latest(fields=('manufacturer', 'name'))
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(len(rows), 3)
+        self.assertNotIsInstance(rows[0], Device)
+        self.assertEqual(Device.serialize_rows(rows, ('manufacturer', 'name'))[0],
+                         {'manufacturer': 'Samsung', 'name': 'Galaxy S21 Ultra'})
+
+    def test_project_with_manufacturer_filter(self):
+        '''Projecting the manufacturer doesn't clash with filtering by it'''
+        rows = Device.get(manufacturer='Samsung', fields=('manufacturer',))
+        self.assertEqual([row.manufacturer for row in rows], ['Samsung'])
+
+    def test_serialize_rows_matches_serialize(self):
+        '''Rows with every field serialize the same as Devices, specs in one more query'''
+        rows = Device.get(fields=DEVICE_FIELDS)
+        with QueryCounter() as counter:
+            serialized = Device.serialize_rows(rows, DEVICE_FIELDS)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(serialized, [device.serialize()
+                                      for device in Device.get(eager=True)])
+
+    def test_row_cursor(self):
+        '''Rows make the same cursors as their Devices'''
+        row = Device.get_latest(fields=('name',))[0]
+        device = Device.get_latest()[0]
+        self.assertEqual(Device.cursor(row, latest=True),
+                         device.cursor(latest=True))
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+class SpecReplaceAllTestCase(TestCase):
+    '''Spec.replace_all Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+
+    def setUp(self):
+        self.specs = [
+            {'category': 'Display', 'name': 'Size', 'description': '6.1'},
+            {'category': 'Battery', 'name': 'Capacity', 'description': '2815 mAh'}
+        ]
+
+    def test_replace_all(self):
+        '''Test that replacing specs twice does not duplicate them'''
+        Spec.replace_all({1: self.specs, 2: self.specs[:1]})
+        Spec.replace_all({1: self.specs})
+        self.assertEqual(Spec.query.filter_by(device_id=1).count(), 2)
+        self.assertEqual(Spec.query.filter_by(device_id=2).count(), 1)
+        self.assertEqual(Device.query.get(1).serialize_specs(), {
+            'Display': [{'name': 'Size', 'description': '6.1'}],
+            'Battery': [{'name': 'Capacity', 'description': '2815 mAh'}]
+        })
+
+    def test_replace_all_single_transaction(self):
+        '''Test that replacing specs for many devices takes one delete and one insert'''
+        with QueryCounter() as counter:
+            Spec.replace_all({1: self.specs, 2: self.specs, 3: self.specs})
+        self.assertEqual(counter.count, 2)
+        self.assertEqual(Spec.query.filter(
+            Spec.device_id.in_([1, 2, 3])).count(), 6)
+
+    def test_replace_all_atomic(self):
+        '''Test that a failed replace keeps the existing specs'''
+        Spec.replace_all({1: self.specs})
+        with self.assertRaises(Exception):
+            Spec.replace_all({1: [{'category': 'Display', 'name': 'Size'}]})
+        self.assertEqual(Spec.query.filter_by(device_id=1).count(), 2)
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+class SpecValueTestCase(TestCase):
+    '''Numeric spec filter and sort Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+        Spec.replace_all({
+            1: [{'category': 'Display', 'name': 'Size', 'description': '6.1'},
+                {'category': 'Battery', 'name': 'Capacity', 'description': '2815 mAh'}],
+            2: [{'category': 'Display', 'name': 'Size', 'description': '6.8'},
+                {'category': 'Battery', 'name': 'Capacity', 'description': '5000 mAh'}],
+            3: [{'category': 'Display', 'name': 'Technology', 'description': 'OLED'}]
+        })
+
+    def test_replace_all_values(self):
+        '''Test that numeric specs are stored with their value and unit'''
+        spec = Spec.query.filter_by(device_id=2, key='battery_capacity').one()
+        self.assertEqual((spec.value, spec.unit), (5000.0, 'mAh'))
+        spec = Spec.query.filter_by(device_id=3).one()
+        self.assertIsNone(spec.key)
+
+    def test_filter_specs(self):
+        '''Test that devices are filtered by every spec filter'''
+        devices = Device.get(specs=[('battery_capacity', 'gte', 5000)])
+        self.assertEqual([device.id for device in devices], [2])
+        devices = Device.get_latest(
+            specs=[('display_size', 'gte', 6), ('display_size', 'lte', 6.5)])
+        self.assertEqual([device.id for device in devices], [1])
+
+    def test_sort_by_spec(self):
+        '''Test that devices are sorted by a spec, devices without it last'''
+        devices = Device.get(sort_by=('display_size', True))
+        self.assertEqual([device.id for device in devices], [2, 1, 3])
+        devices = Device.get_latest(manufacturer='a', sort_by=('display_size', False))
+        self.assertEqual([device.id for device in devices], [1, 2])
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+def explain(query) -> str:
+    '''Returns the query plan for query with sequential scans disabled'''
+    # The seeded tables are tiny, so the planner would otherwise always scan them
+    db.session.execute('SET LOCAL enable_seqscan = off')
+    sql = query.statement.compile(dialect=db.engine.dialect,
+                                  compile_kwargs={'literal_binds': True})
+    return '\n'.join(row[0] for row in db.session.execute(f'EXPLAIN {sql}'))
+
+
+class DeviceQueryIndexTestCase(TestCase):
+    '''Device.filtered index Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+
+    def test_released_compares_column(self):
+        '''is_released compares release_date without wrapping it in a function'''
+        sql = str(Device.filtered(is_released=True).statement)
+        self.assertIn('devices.release_date <', sql)
+        self.assertNotIn('date(devices.release_date)', sql)
+
+    def test_latest_order_uses_index(self):
+        '''The latest devices are read in order from the release date index'''
+        plan = explain(Device.filtered().order_by(
+            nullslast(Device.release_date.desc()), Device.id).limit(10))
+        self.assertIn('ix_devices_release_date_id', plan)
+
+    def test_manufacturer_uses_index(self):
+        '''Devices are joined to their manufacturer through the manufacturer_id index'''
+        plan = explain(Device.query.filter(Device.manufacturer_id == 1))
+        self.assertIn('ix_devices_manufacturer_id', plan)
+
+    def test_filters_combine(self):
+        '''Only the filters given are applied, and they all apply together'''
+        self.assertEqual(Device.filtered().count(), 3)
+        self.assertEqual([d.name for d in Device.filtered(manufacturer='sam', name='ultra')],
+                         ['Galaxy S21 Ultra'])
+        self.assertEqual(Device.filtered(manufacturer='sam', exact_manufacturer=True).count(), 0)
+        self.assertEqual(Device.filtered(manufacturer='samsung', exact_manufacturer=True).count(), 1)
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+def has_pg_trgm() -> bool:
+    return db.session.execute(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").scalar() is not None
+
+
+class NameSearchIndexTestCase(TestCase):
+    '''Trigram name index Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        if not has_pg_trgm():
+            raise SkipTest('pg_trgm is not available')
+        seed_db()
+
+    def assertUsesIndex(self, query, index: str):
+        '''Asserts query's plan reads through index, not a scan of a whole table'''
+        # The primary keys could otherwise serve the ordered pages, filtering every row
+        db.session.execute('SET LOCAL enable_indexscan = off')
+        plan = explain(query)
+        self.assertIn(index, plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_device_name_uses_index(self):
+        '''The name filter of get-devices is served by the trigram index'''
+        self.assertUsesIndex(Device.list_query(name='iPhone'), 'ix_devices_name_trgm')
+
+    def test_latest_manufacturer_uses_index(self):
+        '''The manufacturer filter of get-latest-devices is served by the trigram index'''
+        self.assertUsesIndex(Device.latest_query(manufacturer='Sams'),
+                             'ix_manufacturers_name_trgm')
+
+    def test_manufacturer_name_uses_index(self):
+        '''The name filter of get-manufacturers is served by the trigram index'''
+        self.assertUsesIndex(Manufacturer.list_query(manufacturer='Apple'),
+                             'ix_manufacturers_name_trgm')
+
     def tearDown(self):
         db.session.rollback()
@@ -0,0 +1,90 @@
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+from bs4 import BeautifulSoup as bsoup
+import datetime
+import os
+from api import parsing
+from api.parsing import parse_device_page, parse_device_listing, parse_manufacturer_info, parse_specs
+
+PAGES = os.path.join(os.path.dirname(__file__), 'fixtures',
+                     'phonearena', 'www.phonearena.com', 'phones')
+
+try:
+    import lxml
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+
+def read_page(*path):
+    with open(os.path.join(PAGES, *path), encoding='utf-8') as page:
+        return page.read()
+
+
+class ParseDevicePageTestCase(TestCase):
+    '''parse_device_page Test Case'''
+
+    def test_parse_device_page(self):
+        '''Parses the rating, image, release date and specs in one pass'''
+        details = parse_device_page(read_page('Apple-iPhone-12_id11417.html'))
+        self.assertEqual(details['rating'], 8.4)
+        self.assertEqual(
+            details['image'], 'https://i-cdn.phonearena.com/images/phones/76958-350/Apple-iPhone-12.jpg')
+        self.assertEqual(details['release_date'], datetime.date(2020, 10, 23))
+        self.assertEqual(details['specs'][0], {
+                         'category': 'Display', 'name': 'Size', 'description': '6.1'})
+        self.assertEqual(len(details['specs']), 13)
+
+    def test_unreleased_no_image(self):
+        '''Sets unreleased devices' release date to the placeholder year'''
+        details = parse_device_page(
+            read_page('Samsung-Galaxy-S21-Ultra_id11646.html'))
+        self.assertIsNone(details['image'])
+        self.assertEqual(details['release_date'], datetime.date(
+            datetime.date.today().year + parsing.UNRELEASED_YEAR, 12, 31))
+
+    def test_empty_page(self):
+        '''Returns no details for a page without any widgets'''
+        self.assertEqual(parse_device_page('<html></html>'), {
+            'rating': None, 'image': None, 'release_date': None, 'specs': None})
+
+    def test_matches_full_parse(self):
+        '''Narrowing the page gives the same details as parsing all of it'''
+        for name in ('Apple-iPhone-12_id11417.html', 'Apple-iPhone-12-mini_id11418.html'):
+            html = read_page(name)
+            page = bsoup(html, 'html.parser')
+            details = parse_device_page(html)
+            self.assertEqual(details['rating'], parsing.parse_rating(page))
+            self.assertEqual(details['image'], parsing.parse_image(page))
+            self.assertEqual(details['specs'], parse_specs(page))
+
+    @skipUnless(HAS_LXML, 'lxml is not installed')
+    def test_parsers_agree(self):
+        '''lxml and html.parser give the same details'''
+        html = read_page('Apple-iPhone-12_id11417.html')
+        with patch('api.parsing.PARSER', 'html.parser'):
+            expected = parse_device_page(html)
+        with patch('api.parsing.PARSER', 'lxml'):
+            self.assertEqual(parse_device_page(html), expected)
+
+
+class ParseListingTestCase(TestCase):
+    '''parse_device_listing & parse_manufacturer_info Test Case'''
+
+    def test_parse_device_listing(self):
+        '''Parses the url and name of every listed device'''
+        devices = parse_device_listing(
+            read_page('manufacturers', 'Apple.html'))
+        self.assertEqual(devices, [
+            ('https://www.phonearena.com/phones/Apple-iPhone-12_id11417', 'Apple iPhone 12'),
+            ('https://www.phonearena.com/phones/Apple-iPhone-12-mini_id11418',
+             'Apple iPhone 12 mini')
+        ])
+        self.assertEqual(parse_device_listing('<html></html>'), [])
+
+    def test_parse_manufacturer_info(self):
+        '''Parses the name, url and image of every manufacturer'''
+        info = parse_manufacturer_info(read_page('manufacturers.html'))
+        self.assertEqual([m['name'] for m in info], ['Apple', 'Samsung'])
+        self.assertEqual(
+            info[0]['url'], 'https://www.phonearena.com/phones/manufacturers/Apple')
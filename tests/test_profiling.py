@@ -0,0 +1,109 @@
+from unittest import TestCase
+from api.models import APIKey
+from api.cache import response_cache
+from app.profiling import Metrics, metrics
+from app.database import TimedQueuePool
+from api.config import DB_POOL_SIZE, DB_STATEMENT_TIMEOUT
+from tests.setup_tests import app, db, seed_db
+import re
+import run  # registers the app's routes
+
+
+class ProfilingTestCase(TestCase):
+    '''Request profiling Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+        cls.key = APIKey.generate_and_create().key
+
+    def setUp(self):
+        self.client = app.test_client()
+        app.config['PROFILING'] = True
+        metrics.reset()
+        response_cache.clear()
+        # Cached, so the key isn't counted as one of the request's queries
+        APIKey.validate(self.key)
+
+    def test_server_timing(self):
+        '''Responses report their wall, SQL and serialization time'''
+        response = self.client.get(
+            '/api/get-devices', query_string={'key': self.key})
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'app;dur=[\d.]+')
+        self.assertRegex(timing, r'serialize;dur=[\d.]+')
+        # The devices, their manufacturers and their specs
+        self.assertIn('db;dur=', timing)
+        self.assertEqual(re.search(r'"(\d+) queries"', timing).group(1), '3')
+
+    def test_metrics(self):
+        '''/metrics totals requests, queries and bytes per endpoint'''
+        for _ in range(2):
+            response = self.client.get(
+                '/api/get-devices', query_string={'key': self.key})
+        body = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn(
+            'grabaphone_requests_total{endpoint="get_devices",method="GET",status="200"} 2', body)
+        self.assertIn(
+            'grabaphone_request_duration_seconds_count{endpoint="get_devices"} 2', body)
+        # The second request is served from the response cache
+        self.assertIn('grabaphone_sql_queries_total{endpoint="get_devices"} 3', body)
+        self.assertIn(
+            f'grabaphone_response_bytes_total{{endpoint="get_devices"}} {2 * len(response.get_data())}', body)
+
+    def test_pool_checkouts(self):
+        '''Pool checkout waits are timed per request and in /metrics'''
+        response = self.client.get(
+            '/api/get-devices', query_string={'key': self.key})
+        self.assertRegex(response.headers['Server-Timing'], r'pool;dur=[\d.]+')
+        body = self.client.get('/metrics').get_data(as_text=True)
+        count = re.search(r'grabaphone_pool_checkout_seconds_count (\d+)', body)
+        self.assertGreaterEqual(int(count.group(1)), 1)
+        self.assertIn('grabaphone_pool_checkout_timeouts_total 0', body)
+
+    def test_disabled(self):
+        '''Nothing is recorded or served when profiling is off'''
+        app.config['PROFILING'] = False
+        response = self.client.get(
+            '/api/get-devices', query_string={'key': self.key})
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(metrics.requests, {})
+
+    def tearDown(self):
+        app.config['PROFILING'] = False
+
+
+class EngineOptionsTestCase(TestCase):
+    '''Engine pool and timeout settings Test Case'''
+
+    def test_pool(self):
+        '''The engine uses the timed pool sized from the config'''
+        self.assertIsInstance(db.engine.pool, TimedQueuePool)
+        self.assertEqual(db.engine.pool.size(), DB_POOL_SIZE)
+        self.assertTrue(db.engine.pool._pre_ping)
+
+    def test_statement_timeout(self):
+        '''Connections are opened with the statement timeout'''
+        timeout = db.session.execute('SHOW statement_timeout').scalar()
+        db.session.rollback()
+        self.assertEqual(timeout, f'{DB_STATEMENT_TIMEOUT // 1000}s')
+
+
+class MetricsTestCase(TestCase):
+    '''Metrics Test Case'''
+
+    def test_histogram(self):
+        '''Requests are counted in every bucket at least as long as they took'''
+        registry = Metrics()
+        profile = {'duration': 0.03, 'queries': 2,
+                   'db': 0.01, 'serialize': 0.005, 'bytes': 100}
+        registry.observe('get_devices', 'GET', 200, profile)
+        body = registry.render()
+        self.assertIn(
+            'grabaphone_request_duration_seconds_bucket{endpoint="get_devices",le="0.025"} 0', body)
+        self.assertIn(
+            'grabaphone_request_duration_seconds_bucket{endpoint="get_devices",le="0.05"} 1', body)
+        self.assertIn(
+            'grabaphone_request_duration_seconds_bucket{endpoint="get_devices",le="+Inf"} 1', body)
+        self.assertIn('grabaphone_sql_seconds_total{endpoint="get_devices"} 0.010000', body)
@@ -0,0 +1,160 @@
+from unittest import TestCase
+from unittest.mock import patch
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from threading import Event
+from sqlalchemy.exc import OperationalError
+from api.models import APIKey
+from api.ratelimit import MemoryStore, SQLiteStore, RateLimiter, UsageCounter, rate_limiter, usage, take_token
+from tests.setup_tests import app, db, seed_db
+from app.profiling import QueryCounter
+import os
+import sqlite3
+import run  # registers the app's routes
+
+
+class TokenBucketTestCase(TestCase):
+    '''Token bucket stores Test Case'''
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'buckets.sqlite3')
+
+    def test_take_token(self):
+        '''New buckets start full, and refill at rate up to burst'''
+        self.assertEqual(take_token(None, 1, 3, 100), (2, 0))
+        self.assertEqual(take_token((0, 100), 2, 3, 101), (1, 0))
+        self.assertEqual(take_token((1, 100), 2, 3, 200), (2, 0))
+        tokens, wait = take_token((0.5, 100), 2, 3, 100)
+        self.assertEqual(wait, 0.25)
+
+    def assertLimits(self, store):
+        '''Asserts store allows a burst then makes key wait, per key'''
+        waits = [store.take('key', 1, 3, 100) for _ in range(4)]
+        self.assertEqual(waits, [0, 0, 0, 1])
+        self.assertEqual(store.take('other', 1, 3, 100), 0)
+        self.assertEqual(store.take('key', 1, 3, 101), 0)
+
+    def test_memory_store(self):
+        '''MemoryStore keeps a bucket per key'''
+        self.assertLimits(MemoryStore())
+
+    def test_sqlite_store(self):
+        '''SQLiteStore keeps a bucket per key, shared by every opener of its path'''
+        self.assertLimits(SQLiteStore(self.path))
+        # Another worker's store sees the same empty bucket
+        self.assertEqual(SQLiteStore(self.path).take('key', 1, 3, 101), 1)
+
+    def test_sqlite_store_fails_open(self):
+        '''SQLiteStore lets requests through while it's locked or can't be opened'''
+        store = SQLiteStore(self.path, timeout=0.01)
+        store.take('key', 1, 1, 100)
+        locker = sqlite3.connect(self.path, isolation_level=None)
+        locker.execute('BEGIN EXCLUSIVE')
+        try:
+            self.assertEqual(store.take('key', 1, 1, 100), 0)
+        finally:
+            locker.execute('ROLLBACK')
+            locker.close()
+        self.assertEqual(store.take('key', 1, 1, 100), 1)
+        missing = SQLiteStore(os.path.join(self.path, 'missing', 'buckets.sqlite3'))
+        self.assertEqual(missing.take('key', 1, 1, 100), 0)
+
+    def test_disabled(self):
+        '''A rate of 0 allows every request'''
+        limiter = RateLimiter(MemoryStore(), rate=0, burst=1)
+        self.assertEqual([limiter.check('key') for _ in range(3)], [0, 0, 0])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class UsageCounterTestCase(TestCase):
+    '''UsageCounter Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+        cls.keys = [APIKey.generate_and_create().key for _ in range(2)]
+
+    def test_flush_in_batches(self):
+        '''Counts requests in memory and adds them to the DB in one statement'''
+        counter = UsageCounter(flush_size=3, flush_interval=60)
+        self.assertFalse(counter.record(self.keys[0]))
+        self.assertFalse(counter.record(self.keys[0]))
+        self.assertTrue(counter.record(self.keys[1]))
+        with QueryCounter() as queries:
+            counter.flush()
+        self.assertEqual(queries.count, 1)
+        self.assertEqual(counter.pending, 0)
+
+        first, second = [APIKey.query.filter_by(key=key).one() for key in self.keys]
+        self.assertEqual((first.request_count, second.request_count), (2, 1))
+        self.assertLessEqual(first.last_used, datetime.utcnow())
+
+    def test_flush_interval(self):
+        '''Asks for a flush once flush_interval has passed'''
+        counter = UsageCounter(flush_size=100, flush_interval=0)
+        self.assertTrue(counter.record(self.keys[0]))
+
+    def test_flush_in_background(self):
+        '''Flushes in a thread, one at a time'''
+        counter = UsageCounter(flush_size=1, flush_interval=60)
+        counter.record(self.keys[1])
+        written = Event()
+        with patch.object(APIKey, 'add_usage', side_effect=lambda usage: written.wait(5)) as add_usage:
+            thread = counter.flush_in_background()
+            self.assertIsNone(counter.flush_in_background())
+            written.set()
+            thread.join()
+        add_usage.assert_called_once()
+        self.assertEqual(counter.pending, 0)
+
+    def test_failed_flush(self):
+        '''Keeps the counts for the next flush if the DB can't be written'''
+        counter = UsageCounter(flush_size=100, flush_interval=60)
+        counter.record(self.keys[0])
+        with patch.object(APIKey, 'add_usage', side_effect=OperationalError('', {}, None)):
+            counter.flush()
+        self.assertEqual(counter.pending, 1)
+        counter.record(self.keys[0])
+        with patch.object(APIKey, 'add_usage') as add_usage:
+            counter.flush()
+        self.assertEqual(add_usage.call_args[0][0][self.keys[0]][0], 2)
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+class RateLimitedRoutesTestCase(TestCase):
+    '''Rate limited routes Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.key = APIKey.generate_and_create().key
+
+    def test_rate_limit(self):
+        '''Responds 429 with Retry-After once a key's burst is used up'''
+        with patch.object(rate_limiter, 'rate', 0.5), patch.object(rate_limiter, 'burst', 2):
+            statuses = [self.client.get('/api/get-manufacturers', query_string={'key': self.key}).status_code
+                        for _ in range(3)]
+            response = self.client.get('/api/get-devices', query_string={'key': self.key})
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.get_json()['message'], 'Rate limit exceeded!')
+        self.assertEqual(response.headers['Retry-After'], '2')
+
+    def test_usage(self):
+        '''Counts the key's served requests'''
+        usage.flush()
+        for _ in range(2):
+            self.client.get('/api/get-manufacturers', query_string={'key': self.key})
+        usage.flush()
+        self.assertEqual(APIKey.query.filter_by(key=self.key).one().request_count, 2)
+
+    def tearDown(self):
+        db.session.rollback()
@@ -0,0 +1,83 @@
+from unittest import TestCase
+from flask import g
+from sqlalchemy import event
+from api.models import APIKey, Manufacturer
+from api.cache import response_cache
+from app.database import RoutingSession, REPLICA
+from tests.setup_tests import app, db, seed_db
+import run  # registers the app's routes
+
+
+class ReplicaRoutingTestCase(TestCase):
+    '''Read replica routing Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        # The test database stands in for the replica, on its own engine
+        app.config['SQLALCHEMY_BINDS'] = {
+            REPLICA: app.config['SQLALCHEMY_DATABASE_URI']}
+        seed_db()
+        cls.key = APIKey.generate_and_create().key
+        cls.replica = db.get_engine(app, bind=REPLICA)
+
+    def setUp(self):
+        self.client = app.test_client()
+        response_cache.clear()
+        RoutingSession.last_write = float('-inf')
+        self.queries = {'primary': 0, 'replica': 0}
+        event.listen(db.engine, 'before_cursor_execute', self.on_primary)
+        event.listen(self.replica, 'before_cursor_execute', self.on_replica)
+
+    def on_primary(self, *args):
+        self.queries['primary'] += 1
+
+    def on_replica(self, *args):
+        self.queries['replica'] += 1
+
+    def get_devices(self):
+        response = self.client.get('/api/get-devices', query_string={'key': self.key})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_get_route_reads_replica(self):
+        '''GET routes query the replica, checking the key on the primary'''
+        APIKey.cache.clear()
+        self.assertTrue(self.get_devices()['Devices'])
+        self.assertGreater(self.queries['replica'], 0)
+        self.assertEqual(self.queries['primary'], 1)
+
+    def test_reads_primary_after_write(self):
+        '''Reads go to the primary for REPLICA_STALENESS seconds after a commit'''
+        db.session.add(Manufacturer(name='Nokia', url='https://nokia.com'))
+        db.session.commit()
+        self.get_devices()
+        self.assertEqual(self.queries['replica'], 0)
+        self.assertGreater(self.queries['primary'], 0)
+
+    def test_reads_primary_in_write_transaction(self):
+        '''Queries after a flush stay on the primary until the transaction ends'''
+        with app.test_request_context():
+            g.read_replica = True
+            db.session.add(Manufacturer(name='Sony', url='https://sony.com'))
+            db.session.flush()
+            self.assertTrue(Manufacturer.query.filter_by(name='Sony').first())
+            self.assertEqual(self.queries['replica'], 0)
+            db.session.rollback()
+            Manufacturer.query.all()
+            self.assertGreater(self.queries['replica'], 0)
+
+    def test_unmarked_queries_use_primary(self):
+        '''Queries outside read_replica routes use the primary'''
+        Manufacturer.query.all()
+        self.assertEqual(self.queries['replica'], 0)
+
+    def tearDown(self):
+        db.session.rollback()
+        event.remove(db.engine, 'before_cursor_execute', self.on_primary)
+        event.remove(self.replica, 'before_cursor_execute', self.on_replica)
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session.remove()
+        del app.config['SQLALCHEMY_BINDS']
+        cls.replica.dispose()
@@ -0,0 +1,222 @@
+from unittest import TestCase
+from unittest.mock import patch
+from api.models import APIKey, Device, Spec
+from api.cache import response_cache
+from tests.setup_tests import app, db, seed_db
+from app.profiling import QueryCounter
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+import datetime
+import gzip
+import json
+import run  # registers the app's routes
+
+
+class GetRoutesTestCase(TestCase):
+    '''GET routes Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+        # Devices sharing release dates, so pages have to break ties by id
+        for i in range(7):
+            db.session.add(Device(name=f'Paged Phone {i}', manufacturer_id=(i % 3) + 1,
+                                  url=f'https://paged.com/{i}', release_date=datetime.date(2020, 1, (i % 2) + 1)))
+        db.session.commit()
+        cls.key = APIKey.generate_and_create().key
+
+    def setUp(self):
+        self.client = app.test_client()
+        response_cache.clear()
+
+    def get(self, route: str, **params):
+        response = self.client.get(route, query_string={'key': self.key, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def walk(self, route: str, results_key: str, limit: int = 2, **filters) -> list:
+        '''Walks every page of route with cursors, returning all the ids'''
+        ids = []
+        cursor = None
+        while True:
+            params = {'limit': limit, **filters}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.get(route, **params)
+            ids.extend(row['id'] for row in data[results_key])
+            cursor = data['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_invalid_key(self):
+        '''Responds 401 without a valid API key'''
+        response = self.client.get(
+            '/api/get-devices', query_string={'key': 'invalid'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_get_devices_cursor(self):
+        '''Walking get-devices with cursors returns every device once, in order'''
+        expected = [d['id'] for d in self.get(
+            '/api/get-devices', limit=100)['Devices']]
+        self.assertEqual(self.walk('/api/get-devices', 'Devices'), expected)
+
+    def test_get_latest_devices_cursor(self):
+        '''Walking get-latest-devices with cursors matches the unpaged order'''
+        expected = [d['id'] for d in self.get(
+            '/api/get-latest-devices', limit=100)['Devices']]
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(self.walk(
+            '/api/get-latest-devices', 'Devices', limit=3), expected)
+
+    def test_get_manufacturers_cursor(self):
+        '''Walking get-manufacturers with cursors returns every manufacturer'''
+        self.assertEqual(self.walk(
+            '/api/get-manufacturers', 'Manufacturers'), [1, 2, 3])
+
+    def test_last_page_has_no_cursor(self):
+        '''The last page has no next_cursor'''
+        data = self.get('/api/get-manufacturers', limit=100)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_cached_response(self):
+        '''Repeat requests are served from the response cache'''
+        first = self.client.get('/api/get-latest-devices',
+                                query_string={'key': self.key, 'name': 'Paged'})
+        with QueryCounter() as counter:
+            second = self.client.get('/api/get-latest-devices',
+                                     query_string={'key': self.key, 'name': 'Paged'})
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_filters_cached_separately(self):
+        '''Different filters and routes get different cached responses'''
+        paged = self.get('/api/get-devices', name='Paged')
+        pixel = self.get('/api/get-devices', name='Pixel')
+        self.assertNotEqual(paged, pixel)
+        self.assertNotEqual(self.get('/api/get-latest-devices', name='Pixel'),
+                            self.get('/api/get-manufacturers'))
+
+    def test_if_none_match(self):
+        '''Responds 304 without a body when the ETag still matches'''
+        response = self.client.get(
+            '/api/get-manufacturers', query_string={'key': self.key})
+        etag = response.headers['ETag']
+        response = self.client.get('/api/get-manufacturers', query_string={'key': self.key},
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+
+    def test_create_invalidates(self):
+        '''Creating a device clears cached responses'''
+        before = self.get('/api/get-devices', name='Fresh')
+        Device.create(name='Fresh Phone', manufacturer_id=1,
+                      url='https://fresh.com')
+        after = self.get('/api/get-devices', name='Fresh')
+        self.assertNotEqual(before, after)
+        self.assertEqual(after['Devices'][0]['name'], 'Fresh Phone')
+        db.session.delete(Device.query.filter_by(name='Fresh Phone').one())
+        db.session.commit()
+
+    def test_get_devices_by_id(self):
+        '''Returns devices in the order requested, listing missing ids'''
+        data = self.get('/api/get-devices-by-id', ids='3,999,1,3')
+        self.assertEqual([d['id'] for d in data['Devices']], [3, 1])
+        self.assertEqual(data['Devices'][1]['name'], 'Apple iPhone 12')
+        self.assertEqual(data['missing'], [999])
+
+    def test_get_devices_by_id_invalid(self):
+        '''Responds 400 for missing or invalid ids'''
+        for ids in ('', '1,two'):
+            response = self.client.get('/api/get-devices-by-id',
+                                       query_string={'key': self.key, 'ids': ids})
+            self.assertEqual(response.status_code, 400)
+
+    def test_get_devices_by_id_cap(self):
+        '''Responds 400 for more ids than the configured cap'''
+        with patch('api.views.MAX_IDS_PER_REQUEST', 2):
+            response = self.client.get('/api/get-devices-by-id',
+                                       query_string={'key': self.key, 'ids': '1,2,3'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_devices_specs(self):
+        '''Filters and sorts devices by numeric specs, paging by offset'''
+        Spec.replace_all({
+            1: [{'category': 'Battery', 'name': 'Capacity', 'description': '2815 mAh'}],
+            2: [{'category': 'Battery', 'name': 'Capacity', 'description': '5000 mAh'}]
+        })
+        data = self.get('/api/get-devices', specs='battery_capacity:gte:3000')
+        self.assertEqual([d['id'] for d in data['Devices']], [2])
+        data = self.get('/api/get-latest-devices',
+                        sort_by='-battery_capacity', limit=2)
+        self.assertEqual([d['id'] for d in data['Devices']], [2, 1])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_devices_fields(self):
+        '''fields returns only the fields asked for, paging the same'''
+        data = self.get('/api/get-devices', fields='release_date,name', limit=1)
+        self.assertEqual(set(data['Devices'][0]), {'name', 'release_date'})
+        self.assertIsNotNone(data['next_cursor'])
+        expected = [d['id'] for d in self.get(
+            '/api/get-latest-devices', limit=100)['Devices']]
+        self.assertEqual(self.walk('/api/get-latest-devices', 'Devices',
+                                   limit=3, fields='id'), expected)
+
+    def test_get_devices_fields_specs(self):
+        '''Specs are only returned when asked for, as in the full response'''
+        full = self.get('/api/get-devices')['Devices']
+        data = self.get('/api/get-devices', fields='id,specs')['Devices']
+        self.assertEqual(data, [{'id': d['id'], 'specs': d['specs']}
+                                for d in full])
+        # Unknown fields are ignored, returning every field
+        self.assertEqual(self.get('/api/get-devices', fields='price')['Devices'], full)
+
+    def test_statement_timeout(self):
+        '''Responds 503 instead of waiting on a statement past its timeout'''
+        def slow_query(**filters):
+            db.session.execute('SET LOCAL statement_timeout = 10')
+            db.session.execute('SELECT pg_sleep(1)')
+        with patch.object(Device, 'get', side_effect=slow_query):
+            response = self.client.get('/api/get-devices', query_string={'key': self.key})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['message'], 'Request timed out!')
+        self.assertEqual(response.headers['Retry-After'], '1')
+        # The session is usable again afterwards
+        self.assertEqual(self.client.get('/api/get-devices', query_string={
+                         'key': self.key}).status_code, 200)
+
+    def test_pool_timeout(self):
+        '''Responds 503 when no pooled connection frees up in time'''
+        with patch.object(Device, 'get', side_effect=PoolTimeoutError('QueuePool limit reached')):
+            response = self.client.get('/api/get-devices', query_string={'key': self.key})
+        self.assertEqual(response.status_code, 503)
+
+    def test_export_devices(self):
+        '''Streams every device as one JSON object per line'''
+        response = self.client.get(
+            '/api/export-devices', query_string={'key': self.key})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        devices = [json.loads(line) for line in lines]
+        self.assertEqual([d['id'] for d in devices],
+                         sorted(d.id for d in Device.query.all()))
+        self.assertEqual(devices[0], Device.query.get(
+            devices[0]['id']).serialize())
+
+    def test_export_devices_gzip(self):
+        '''Gzips the export when the client accepts it'''
+        plain = self.client.get(
+            '/api/export-devices', query_string={'key': self.key})
+        with patch('api.views.EXPORT_BATCH_SIZE', 2):
+            zipped = self.client.get('/api/export-devices', query_string={'key': self.key},
+                                     headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(zipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(
+            zipped.get_data()), plain.get_data())
+        refused = self.client.get('/api/export-devices', query_string={'key': self.key},
+                                  headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+        self.assertNotIn('Content-Encoding', refused.headers)
+        self.assertEqual(refused.get_data(), plain.get_data())
+
+    def tearDown(self):
+        db.session.rollback()
@@ -0,0 +1,35 @@
+from unittest import TestCase
+from api.models import APIKey
+from api.cache import response_cache
+from tests.setup_tests import app, db, seed_db
+from app.profiling import QueryCounter
+import run  # registers the app's routes
+
+
+class PostRoutesTestCase(TestCase):
+    '''POST routes Test Case'''
+
+    @classmethod
+    def setUpClass(cls):
+        seed_db()
+        cls.key = APIKey.generate_and_create().key
+
+    def setUp(self):
+        self.client = app.test_client()
+        response_cache.clear()
+
+    def test_get_devices_by_id(self):
+        '''Looks up a JSON list of ids with a fixed number of queries'''
+        APIKey.validate(self.key)
+        with QueryCounter() as counter:
+            response = self.client.post('/api/get-devices-by-id',
+                                        json={'key': self.key, 'ids': [2, 1, 3, 42]})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([d['id'] for d in data['Devices']], [2, 1, 3])
+        self.assertEqual(data['missing'], [42])
+        # devices, then their manufacturers and specs
+        self.assertEqual(counter.count, 3)
+
+    def tearDown(self):
+        db.session.rollback()